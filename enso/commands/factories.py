@@ -52,65 +52,14 @@ __updated__ = "2017-02-23"
 # ----------------------------------------------------------------------------
 
 import logging
-import re
 from abc import ABCMeta, abstractmethod
 
-from enso.commands.suggestions import AutoCompletion, Suggestion
+from enso.commands.suggestions import (
+    AutoCompletion, Suggestion, nearnessBound)
 from enso.commands.interfaces import AbstractCommandFactory, CommandObject
+from enso.commands.postfixindex import (
+    MATCH_PREFIX, MATCH_SUBSTRING, MATCH_WORD_PREFIX, PostfixIndex)
 from enso import config
-from enso import clipboard
-
-
-# ----------------------------------------------------------------------------
-# Private Utility Functions
-# ----------------------------------------------------------------------------
-
-def _equivalizeChars(userText):
-    """
-    Returns a regular expression in which certain characters are
-    replaced with equivalent character sets, e.g., "2" by "[2@]".
-    """
-
-    # TODO: These appear to only be equivalent characters for US
-    # keyboard layouts.
-
-    EQUIVALENT_CHARS = {
-        "1": "1!",
-        "2": "2@",
-        "3": "3#",
-        "4": "4$",
-        "5": "5%",
-        "6": "6^",
-        "7": "7&",
-        "8": "8*",
-        "9": "9(",
-        "0": "0)",
-        "-": "-_",
-        "=": "=+",
-        ";": ":;",
-        "-": "-_",
-        "'": "'\"",
-    }
-
-    re_escape = re.escape
-
-    searchText = re_escape(userText)
-    for char in EQUIVALENT_CHARS.keys():
-        expr = "[%s]" % re_escape(EQUIVALENT_CHARS[char])
-        char = re_escape(char)
-        searchText = searchText.replace(char, expr)
-
-    # {{{searchText}}} is a pattern that may contain spaces.  To
-    # determine whether a string matches searchText, we want any
-    # number of spaces in the string to match a single space in
-    # searchText.  Therefore, we replace each space in searchText with
-    # a "multispace" match RE, i.e., a regular expression that will
-    # match one or more spaces.
-    space = re_escape(" ")
-    multiSpace = "[%s]+" % space
-    searchText = searchText.replace(space, multiSpace)
-
-    return searchText
 
 
 # ----------------------------------------------------------------------------
@@ -130,7 +79,7 @@ class GenericPrefixFactory(AbstractCommandFactory):
 
     __metaclass__ = ABCMeta
     override = (
-        'retrieveSuggestions', 'autoComplete', 'getCommandObj', 'getCommandList',
+        'retrieveSuggestions', 'retrieveTopSuggestions', 'hasSuggestions', 'autoComplete', 'getCommandObj', 'getCommandList',
         'update', 'HELP_TEXT', 'PREFIX')
 
     # The portion of the command expression that is common to all
@@ -149,6 +98,15 @@ class GenericPrefixFactory(AbstractCommandFactory):
     # not been displayed.
     DESCRIPTION_TEXT = None
 
+    # Whether the suggestions of this factory are the commands whose
+    # postfix contains the user text, as retrieveSuggestions() below
+    # finds them.  retrieveTopSuggestions() and hasSuggestions() then
+    # search the postfix index directly instead of going through
+    # retrieveSuggestions().  None means that this is so unless a
+    # subclass overrides retrieveSuggestions(); subclasses can set it
+    # to True or False to force either behavior.
+    SUGGESTS_POSTFIX_MATCHES = None
+
     def __init__(self):
         """
         Instantiantes the command factory.
@@ -164,7 +122,10 @@ class GenericPrefixFactory(AbstractCommandFactory):
         self.__postfixes = []
         self.__postfixesChanged = False
 
-        self.__searchString = ""
+        self.__postfixIndex = PostfixIndex([])
+        # The most recent search in each match mode, as a tuple
+        # (index, postfix, hasMatches); see __findMatches().
+        self.__lastSearches = {}
 
         self.userText = ""
 
@@ -205,19 +166,16 @@ class GenericPrefixFactory(AbstractCommandFactory):
 
     def __update(self):
         """
-        Private method for maintaining a search-string structure.
+        Private method for maintaining the postfix search index.
         """
 
         self.update()
-
-        if self.__postfixesChanged:
-            self.__postfixesChanged = False
-            self.__searchString = "\n".join(self.__postfixes)
+        self.afterUpdate()
 
     def afterUpdate(self):
         if self.__postfixesChanged:
             self.__postfixesChanged = False
-            self.__searchString = "\n".join(self.__postfixes)
+            self.__postfixIndex = PostfixIndex(self.__postfixes)
 
     # LONGTERM TODO: This is not the greatest design.  Perhaps in
     # Mehitabel Core 2.0 this can be replaced with an Observer pattern.
@@ -247,16 +205,12 @@ class GenericPrefixFactory(AbstractCommandFactory):
         """
         self.userText = userText
 
-        pattern = userText[len(self.PREFIX):]
-        pattern = _equivalizeChars(pattern)
-
-        # Match any command that contains the user postfix (i.e.,
-        # any characters followed by the user postfix).
-        pattern = ".*" + pattern
+        # Match any command that contains the user postfix.
+        matches = self.__findMatches(userText[len(self.PREFIX):],
+                                     MATCH_SUBSTRING)
 
-        matches = self.__findMatches(pattern)
-
-        suggestions = [Suggestion(userText, self.PREFIX + m[0])
+        suggestions = [Suggestion(userText, self.PREFIX + m[0], None,
+                                  *self.__getMatchSpan(userText, m))
                        for m in matches]
 
         if self.PREFIX.startswith(userText):
@@ -269,6 +223,104 @@ class GenericPrefixFactory(AbstractCommandFactory):
 
         return suggestions
 
+    def __suggestsPostfixMatches(self):
+        """
+        Returns whether the suggestions of this factory are the
+        postfix matches of retrieveSuggestions() above (see
+        SUGGESTS_POSTFIX_MATCHES).
+        """
+
+        if self.SUGGESTS_POSTFIX_MATCHES is not None:
+            return self.SUGGESTS_POSTFIX_MATCHES
+        return (type(self).retrieveSuggestions.im_func
+                is GenericPrefixFactory.retrieveSuggestions.im_func)
+
+    def retrieveTopSuggestions(self, userText, topSuggestions):
+        """
+        Offers the suggestions matching userText to topSuggestions
+        (see AbstractCommandFactory.retrieveTopSuggestions()).
+
+        The matches are visited in order of decreasing nearness bound,
+        which only depends on their length; the nearness is computed
+        only for those that could still be among the top suggestions,
+        and Suggestion objects only for those that end up there.
+        Matches boosted by their usage are offered up front.
+        """
+
+        if not self.__suggestsPostfixMatches():
+            AbstractCommandFactory.retrieveTopSuggestions(
+                self, userText, topSuggestions)
+            return
+
+        self.userText = userText
+        prefix = self.PREFIX
+
+        if prefix.startswith(userText):
+            topSuggestions.offerText(userText, prefix, self.HELP_TEXT)
+
+        matches = self.__findMatches(userText[len(prefix):], MATCH_SUBSTRING)
+
+        isBoosted = topSuggestions.isBoosted
+        matchesByLength = {}
+        for match in matches:
+            if isBoosted(prefix + match[0]):
+                # Its rank is not limited by its nearness bound.
+                topSuggestions.offerText(
+                    userText, prefix + match[0], None,
+                    *self.__getMatchSpan(userText, match))
+                continue
+            try:
+                matchesByLength[len(match[0])].append(match)
+            except KeyError:
+                matchesByLength[len(match[0])] = [match]
+
+        sourceLength = len(userText)
+        bounds = sorted(
+            ((nearnessBound(sourceLength, len(prefix) + length), length)
+             for length in matchesByLength),
+            reverse=True
+        )
+        for bound, length in bounds:
+            if not topSuggestions.accepts(bound):
+                # Every remaining match is at most as near as this one.
+                break
+            for match in matchesByLength[length]:
+                topSuggestions.offerText(
+                    userText, prefix + match[0], None,
+                    *self.__getMatchSpan(userText, match))
+
+    def hasSuggestions(self, userText):
+        """
+        Returns True if retrieveSuggestions( userText ) would return
+        any suggestions, probing the postfix index instead of
+        collecting the matches.
+        """
+
+        if not self.__suggestsPostfixMatches():
+            return AbstractCommandFactory.hasSuggestions(self, userText)
+
+        if self.PREFIX.startswith(userText):
+            return True
+
+        self.__update()
+        return self.__postfixIndex.hasMatches(userText[len(self.PREFIX):],
+                                              MATCH_SUBSTRING)
+
+    def __getMatchSpan(self, userText, match):
+        """
+        Returns the (prefix_end, start, end) arguments that let a
+        Suggestion highlight match, a (postfix, start, end) tuple found
+        for userText, without comparing the texts again.  All three are
+        None unless the user has typed the whole prefix.
+        """
+
+        prefix = self.PREFIX
+        if not userText.startswith(prefix):
+            return None, None, None
+
+        postfix, start, end = match
+        return len(prefix), start, end
+
     def autoComplete(self, userText):
         """
         If userText begins with this factory's prefix, and the
@@ -284,20 +336,18 @@ class GenericPrefixFactory(AbstractCommandFactory):
         elif not userText.startswith(self.PREFIX):
             return None
 
-        pattern = userText[len(self.PREFIX):]
-        pattern = _equivalizeChars(pattern)
-        matches = self.__findMatches(pattern)
+        postfix = userText[len(self.PREFIX):]
+        matches = self.__findMatches(postfix, MATCH_PREFIX)
         if len(self.PREFIX) > 0 and len(matches) == 0:
             # We have a real prefix; look for beginings of words.
-            # Instead of \b for word boundary, use [^a-zA-Z0-9] so the underscore
-            # character is also considered as a word boundary
-            matches = self.__findMatches(
-                r".*?(?:^|[^a-zA-Z0-9])(%s)" % re.escape(pattern))
+            # The underscore character is also considered as a word
+            # boundary.
+            matches = self.__findMatches(postfix, MATCH_WORD_PREFIX)
         if len(matches) < 1:
             return None
 
         # Take first hit by default...
-        match, match_location = matches[0]
+        match, start, end = matches[0]
         """
         #FIXME: Is this really needed here? It does not work properly (try to type 'open o', it will result into 'open open'
         # ..but prefer 'open' command if it's in the list
@@ -310,54 +360,43 @@ class GenericPrefixFactory(AbstractCommandFactory):
         # TODO: This is incorrect. It matches the first one, not the correct one
         #matchLocation = re.search( pattern, match, re.I ).start()
 
-        newUserText = self.PREFIX
-        start = match_location
-        end = match_location + len(userText) - len(self.PREFIX)
-        newUserText += match[start:end]
+        newUserText = self.PREFIX + match[start:end]
         completion = AutoCompletion(
             newUserText, self.PREFIX + match, None,
             len(self.PREFIX), start, end)
         return completion
 
-    def __findMatches(self, pattern):
+    def __findMatches(self, postfix, mode):
         """
         Finds all command names that:
           (1) start with the correct prefix, and
-          (2) match pattern.
+          (2) contain postfix, as described by mode (one of the
+              postfixindex MATCH_* constants).
 
-        Returns list of tuples:
-        (match:string, match_location:int)
+        Matching is case-insensitive, treats characters sharing a key
+        on the keyboard as equal (so that the user text
+        "open boo 9temp0" matches the command named "open boo (temp)")
+        and lets a single space match any number of spaces.
+
+        Returns a sorted list of tuples:
+        (match:string, match_start:int, match_end:int)
         """
 
         self.__update()
 
-        # This part works by using regular expressions to quickly grab
-        # all the new-line delimited substrings that contain
-        # the pattern.  NOTE: This will allow us to modify the pattern
-        # into a more advanced regexp, allowing ( for example ) the
-        # user text "open boo 9temp0" to match to the command named
-        # "open boo (temp)".
-
-        # ^ matches begining of line or begining of string
-        # $ matches end of line or end of string
-        # .* matches any number of any character, except newlines
-
-        # re.M means that "multiline mode" is used, so "." does not
-        # match newlines.
-        # re.I matches case-insensitively
-        if "(" not in pattern or ")" not in pattern:
-            pattern = r"(%s)" % pattern
-        re_pattern_finditer = re.compile(
-            r"^%s.*$" % pattern, re.M | re.I).finditer
-        # print [(m.groups(), m.start(0), m.start(1)) for m in
-        # re_pattern.finditer(self.__searchString)]
-        matches = [
-            (m.group(0), m.start(1) - m.start(0))
-            for m in re_pattern_finditer(self.__searchString)
-            if m.groups() and m.group(0)
-        ]
-        if matches:
-            matches.sort()
+        index = self.__postfixIndex
+
+        # While the user keeps typing, each search extends the text of
+        # the previous one, so its matches can only be a subset of the
+        # previous matches; once nothing matches, the index does not
+        # need to be consulted again until the postfixes change.
+        lastSearch = self.__lastSearches.get(mode)
+        if (lastSearch is not None and lastSearch[0] is index
+                and not lastSearch[2] and postfix.startswith(lastSearch[1])):
+            return []
+
+        matches = index.searchSpans(postfix, mode)
+        self.__lastSearches[mode] = (index, postfix, bool(matches))
         return matches
 
     def getCommandObj(self, commandName):
@@ -402,7 +441,10 @@ class ArbitraryPostfixFactory(GenericPrefixFactory):
     Abstract factory class for factories that produce "learn as"
     commands, and other command families that can take any argument.
     """
-    override = ('retrieveSuggestions', 'autoComplete', 'update')
+    override = ('retrieveSuggestions', 'hasSuggestions', 'autoComplete', 'update',
+                'SUGGESTS_POSTFIX_MATCHES')
+
+    SUGGESTS_POSTFIX_MATCHES = False
 
     def __init__(self):
         """
@@ -468,6 +510,16 @@ class ArbitraryPostfixFactory(GenericPrefixFactory):
         else:
             return []
 
+    def hasSuggestions(self, userText):
+        """
+        Returns True if userText is contained in the prefix, or if
+        autoComplete() completes it, i.e., if userText begins with
+        all or part of the prefix.
+        """
+
+        return (userText in self.PREFIX
+                or userText.startswith(self.PREFIX))
+
     def textModified(self, keyCode, oldText, newText, quasimodeId=None):
         pass
 
@@ -0,0 +1,252 @@
+# Copyright (c) 2008, Humanized, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#    3. Neither the name of Enso nor the names of its contributors may
+#       be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Humanized, Inc. ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Humanized, Inc. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ----------------------------------------------------------------------------
+#
+#   enso.commands.highlighting
+#
+# ----------------------------------------------------------------------------
+
+"""
+    Computes the markup that highlights how a suggestion relates to
+    the text the user typed; see Suggestion.toXml() for the tags used.
+
+    Suggestions produced from a known match (e.g., by a command
+    factory searching its postfixes) carry the span of the user text
+    within the suggestion, and are marked up in a single pass over the
+    suggestion.  Other suggestions are compared to the user text
+    character by character.  Either way, the markup of a pair of texts
+    is cached, because the same suggestions are drawn over and over
+    while the user types.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+from enso.utils.xml_tools import escape_xml
+
+
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# Maximum number of marked-up suggestions kept by the markup cache.
+MARKUP_CACHE_SIZE = 1024
+
+# Characters that continue a word; an occurrence right after anything
+# else is at a word boundary.  This is deliberately not \w, so that the
+# underscore is considered a word boundary too.
+_WORD_CHARS = frozenset(
+    u"abcdefghijklmnopqrstuvwxyz"
+    u"ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    u"0123456789"
+)
+
+
+# ----------------------------------------------------------------------------
+# Markup
+# ----------------------------------------------------------------------------
+
+def _decorate(xmlText, helpText, suggestedPrefix, escapeHelp):
+    """
+    Adds the help text and suggested-prefix tags to xmlText.
+    """
+
+    if helpText is not None:
+        if escapeHelp:
+            helpText = escape_xml(helpText)
+        xmlText = "%s<help>%s</help>" % (xmlText, helpText)
+    if suggestedPrefix and xmlText.startswith(suggestedPrefix):
+        xmlText = "<prefix>%s</prefix>%s" % (
+            escape_xml(suggestedPrefix), xmlText[len(suggestedPrefix):])
+    return xmlText
+
+
+def markupSpan(suggestion, prefixEnd, start, end, helpText=None,
+               suggestedPrefix=None):
+    """
+    Marks up suggestion for a user text that was found in it.
+
+    The first prefixEnd characters of suggestion are the command
+    prefix that the user typed in full; start and end delimit the
+    typed part of the postfix, relative to prefixEnd.  Everything
+    else is an insertion.
+
+      >>> markupSpan( 'open my file', 5, 3, 5 )
+      'open <ins>my </ins>fi<ins>le</ins>'
+    """
+
+    matchStart = prefixEnd + start
+    matchEnd = prefixEnd + end
+    parts = [escape_xml(suggestion[:prefixEnd])]
+    for text, tag in ((suggestion[prefixEnd:matchStart], True),
+                      (suggestion[matchStart:matchEnd], False),
+                      (suggestion[matchEnd:], True)):
+        if not text:
+            continue
+        if tag:
+            parts.append("<ins>%s</ins>" % escape_xml(text))
+        else:
+            parts.append(escape_xml(text))
+    return _decorate("".join(parts), helpText, suggestedPrefix, True)
+
+
+def _findWordStart(suggestion, target):
+    """
+    Returns the index of the last case-insensitive occurrence of target
+    in suggestion that follows a non-word character, or -1.
+    """
+
+    suggestion = suggestion.lower()
+    target = target.lower()
+    index = suggestion.rfind(target)
+    while index > 0:
+        if suggestion[index - 1] not in _WORD_CHARS:
+            return index
+        index = suggestion.rfind(target, 0, index + len(target) - 1)
+    return -1
+
+
+def _longestPrefixIn(source, suggestion):
+    """
+    Returns the length of the longest initial substring of source that
+    is contained in suggestion.
+
+    If an initial substring is contained in suggestion, so are all the
+    shorter ones, so the length is found by bisection.
+    """
+
+    lo, hi = 0, len(source)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if source[:mid] in suggestion:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def markupSimilarity(source, suggestion, helpText=None,
+                     suggestedPrefix=None):
+    """
+    Marks up suggestion by comparing it to source, the user text.
+
+    Repeatedly takes the longest initial substring of the unused part
+    of source that occurs in the unused part of suggestion (preferring
+    an occurrence at a word boundary), marking whatever precedes it in
+    suggestion as an insertion, or as an alteration if some characters
+    of source had to be skipped.
+
+      >>> markupSimilarity( 'foobar', 'foo the bar' )
+      'foo<ins> the </ins>bar'
+      >>> markupSimilarity( 'zzzfo', 'gfoo' )
+      '<alt>g</alt>fo<ins>o</ins>'
+    """
+
+    unusedSource = source
+    unusedSuggestion = suggestion
+    parts = []
+
+    # Characters of source that could not be matched; they turn the
+    # next insertion into an alteration.
+    unmatchedChars = False
+
+    while unusedSource:
+        length = _longestPrefixIn(unusedSource, unusedSuggestion)
+        if length == 0:
+            unmatchedChars = True
+            unusedSource = unusedSource[1:]
+            continue
+
+        target = unusedSource[:length]
+        index = unusedSuggestion.find(target)
+        wordStart = _findWordStart(unusedSuggestion, target)
+        if wordStart > index:
+            # Prefer word boundary match
+            index = wordStart
+        if index > 0:
+            if unmatchedChars:
+                xmlFormat = "<alt>%s</alt>"
+            else:
+                xmlFormat = "<ins>%s</ins>"
+            parts.append(xmlFormat % escape_xml(unusedSuggestion[:index]))
+        unmatchedChars = False
+        parts.append(escape_xml(target))
+        unusedSuggestion = unusedSuggestion[index + length:]
+        unusedSource = unusedSource[length:]
+
+    # Whatever is left of the suggestion is an insertion (or an
+    # alteration, if appropriate).
+    if unusedSuggestion:
+        if unmatchedChars:
+            xmlFormat = "<alt>%s</alt>"
+        else:
+            xmlFormat = "<ins>%s</ins>"
+        parts.append(xmlFormat % escape_xml(unusedSuggestion))
+
+    return _decorate("".join(parts), helpText, suggestedPrefix, False)
+
+
+# ----------------------------------------------------------------------------
+# Markup Cache
+# ----------------------------------------------------------------------------
+
+_markupCache = {}
+
+
+def getMarkup(source, suggestion, helpText=None, suggestedPrefix=None,
+              prefixEnd=None, start=None, end=None):
+    """
+    Returns the markup of suggestion for the user text source, using
+    markupSpan() if the span of the match is known (start is not
+    None) and markupSimilarity() otherwise.
+
+    Results are cached; like the cache of the re module, the cache is
+    simply emptied when it gets full.
+    """
+
+    key = (source, suggestion, helpText, suggestedPrefix,
+           prefixEnd, start, end)
+    try:
+        return _markupCache[key]
+    except KeyError:
+        pass
+
+    if start is not None:
+        xmlText = markupSpan(suggestion, prefixEnd, start, end, helpText,
+                             suggestedPrefix)
+    else:
+        xmlText = markupSimilarity(source, suggestion, helpText,
+                                   suggestedPrefix)
+
+    if len(_markupCache) >= MARKUP_CACHE_SIZE:
+        _markupCache.clear()
+    _markupCache[key] = xmlText
+    return xmlText
@@ -205,8 +205,9 @@ class AbstractCommandFactory(_CommandImpl):
 
     __metaclass__ = ABCMeta
 
-    override = ('retrieveSuggestions', 'autoComplete',
-                'getCommandObj', 'getCommandList')
+    override = ('retrieveSuggestions', 'retrieveTopSuggestions',
+                'hasSuggestions', 'autoComplete', 'getCommandObj',
+                'getCommandList')
 
     @abstractmethod
     def getCommandList(self):
@@ -225,6 +226,35 @@ class AbstractCommandFactory(_CommandImpl):
         """
         return None
 
+    def retrieveTopSuggestions(self, userText, topSuggestions):
+        """
+        Offers the suggestions matching the userText string to
+        topSuggestions, a TopSuggestions object shared by all command
+        factories.
+
+        The default implementation offers everything returned by
+        retrieveSuggestions(); subclasses able to tell in advance that
+        a candidate cannot make it (see TopSuggestions.accepts()) can
+        override this to avoid creating Suggestion objects for it.
+        """
+
+        topSuggestions.extend(self.retrieveSuggestions(userText))
+
+    def hasSuggestions(self, userText):
+        """
+        Returns True if retrieveSuggestions( userText ) would return
+        any suggestions.  It must also return True whenever
+        autoComplete( userText ) would return an AutoCompletion, as
+        there is no need to look for one otherwise.
+
+        The default implementation retrieves them, and failing that,
+        looks for an autocompletion; subclasses should override this
+        with a cheaper test where they can.
+        """
+
+        return (len(self.retrieveSuggestions(userText)) > 0
+                or self.autoComplete(userText) is not None)
+
     @abstractmethod
     def autoComplete(self, userText):
         """
@@ -44,11 +44,14 @@
 
 import logging
 import operator
+from bisect import bisect_left, insort
 
 from enso import config
 from enso.commands.factories import GenericPrefixFactory
 from enso.commands.interfaces import AbstractCommandFactory
 from enso.commands.interfaces import CommandExpression, CommandObject
+from enso.commands.suggestions import TopSuggestions
+from enso.commands.usage import UsageStore
 
 
 # ----------------------------------------------------------------------------
@@ -82,6 +85,8 @@ class CommandManager:
         self.__cmdFactoryDict = {
             self.CMD_KEY: self.__cmdObjReg,
         }
+        self.__prefixIndex = CommandPrefixIndex()
+        self.__prefixIndex.add(self.CMD_KEY, self.__cmdObjReg)
 
     def registerCommand(self, cmdName, cmdObj):
         """
@@ -108,6 +113,7 @@ class CommandManager:
             assert cmdExpr not in self.__cmdFactoryDict,\
                 "Command is already registered: %s" % cmdExpr
             self.__cmdFactoryDict[cmdExpr] = cmdObj
+            self.__prefixIndex.add(cmdExpr, cmdObj)
         else:
             # The command expression has no argument; it is a
             # simple command with an exact name.
@@ -120,6 +126,7 @@ class CommandManager:
         ):  # Need keys() to obtain copy so we can mutate
             if cmdExpr.getString() == cmdName and cmdExpr != self.CMD_KEY:  # Protect cmdObjeReg from deletion
                 del self.__cmdFactoryDict[cmdExpr]
+                self.__prefixIndex.remove(cmdExpr)
                 break
         else:
             self.__cmdObjReg.removeCommandObj(cmdName)
@@ -135,18 +142,17 @@ class CommandManager:
 
         prefixes = []
 
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(commandName):
-                # This expression matches commandName; try to fetch a
-                # command object from the corresponding factory.
-                cmd = factory.getCommandObj(commandName)
-                if expr == self.CMD_KEY and cmd is not None:
-                    prefixes.append(commandName)
-                elif cmd is not None:
-                    # The factory returned a non-nil command object.
-                    # Make sure that nothing else has matched this
-                    # commandName.
-                    prefixes.append(expr.getPrefix())
+        for expr, factory in self.__prefixIndex.iterMatches(commandName):
+            # This expression matches commandName; try to fetch a
+            # command object from the corresponding factory.
+            cmd = factory.getCommandObj(commandName)
+            if expr == self.CMD_KEY and cmd is not None:
+                prefixes.append(commandName)
+            elif cmd is not None:
+                # The factory returned a non-nil command object.
+                # Make sure that nothing else has matched this
+                # commandName.
+                prefixes.append(expr.getPrefix())
 
         if len(prefixes) == 0:
             return None
@@ -186,18 +192,17 @@ class CommandManager:
 
         expressions = []
 
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(commandName):
-                # This expression matches commandName; try to fetch a
-                # command object from the corresponding factory.
-                cmd = factory.getCommandObj(commandName)
-                if expr == self.CMD_KEY and cmd is not None:
-                    expressions.append((commandName, commandName))
-                elif cmd is not None:
-                    # The factory returned a non-nil command object.
-                    # Make sure that nothing else has matched this
-                    # commandName.
-                    expressions.append((expr.getPrefix(), expr))
+        for expr, factory in self.__prefixIndex.iterMatches(commandName):
+            # This expression matches commandName; try to fetch a
+            # command object from the corresponding factory.
+            cmd = factory.getCommandObj(commandName)
+            if expr == self.CMD_KEY and cmd is not None:
+                expressions.append((commandName, commandName))
+            elif cmd is not None:
+                # The factory returned a non-nil command object.
+                # Make sure that nothing else has matched this
+                # commandName.
+                expressions.append((expr.getPrefix(), expr))
 
         if len(expressions) == 0:
             return None
@@ -238,14 +243,13 @@ class CommandManager:
 
         commands = []
 
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(commandName):
-                # This expression matches commandName; try to fetch a
-                # command object from the corresponding factory.
-                cmd = factory.getCommandObj(commandName)
-                if cmd is not None:
-                    # The factory returned a non-nil command object.
-                    commands.append((expr, cmd))
+        for expr, factory in self.__prefixIndex.iterMatches(commandName):
+            # This expression matches commandName; try to fetch a
+            # command object from the corresponding factory.
+            cmd = factory.getCommandObj(commandName)
+            if cmd is not None:
+                # The factory returned a non-nil command object.
+                commands.append((expr, cmd))
 
         if len(commands) == 0:
             # There is no match
@@ -285,12 +289,11 @@ class CommandManager:
 
         completions = []
 
-        # Check each of the command factories for a match.
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(userText):
-                completion = factory.autoComplete(userText)
-                if completion is not None:
-                    completions.append(completion)
+        # Check each of the command factories whose prefix matches.
+        for expr, factory in self.__prefixIndex.iterMatches(userText):
+            completion = factory.autoComplete(userText)
+            if completion is not None:
+                completions.append(completion)
 
         if len(completions) == 0:
             return None
@@ -308,19 +311,16 @@ class CommandManager:
             # return completions[0]
             return min(completions)
 
-    # FIXME: Make this faster by implementing factory.hasSuggestions()
-    # This is not used anywhere now
     def hasSuggestions(self, userText):
         """
-        Returns True if the userText yields any suggestions
+        Returns True if the userText yields any suggestions, without
+        retrieving them.
         """
-        raise NotImplementedError()
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(userText):
-                if len(factory.retrieveSuggestions(userText)) > 0:
-                    return True
-        else:
-            return False
+
+        for expr, factory in self.__prefixIndex.iterMatches(userText):
+            if factory.hasSuggestions(userText):
+                return True
+        return False
 
     def retrieveSuggestions(self, userText):
         """
@@ -328,13 +328,34 @@ class CommandManager:
         """
 
         suggestions = []
-        # Extend the suggestions using each of the command factories
-        for expr, factory in self.__cmdFactoryDict.iteritems():
-            if expr.matches(userText):
-                suggestions.extend(factory.retrieveSuggestions(userText))
+        # Extend the suggestions using each of the matching command
+        # factories
+        for expr, factory in self.__prefixIndex.iterMatches(userText):
+            suggestions.extend(factory.retrieveSuggestions(userText))
 
         return suggestions
 
+    def retrieveTopSuggestions(self, userText, count):
+        """
+        Returns the count best suggestions for userText, best first.
+
+        Unlike retrieveSuggestions(), this lets every command factory
+        skip candidates that cannot make it into the result.  The
+        commands the user runs often are ranked higher (see
+        enso.commands.usage).
+        """
+
+        usageWeight = config.COMMAND_USAGE_RANKING_WEIGHT
+        topSuggestions = TopSuggestions(
+            count,
+            UsageStore.get() if usageWeight else None,
+            usageWeight
+        )
+        for expr, factory in self.__prefixIndex.iterMatches(userText):
+            factory.retrieveTopSuggestions(userText, topSuggestions)
+
+        return topSuggestions.getSuggestions()
+
     def getCommands(self):
         """
         Returns a dictionary of command expression strings and their
@@ -443,6 +464,88 @@ class CommandObjectRegistry(GenericPrefixFactory):
         return None
 
 
+# ----------------------------------------------------------------------------
+# Command Prefix Index
+# ----------------------------------------------------------------------------
+
+class CommandPrefixIndex(object):
+    """
+    Dispatch structure mapping command prefixes to the command
+    factories registered under them.
+
+    Finds the command expressions matching a user text (in the sense
+    of CommandExpression.matches()) without testing every registered
+    expression; the cost of a lookup depends on the length of the
+    user text and the number of matches, not on the number of
+    installed commands.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty index.
+        """
+
+        # Prefix string -> list of (expr, factory) pairs registered
+        # with that prefix.
+        self.__byPrefix = {}
+        # All keys of __byPrefix, kept sorted.
+        self.__sortedPrefixes = []
+
+    def add(self, cmdExpr, factory):
+        """
+        Adds factory to the index under the prefix of cmdExpr.
+        """
+
+        prefix = cmdExpr.getPrefix()
+        entries = self.__byPrefix.get(prefix)
+        if entries is None:
+            entries = self.__byPrefix[prefix] = []
+            insort(self.__sortedPrefixes, prefix)
+        entries.append((cmdExpr, factory))
+
+    def remove(self, cmdExpr):
+        """
+        Removes the factory registered under cmdExpr.
+        """
+
+        prefix = cmdExpr.getPrefix()
+        entries = self.__byPrefix[prefix]
+        entries[:] = [(expr, factory) for (expr, factory) in entries
+                      if expr is not cmdExpr]
+        if not entries:
+            del self.__byPrefix[prefix]
+            del self.__sortedPrefixes[
+                bisect_left(self.__sortedPrefixes, prefix)]
+
+    def iterMatches(self, userText):
+        """
+        Yields the (expr, factory) pairs whose command expression
+        matches userText, i.e., whose prefix either starts with
+        userText or is itself the start of userText.
+        """
+
+        byPrefix = self.__byPrefix
+
+        # Prefixes that userText starts with (including the empty
+        # prefix of the command object registry).
+        for end in xrange(len(userText) + 1):
+            entries = byPrefix.get(userText[:end])
+            if entries:
+                for entry in entries[:]:
+                    yield entry
+
+        # Prefixes that are strictly longer than userText and start
+        # with it; they are contiguous in the sorted prefix list.
+        prefixes = self.__sortedPrefixes
+        index = bisect_left(prefixes, userText)
+        while index < len(prefixes) and prefixes[index].startswith(userText):
+            prefix = prefixes[index]
+            if len(prefix) > len(userText):
+                for entry in byPrefix[prefix][:]:
+                    yield entry
+            index += 1
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -0,0 +1,539 @@
+# Copyright (c) 2008, Humanized, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#    3. Neither the name of Enso nor the names of its contributors may
+#       be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Humanized, Inc. ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Humanized, Inc. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ----------------------------------------------------------------------------
+#
+#   enso.commands.postfixindex
+#
+# ----------------------------------------------------------------------------
+
+"""
+    A search index over the postfixes of a command factory.
+
+    The PostfixIndex folds every postfix to a canonical "search key"
+    (lower case, keyboard-equivalent characters merged, runs of spaces
+    collapsed) and keeps a sorted array of all suffixes of those keys.
+    Every postfix containing a given piece of user text then occupies
+    one contiguous range of that array, which is found with two binary
+    searches; the cost of a query is therefore proportional to the
+    number of hits rather than to the total size of the postfix list.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+from array import array
+from bisect import bisect_right
+
+
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# Characters that share a key on US keyboard layouts; the user can
+# type either one of the pair to match the other.
+# TODO: These appear to only be equivalent characters for US
+# keyboard layouts.
+EQUIVALENT_CHARS = {
+    "1": "1!",
+    "2": "2@",
+    "3": "3#",
+    "4": "4$",
+    "5": "5%",
+    "6": "6^",
+    "7": "7&",
+    "8": "8*",
+    "9": "9(",
+    "0": "0)",
+    "-": "-_",
+    "=": "=+",
+    ";": ":;",
+    "'": "'\"",
+}
+
+# unicode.translate() table folding each character onto the
+# representative of its equivalence class.  Newlines are folded to
+# spaces because they separate the keys in the index text.
+_FOLD_TABLE = dict(
+    (ord(char), unicode(representative))
+    for representative, chars in EQUIVALENT_CHARS.iteritems()
+    for char in chars
+    if char != representative
+)
+_FOLD_TABLE[ord("\n")] = u" "
+
+# Characters that continue a word; a match that starts right after
+# anything else starts at a word boundary.  This is deliberately not
+# \w, so that the underscore is considered a word boundary too.
+_WORD_CHARS = frozenset(
+    u"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+)
+
+# Search modes understood by PostfixIndex.search().
+MATCH_PREFIX = "prefix"
+MATCH_WORD_PREFIX = "word-prefix"
+MATCH_SUBSTRING = "substring"
+
+# Maximum number of folded user texts kept by the query cache.
+QUERY_CACHE_SIZE = 512
+
+# Number of characters of each suffix used as its sort key when
+# building an index; longer common prefixes are compared in place.
+SORT_PREFIX_LENGTH = 16
+
+
+# ----------------------------------------------------------------------------
+# Search Keys
+# ----------------------------------------------------------------------------
+
+def makeSearchKey(text):
+    """
+    Folds text into its canonical search form.
+
+    Returns a tuple (key, offsets); offsets is None when each
+    character of key corresponds to the character at the same index
+    of text, and otherwise a list mapping each index of key to an
+    index of text.
+
+      >>> makeSearchKey( u'Foo@Bar' )
+      (u'foo2bar', None)
+      >>> makeSearchKey( u'a  b_c' )
+      (u'a b-c', [0, 1, 3, 4, 5])
+    """
+
+    if isinstance(text, str):
+        text = text.decode("utf-8", "replace")
+
+    key = text.lower().translate(_FOLD_TABLE)
+    if len(key) == len(text) and u"  " not in key:
+        return key, None
+
+    # Slow path: some characters folded to several characters, or
+    # several spaces have to be collapsed into one.
+    chars = []
+    offsets = []
+    for index, char in enumerate(text):
+        folded = char.lower().translate(_FOLD_TABLE)
+        if folded == u" " and chars and chars[-1] == u" ":
+            continue
+        for foldedChar in folded:
+            chars.append(foldedChar)
+            offsets.append(index)
+    return u"".join(chars), offsets
+
+
+def _decodeUtf8(text):
+    """
+    Decodes the UTF-8 byte string text, replacing invalid bytes with
+    U+FFFD one by one.  Returns a tuple (unicode, offsets); offsets is
+    None when text is ASCII, and otherwise a list mapping each index
+    of unicode, and its length, to an index of text.
+
+      >>> _decodeUtf8( 'caf\\xc3\\xa9 bar' )
+      (u'caf\\xe9 bar', [0, 1, 2, 3, 5, 6, 7, 8, 9])
+      >>> _decodeUtf8( 'bar' )
+      (u'bar', None)
+    """
+
+    try:
+        return text.decode("ascii"), None
+    except UnicodeDecodeError:
+        pass
+
+    chars = []
+    offsets = []
+    index = 0
+    while index < len(text):
+        lead = ord(text[index])
+        if lead < 0xc0:
+            length = 1
+        elif lead < 0xe0:
+            length = 2
+        elif lead < 0xf0:
+            length = 3
+        else:
+            length = 4
+        try:
+            char = text[index:index + length].decode("utf-8")
+        except UnicodeDecodeError:
+            char, length = u"\ufffd", 1
+        chars.append(char)
+        # A character outside the BMP is two code units on narrow
+        # builds.
+        offsets.extend([index] * len(char))
+        index += length
+    offsets.append(len(text))
+    return u"".join(chars), offsets
+
+
+# ----------------------------------------------------------------------------
+# Query Cache
+# ----------------------------------------------------------------------------
+
+class QueryCache(object):
+    """
+    Bounded cache of search keys for user texts, shared by every
+    PostfixIndex.
+
+    Each keystroke searches several factories (and up to three match
+    modes per factory) for the same user text, and the same texts
+    recur throughout a session, so the search key of a user text is
+    folded only once.  Like the cache of the re module, the cache is
+    simply emptied when it gets full; that keeps a lookup down to a
+    single dict access.
+    """
+
+    def __init__(self, maxSize=QUERY_CACHE_SIZE):
+        self.__maxSize = maxSize
+        self.__keys = {}
+        self.__hits = 0
+        self.__misses = 0
+
+    def getSearchKey(self, userText):
+        """
+        Returns the search key of userText (see makeSearchKey()).
+        """
+
+        try:
+            key = self.__keys[userText]
+        except KeyError:
+            self.__misses += 1
+            if len(self.__keys) >= self.__maxSize:
+                self.__keys.clear()
+            key = self.__keys[userText] = makeSearchKey(userText)[0]
+        else:
+            self.__hits += 1
+        return key
+
+    def clear(self):
+        self.__keys.clear()
+        self.__hits = 0
+        self.__misses = 0
+
+    def getStats(self):
+        """
+        Returns a dictionary describing the cache usage so far.
+        """
+
+        return dict(
+            hits=self.__hits,
+            misses=self.__misses,
+            size=len(self.__keys),
+            maxSize=self.__maxSize,
+        )
+
+
+_queryCache = QueryCache()
+
+
+def getQueryCacheStats():
+    """
+    Returns the usage statistics of the query cache shared by all
+    postfix indexes.
+    """
+
+    return _queryCache.getStats()
+
+
+# ----------------------------------------------------------------------------
+# Suffix Sorting
+# ----------------------------------------------------------------------------
+
+def _sortSuffixes(text, positions):
+    """
+    Returns positions sorted by the text starting at each of them.
+
+    The suffixes are compared in place, a window of
+    SORT_PREFIX_LENGTH characters at a time: the positions are sorted
+    by the first window of their suffix, and each run of positions
+    whose windows are equal is then sorted by the next window, and so
+    on.  The sort keys alive at any time are thus bounded by the
+    number of positions times the window length, rather than by the
+    total length of the suffixes.
+
+      >>> text = u"banana\\nban\\n"
+      >>> [text[p:text.find(u"\\n", p)]
+      ...  for p in _sortSuffixes( text, range( 6 ) )]
+      [u'a', u'ana', u'anana', u'banana', u'na', u'nana']
+    """
+
+    width = SORT_PREFIX_LENGTH
+    positions = list(positions)
+
+    # Runs of positions still to sort, as (start, end, offset) tuples;
+    # within a run, the suffixes are known to share their first offset
+    # characters.
+    runs = [(0, len(positions), 0)]
+    while runs:
+        start, end, offset = runs.pop()
+
+        def window(position):
+            return text[position + offset:position + offset + width]
+
+        run = sorted(positions[start:end], key=window)
+        positions[start:end] = run
+        keys = map(window, run)
+
+        # A window shorter than width reaches the end of the text, so
+        # its suffix differs from all others.
+        runStart = 0
+        for index in xrange(1, len(run) + 1):
+            if index < len(run) and keys[index] == keys[runStart]:
+                continue
+            if index - runStart > 1 and len(keys[runStart]) == width:
+                runs.append((start + runStart, start + index, offset + width))
+            runStart = index
+        del keys
+    return positions
+
+
+# ----------------------------------------------------------------------------
+# The Postfix Index
+# ----------------------------------------------------------------------------
+
+class PostfixIndex(object):
+    """
+    Immutable index over a list of postfixes.
+
+    The postfixes are kept in their original form; only their search
+    keys are folded.  Build a new index when the postfix list changes.
+    """
+
+    def __init__(self, postfixes):
+        """
+        Builds the index over the sequence of strings in postfixes.
+        """
+
+        self.__postfixes = list(postfixes)
+
+        keys = []
+        # Start position of each key in the index text.
+        self.__starts = array("l")
+        # Offset maps for the keys that need them (see makeSearchKey).
+        self.__offsets = {}
+        # Byte offsets of the non-ASCII byte string postfixes, as the
+        # spans returned by searchSpans() index the postfixes
+        # themselves (see _decodeUtf8).
+        self.__byteOffsets = {}
+        # The postfixes as Unicode, while the index is built.
+        texts = []
+
+        position = 0
+        for postfixId, postfix in enumerate(self.__postfixes):
+            if isinstance(postfix, str):
+                postfix, byteOffsets = _decodeUtf8(postfix)
+                if byteOffsets is not None:
+                    self.__byteOffsets[postfixId] = byteOffsets
+            texts.append(postfix)
+            key, offsets = makeSearchKey(postfix)
+            if offsets is not None:
+                self.__offsets[postfixId] = offsets
+            keys.append(key)
+            self.__starts.append(position)
+            position += len(key) + 1
+
+        # All keys are stored newline-terminated in one string, so a
+        # suffix is denoted by a single integer position.
+        self.__text = text = u"\n".join(keys) + u"\n"
+
+        # For every position of the text, how strongly a match may be
+        # anchored there: 1 anywhere in a key, 2 at a word boundary
+        # and 3 at the start of a key.  Word boundaries are found in
+        # the postfixes themselves, as folding turns punctuation such
+        # as "(" or "@" into digits.
+        anchors = bytearray(len(text))
+        for postfixId, start in enumerate(self.__starts):
+            postfix = texts[postfixId]
+            offsets = self.__offsets.get(postfixId)
+            previous = None
+            for index in xrange(len(keys[postfixId])):
+                if offsets is None:
+                    original = index
+                else:
+                    original = offsets[index]
+                if original == previous:
+                    # The rest of a character folded to several.
+                    anchors[start + index] = 1
+                elif original == 0 or postfix[original - 1] not in _WORD_CHARS:
+                    anchors[start + index] = 2
+                else:
+                    anchors[start + index] = 1
+                previous = original
+            if keys[postfixId]:
+                anchors[start] = 3
+
+        # Sorting by the full suffix keeps every range of suffixes that
+        # share a prefix contiguous.  Word-boundary suffixes and key
+        # starts are subsets of all suffixes, so their arrays are
+        # filtered out of the sorted one instead of sorted again.
+        suffixes = _sortSuffixes(
+            text,
+            [position for position in xrange(len(text)) if anchors[position]]
+        )
+        self.__suffixes = {
+            MATCH_SUBSTRING: array("l", suffixes),
+            MATCH_WORD_PREFIX: array(
+                "l", [pos for pos in suffixes if anchors[pos] >= 2]),
+            MATCH_PREFIX: array(
+                "l", [pos for pos in suffixes if anchors[pos] == 3]),
+        }
+
+    def __len__(self):
+        return len(self.__postfixes)
+
+    def getPostfixes(self):
+        return self.__postfixes
+
+    def __findFirst(self, suffixes, query):
+        """
+        Returns the index of the first suffix that is not less than
+        query, using a binary search over the sorted suffix array.
+        """
+
+        text = self.__text
+        length = len(query)
+
+        lo, hi = 0, len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = suffixes[mid]
+            if text[position:position + length] < query:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __findRange(self, suffixes, query):
+        """
+        Returns the (lo, hi) bounds of the suffixes that start with
+        query, using two binary searches over the sorted suffix array.
+        """
+
+        text = self.__text
+        length = len(query)
+
+        first = lo = self.__findFirst(suffixes, query)
+        hi = len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = suffixes[mid]
+            if text[position:position + length] == query:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return first, lo
+
+    def hasMatches(self, userText, mode=MATCH_SUBSTRING):
+        """
+        Returns True if search( userText, mode ) would find anything,
+        at the cost of a single binary search.
+        """
+
+        query = _queryCache.getSearchKey(userText)
+        if not query:
+            # Every non-empty key has a start-of-key suffix.
+            return len(self.__suffixes[MATCH_PREFIX]) > 0
+
+        suffixes = self.__suffixes[mode]
+        first = self.__findFirst(suffixes, query)
+        if first == len(suffixes):
+            return False
+        position = suffixes[first]
+        return self.__text.startswith(query, position)
+
+    def search(self, userText, mode=MATCH_SUBSTRING):
+        """
+        Finds the postfixes whose search key contains the search key
+        of userText; mode is one of:
+
+          MATCH_PREFIX       the postfix must start with userText
+          MATCH_WORD_PREFIX  userText must start at a word boundary
+          MATCH_SUBSTRING    userText may occur anywhere
+
+        Returns a sorted list of (postfix, location) tuples, where
+        location is the index in postfix (a byte offset if postfix is a
+        byte string) of the first occurrence of
+        userText.  An empty userText matches every non-empty postfix.
+        """
+
+        return [(postfix, start)
+                for postfix, start, end in self.searchSpans(userText, mode)]
+
+    def searchSpans(self, userText, mode=MATCH_SUBSTRING):
+        """
+        Like search(), but returns a sorted list of (postfix, start,
+        end) tuples, where postfix[start:end] is the first occurrence
+        of userText; for a byte string postfix, these are byte offsets.  As spaces are collapsed and some characters are
+        folded, end - start may differ from the length of userText.
+
+          >>> PostfixIndex( [ u"gimp  2" ] ).searchSpans( "p 2" )
+          [(u'gimp  2', 3, 7)]
+        """
+
+        query = _queryCache.getSearchKey(userText)
+        postfixes = self.__postfixes
+
+        if not query:
+            return sorted((postfix, 0, 0) for postfix in postfixes if postfix)
+
+        suffixes = self.__suffixes[mode]
+        lo, hi = self.__findRange(suffixes, query)
+        if lo == hi:
+            return []
+
+        # Map each hit back to its postfix, keeping the first
+        # occurrence within each postfix.
+        starts = self.__starts
+        locations = {}
+        for position in suffixes[lo:hi]:
+            postfixId = bisect_right(starts, position) - 1
+            location = position - starts[postfixId]
+            if location < locations.get(postfixId, location + 1):
+                locations[postfixId] = location
+
+        offsets = self.__offsets
+        byteOffsets = self.__byteOffsets
+        length = len(query)
+        matches = []
+        for postfixId, location in locations.iteritems():
+            if postfixId in offsets:
+                keyOffsets = offsets[postfixId]
+                start = keyOffsets[location]
+                end = keyOffsets[location + length - 1] + 1
+            else:
+                start = location
+                end = location + length
+            if postfixId in byteOffsets:
+                start = byteOffsets[postfixId][start]
+                end = byteOffsets[postfixId][end]
+            matches.append((postfixes[postfixId], start, end))
+        matches.sort()
+        return matches
@@ -42,18 +42,11 @@ __updated__ = "2017-02-27"
 # Imports
 # ----------------------------------------------------------------------------
 
-try:
-    import regex as re
-except ImportError:
-    import re
+from heapq import heappush, heapreplace
 
+from enso.commands.highlighting import getMarkup
 from enso.utils.strings import string_ratio
 
-# This is used in loop so better to import the function directly to avoid
-# lookup penalty
-
-from enso.utils.xml_tools import escape_xml
-
 # ----------------------------------------------------------------------------
 # Suggestion Objects
 # ----------------------------------------------------------------------------
@@ -92,10 +85,14 @@ class Suggestion(object):
             prefix_end=None,
             start=None,
             end=None,
-            suggestedPrefix=None):
+            suggestedPrefix=None,
+            nearness=None):
         """
         Initializes the Suggestion: suggestedText is the suggestion
         for originalText.
+
+        If the caller has already computed the nearness of the two
+        texts (see TopSuggestions), it can be passed in as nearness.
         """
 
         assert isinstance(originalText, basestring)
@@ -128,7 +125,9 @@ class Suggestion(object):
 
         # For performance reasons, compute the "nearness" value
         # and cache it.
-        self._nearness = self.__getNearness()
+        if nearness is None:
+            nearness = self.__getNearness()
+        self._nearness = nearness
 
     def getHelpText(self):
         return self.__helpText
@@ -335,153 +334,15 @@ class Suggestion(object):
         return self.__xml
 
     def __transform(self):
-        if self.__start is not None:
-            #s = escape_xml(self.__suggestion)
-            xmlText = "%s<ins>%s</ins>%s<ins>%s</ins>" % (escape_xml(
-                self.__suggestion[
-                    :self.__prefix_end]),
-                escape_xml(
-                self.__suggestion[
-                    self.__prefix_end:self.__prefix_end + self.__start]),
-                escape_xml(
-                    self.__suggestion[
-                        self.__prefix_end + self.__start:self.__prefix_end + self.__end]),
-                escape_xml(
-                self.__suggestion[
-                    self.__prefix_end + self.__end:]))
-            if self.__suggestedPrefix and xmlText.startswith(
-                    self.__suggestedPrefix):
-                xmlText = "<prefix>%s</prefix>%s" % (escape_xml(
-                    self.__suggestedPrefix), xmlText[len(self.__suggestedPrefix):])
-            # Finally, add help text, if it exists.
-            if self.__helpText is not None:
-                xmlText = "%s<help>%s</help>" % (xmlText,
-                                                 escape_xml(self.__helpText))
-            self.__xml = xmlText
-            return
-        else:
-            pass
-
-        # We are going to "use up" both the source string and the
-        # suggestion
-        unusedSource = self.__source[:]
-        unusedSuggestion = self.__suggestion[:]
-
-        # The xml representation
-        xmlText = ""
-
-        # The "to the next word" completion.
-        completion = ""
-
-        # If we cannot match an initial substring of unusedSource,
-        # then we are going to peel off characters one-by-one into
-        # this variable.  These characters have been lost in the
-        # suggestion, and will cause "insertions" to instead be
-        # "alterations".
-        unmatchedChars = ""
-
-        # BEGIN SOURCE-STRING LOOP
-
-        # Each iteration of this loop should reduce the length of
-        # unusedSource, and this loop ends when unusedSource is empty.
-        while len(unusedSource) > 0:
-            # Save a copy of unusedSource, so we know if it changes.
-            oldUnusedSource = unusedSource[:]
-
-            # Loop from the full length of unusedSource down to one
-            # character
-            for i in range(len(unusedSource), 0, -1):
-                # The initial substring we are trying to locate.
-                target = unusedSource[:i]
-
-                # BEGIN TARGET-FOUND CONDITION
-                if target in unusedSuggestion:
-                    # Search normally from begining
-                    index = unusedSuggestion.find(target)
-                    # Search on word boundaries. This is different from \b in
-                    # that it considers also the underscore character as a word
-                    # boundary.
-                    m = re.match(
-                        r".*[^0-9a-zA-Z](%s)" %
-                        re.escape(target), unusedSuggestion, re.I)
-                    if m and m.groups() and m.start(1) > index:
-                        # Prefer word boundary match
-                        index = m.start(1)
-                        # index, m.start(1)
-                    if index > 0:
-                        if len(unmatchedChars) > 0:
-                            # There were unused characters in the
-                            # source, and there were characters in the
-                            # unused suggestion before the target, so
-                            # the next "inserted" portion of the
-                            # suggestion becomes an "alteration"
-                            # instead.
-                            xml_format = "<alt>%s</alt>"
-                        else:
-                            xml_format = "<ins>%s</ins>"
-                        xmlText += xml_format % escape_xml(
-                            unusedSuggestion[:index]
-                        )
-                        # NOTE: Do not add inserted characters to the
-                        # 'next word' completion.
-                    # Whether or not there were characters between
-                    # the start of the unused suggestion and "here",
-                    # any unmatched chars are now defunct.
-                    unmatchedChars = ""
-                    xmlText += escape_xml(target)
-                    completion += target
-                    unusedSuggestion = unusedSuggestion[index + len(target):]
-                    unusedSource = unusedSource[i:]
-                    # The target was found and unusedSource was
-                    # modified; we exit the for-loop (to be entered
-                    # again if unusedSource is still nonempty).
-                    break
-                # END TARGET-FOUND CONDITION
-
-            # Either unusedSource is smaller, or it is the same as
-            # oldUnusedSource.  If it is the same as old unusedSource,
-            # then there was no match of a beginning substring, so we
-            # remove the first character and store it as an "unused
-            # character", which will become part of an "altered
-            # substring", if there is a match to a later substring.
-            if unusedSource == oldUnusedSource:
-                unmatchedChars += unusedSource[0]
-                unusedSource = unusedSource[1:]
-
-            assert len(unusedSource) < len(oldUnusedSource), \
-                "Potential infinite loop condition; failed to reduce"\
-                " the length of the unused portion of the source string"\
-                " in toXml()"
-        # END SOURCE-STRING LOOP
-
-        # The source-string loop above only guarantees to use up the
-        # source string; there may be an unused portion of the
-        # suggestion left.  We append it to the xml string as an
-        # insertion (or alteration, if appropriate).
-        if len(unusedSuggestion) > 0:
-            if len(unmatchedChars) > 0:
-                xml_format = "<alt>%s</alt>"
-            else:
-                xml_format = "<ins>%s</ins>"
-            unusedXml = escape_xml(unusedSuggestion)
-            xmlText += xml_format % unusedXml
-
-            completion += unusedSuggestion.split(" ")[0]
-            if " " in unusedSuggestion:
-                completion += " "
-
-        # Finally, add the help text, if it exists.
-        if self.__helpText is not None:
-            xmlText += "<help>%s</help>" % self.__helpText
-
-        if self.__suggestedPrefix and xmlText.startswith(
-                self.__suggestedPrefix):
-            xmlText = "<prefix>%s</prefix>%s" % (escape_xml(
-                self.__suggestedPrefix), xmlText[len(self.__suggestedPrefix):])
-
-        self.__xml = xmlText
-        # print "COMPLETION: \"%s\"" % completion
-        #self.__completion = completion
+        self.__xml = getMarkup(
+            self.__source,
+            self.__suggestion,
+            self.__helpText,
+            self.__suggestedPrefix,
+            self.__prefix_end,
+            self.__start,
+            self.__end
+        )
 
 
 class AutoCompletion(Suggestion):
@@ -534,3 +395,163 @@ class AutoCompletion(Suggestion):
 
     def hasCompletion(self):
         return bool(self.toText())
+
+
+# ----------------------------------------------------------------------------
+# Top Suggestions
+# ----------------------------------------------------------------------------
+
+def nearnessBound(sourceLength, suggestionLength):
+    """
+    Returns the highest nearness a Suggestion can have when its source
+    text and suggested text have the given lengths, without looking
+    at the texts themselves; see enso.utils.strings.string_ratio().
+
+      >>> nearnessBound( 3, 3 )
+      1.0
+      >>> nearnessBound( 2, 6 ) >= Suggestion( 'fo', 'foobar' )._nearness
+      True
+    """
+
+    if not sourceLength:
+        return 0.0
+    return 2.0 * min(sourceLength, suggestionLength) / (
+        sourceLength + suggestionLength)
+
+
+class _WorstFirst(object):
+    """
+    Entry of the TopSuggestions heap.
+
+    Orders entries by score and then text like Suggestion.__cmp__()
+    does by nearness and text, but inverted, so that the top of a heapq
+    heap is the worst entry in it.  The score is the nearness plus the
+    usage boost, if any.  The payload is either a Suggestion or the
+    tuple of Suggestion constructor arguments it will be created from.
+    """
+
+    __slots__ = ('score', 'nearness', 'text', 'payload')
+
+    def __init__(self, score, nearness, text, payload):
+        self.score = score
+        self.nearness = nearness
+        self.text = text
+        self.payload = payload
+
+    def __lt__(self, other):
+        return (self.score, other.text) < (other.score, self.text)
+
+
+class TopSuggestions(object):
+    """
+    Collects the best suggestions (in the order defined by
+    Suggestion.__cmp__()) offered by any number of command factories,
+    keeping at most a fixed number of them.
+
+    Producers can ask whether a candidate could still make it into the
+    collection, given an upper bound of its nearness (see
+    nearnessBound()), before they compute its actual nearness.
+    Candidates offered as plain texts are only turned into Suggestion
+    objects if they are among the best ones in the end.
+
+    If a usage table (see enso.commands.usage.UsageStore) is given,
+    the suggestions are ranked by their nearness plus usageWeight times
+    their usage boost.  Upper bounds of the nearness are then only
+    valid for candidates that are not boosted (see isBoosted()), so
+    producers must offer boosted candidates regardless of the bound.
+    """
+
+    def __init__(self, size, usage=None, usageWeight=0.0):
+        """
+        Initializes an empty collection keeping at most size
+        suggestions.
+        """
+
+        self.__size = size
+        self.__heap = []
+        if not usageWeight:
+            usage = None
+        self.__usage = usage
+        self.__usageWeight = usageWeight
+
+    def accepts(self, nearness):
+        """
+        Returns False if no suggestion with the given nearness (or less)
+        that is not boosted can be added to the collection any more.
+        """
+
+        heap = self.__heap
+        if len(heap) < self.__size:
+            return True
+        return nearness >= heap[0].score
+
+    def isBoosted(self, text):
+        """
+        Returns True if the suggestion with the given text is ranked
+        above its nearness because of its usage.
+        """
+
+        return self.__usage is not None and text in self.__usage
+
+    def __score(self, nearness, text):
+        if self.__usage is None:
+            return nearness
+        return nearness + self.__usageWeight * self.__usage.getBoost(text)
+
+    def __push(self, entry):
+        heap = self.__heap
+        if len(heap) < self.__size:
+            heappush(heap, entry)
+        elif self.__size and heap[0] < entry:
+            heapreplace(heap, entry)
+
+    def offer(self, suggestion):
+        """
+        Adds suggestion to the collection if it is better than the
+        worst suggestion collected so far, or if there is still room.
+        """
+
+        nearness = suggestion._nearness  # IGNORE:W0212
+        text = suggestion.toText()
+        self.__push(_WorstFirst(
+            self.__score(nearness, text),
+            nearness,
+            text,
+            suggestion
+        ))
+
+    def offerText(self, originalText, suggestedText, helpText=None,
+                  prefix_end=None, start=None, end=None):
+        """
+        Like offer( Suggestion( originalText, suggestedText, ... ) ),
+        except that the Suggestion object is not created unless the
+        candidate is among the collected suggestions in the end.
+        """
+
+        nearness = string_ratio(originalText, suggestedText)
+        self.__push(_WorstFirst(
+            self.__score(nearness, suggestedText),
+            nearness,
+            suggestedText,
+            (originalText, suggestedText, helpText, prefix_end, start, end)
+        ))
+
+    def extend(self, suggestions):
+        for suggestion in suggestions:
+            self.offer(suggestion)
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def getSuggestions(self):
+        """
+        Returns the collected suggestions, best first.
+        """
+
+        suggestions = []
+        for entry in sorted(self.__heap, reverse=True):
+            suggestion = entry.payload
+            if not isinstance(suggestion, Suggestion):
+                suggestion = Suggestion(*suggestion, nearness=entry.nearness)
+            suggestions.append(suggestion)
+        return suggestions
@@ -0,0 +1,287 @@
+# Copyright (c) 2008, Humanized, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#    3. Neither the name of Enso nor the names of its contributors may
+#       be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Humanized, Inc. ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Humanized, Inc. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ----------------------------------------------------------------------------
+#
+#   enso.commands.usage
+#
+# ----------------------------------------------------------------------------
+
+"""
+    The UsageStore singleton, which remembers how often and how
+    recently each command has been run.
+
+    Every run is appended to a small UTF-8 log file in the Enso local
+    configuration directory, one tab-separated record per line:
+
+      r <time> <command name>           -- the command was run
+      s <time> <score> <command name>   -- score snapshot (compaction)
+
+    In memory, each command has a single score: the sum over its runs
+    of 2 ** (age / half-life), all measured against one fixed reference
+    time.  Measuring against a fixed time means that recording a run is
+    a single addition and that looking up the relative weight of a
+    command is a dictionary access, while still letting old runs count
+    exponentially less than recent ones.  When the log has grown much
+    longer than the score table, it is rewritten as one snapshot record
+    per command.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+import codecs
+import logging
+import os
+import time
+
+import enso.providers
+from enso import config
+
+
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# Name of the log file in the Enso local configuration directory.
+USAGE_FILE_NAME = "command_usage.log"
+
+# Default half-life of a command run, in seconds.
+DEFAULT_HALF_LIFE = 14 * 24 * 60 * 60
+
+# Commands whose decayed score is below this (i.e., that have not been
+# run for a few half-lives) are forgotten when the log is compacted.
+MIN_SCORE = 1.0 / 64
+
+# The log is compacted when it holds more than this many records per
+# remembered command (and at least MIN_COMPACT_RECORDS records).
+COMPACT_RATIO = 4
+MIN_COMPACT_RECORDS = 256
+
+# Scores are rebased to a new reference time once the reference is
+# this many half-lives old, so that they cannot overflow.
+MAX_REFERENCE_AGE = 64
+
+_RUN_RECORD = u"r"
+_SNAPSHOT_RECORD = u"s"
+
+
+# ----------------------------------------------------------------------------
+# The UsageStore
+# ----------------------------------------------------------------------------
+
+class UsageStore(object):
+    """
+    Keeps decayed usage scores of commands, persisted in an
+    append-only log file.
+    """
+
+    __instance = None
+
+    @classmethod
+    def get(cls):
+        if not cls.__instance:
+            fileName = os.path.join(
+                enso.providers.getInterface("system").get_enso_local_conf_dir(),
+                USAGE_FILE_NAME
+            )
+            cls.__instance = cls(
+                fileName,
+                config.COMMAND_USAGE_HALF_LIFE_DAYS * 24 * 60 * 60
+            )
+        return cls.__instance
+
+    def __init__(self, fileName=None, halfLife=DEFAULT_HALF_LIFE):
+        """
+        Initializes the store from the log in fileName, if it exists.
+        If fileName is None, nothing is read or written.
+        """
+
+        self.__fileName = fileName
+        self.__halfLife = float(halfLife)
+        self.__reference = None
+        self.__scores = {}
+        self.__maxScore = 0.0
+        self.__records = 0
+
+        if fileName is not None and os.path.isfile(fileName):
+            self.__load()
+
+    def __load(self):
+        try:
+            logFile = codecs.open(self.__fileName, "r", "utf-8")
+            try:
+                lines = logFile.read().splitlines()
+            finally:
+                logFile.close()
+        except (IOError, UnicodeDecodeError):
+            logging.warning("Could not read command usage from %s"
+                            % self.__fileName)
+            return
+
+        for line in lines:
+            fields = line.split(u"\t")
+            try:
+                if fields[0] == _RUN_RECORD and len(fields) == 3:
+                    self.__add(fields[2], float(fields[1]), 1.0)
+                elif fields[0] == _SNAPSHOT_RECORD and len(fields) == 4:
+                    self.__add(fields[3], float(fields[1]), float(fields[2]))
+                else:
+                    continue
+            except ValueError:
+                continue
+            self.__records += 1
+
+    def __add(self, name, when, score):
+        """
+        Adds score, as of the given time, to the score of the named
+        command.
+        """
+
+        if self.__reference is None:
+            self.__reference = when
+        elif when - self.__reference > MAX_REFERENCE_AGE * self.__halfLife:
+            self.__rebase(when)
+
+        score *= 2.0 ** ((when - self.__reference) / self.__halfLife)
+        score += self.__scores.get(name, 0.0)
+        self.__scores[name] = score
+        if score > self.__maxScore:
+            self.__maxScore = score
+
+    def __rebase(self, when):
+        factor = 2.0 ** ((self.__reference - when) / self.__halfLife)
+        for name in self.__scores:
+            self.__scores[name] *= factor
+        self.__maxScore *= factor
+        self.__reference = when
+
+    def recordRun(self, name, when=None):
+        """
+        Records that the named command was run at the given time
+        (default: now).
+        """
+
+        if when is None:
+            when = time.time()
+        if isinstance(name, str):
+            name = name.decode("utf-8", "replace")
+        name = name.replace(u"\t", u" ").replace(u"\n", u" ")
+
+        self.__add(name, when, 1.0)
+        self.__records += 1
+        self.__write([u"%s\t%.3f\t%s\n" % (_RUN_RECORD, when, name)], "a")
+
+        if self.__records > max(MIN_COMPACT_RECORDS,
+                                COMPACT_RATIO * len(self.__scores)):
+            self.compact(when)
+
+    def compact(self, when=None):
+        """
+        Forgets the commands whose score has decayed below MIN_SCORE
+        and rewrites the log as one snapshot record per command.
+        """
+
+        if when is None:
+            when = time.time()
+        if self.__reference is not None:
+            self.__rebase(when)
+
+        self.__scores = dict((name, score)
+                             for name, score in self.__scores.iteritems()
+                             if score >= MIN_SCORE)
+        self.__maxScore = max(self.__scores.itervalues()) \
+            if self.__scores else 0.0
+        self.__records = len(self.__scores)
+
+        self.__write([u"%s\t%.3f\t%r\t%s\n" % (_SNAPSHOT_RECORD, when,
+                                                score, name)
+                      for name, score in sorted(self.__scores.iteritems())],
+                     "w")
+
+    def __write(self, lines, mode):
+        """
+        Appends lines to the log (mode "a"), or atomically replaces
+        the log with them (mode "w").
+        """
+
+        if self.__fileName is None:
+            return
+
+        fileName = self.__fileName
+        if mode == "w":
+            fileName += ".tmp"
+        try:
+            directory = os.path.dirname(fileName)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            logFile = open(fileName, mode + "b")
+            try:
+                logFile.write(u"".join(lines).encode("utf-8"))
+            finally:
+                logFile.close()
+            if mode == "w":
+                if os.path.exists(self.__fileName):
+                    # Windows does not replace existing files on rename.
+                    os.remove(self.__fileName)
+                os.rename(fileName, self.__fileName)
+        except (IOError, OSError):
+            logging.warning("Could not write command usage to %s"
+                            % self.__fileName)
+
+    def getBoost(self, name):
+        """
+        Returns the score of the named command relative to the most
+        used command: a number between 0.0 (never run) and 1.0.
+        """
+
+        score = self.__scores.get(name)
+        if not score:
+            return 0.0
+        return score / self.__maxScore
+
+    def getScore(self, name, when=None):
+        """
+        Returns the decayed score of the named command at the given
+        time (default: now); each run counts 1.0 when it happens.
+        """
+
+        score = self.__scores.get(name)
+        if not score:
+            return 0.0
+        if when is None:
+            when = time.time()
+        return score * 2.0 ** ((self.__reference - when) / self.__halfLife)
+
+    def __contains__(self, name):
+        return name in self.__scores
+
+    def __len__(self):
+        return len(self.__scores)
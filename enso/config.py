@@ -25,6 +25,24 @@ SHOW_ON_ACTIVE_MONITOR = True
 
 DRAW_SCALE_FACTOR = 1.0
 
+# Whether the timer driving the quasimode and the animations only runs
+# while something needs it, rather than every 10 ms all the time.
+# Only the Linux input manager supports this so far.
+ADAPTIVE_TIMER = True
+
+# Whether the event profiler records the duration of every call of an
+# event responder.  Its results are shown on the /profiler page of the
+# web UI, where it can also be turned on and off while Enso runs.
+EVENT_PROFILER_ENABLED = False
+
+# Number of the most recent responder calls kept by the event profiler.
+EVENT_PROFILER_BUFFER_SIZE = 4096
+
+# Maximum number of bytes held by the surfaces of closed windows, kept
+# for reuse by new windows.  Set to 0 to disable the reuse.  Only the
+# Linux graphics backend pools its surfaces so far.
+SURFACE_POOL_MAX_BYTES = 64 * 1024 * 1024
+
 # Amount of time, in seconds (float), to wait from the time
 # that the quasimode begins drawing to the time that the
 # suggestion list begins to be displayed.  Setting this to a
@@ -39,6 +57,22 @@ QUASIMODE_MAX_SUGGESTIONS = 6
 # auto-completion mechanism engages.
 QUASIMODE_MIN_AUTOCOMPLETE_CHARS = 2
 
+# Number of recent user texts whose suggestions are remembered while
+# in the quasimode, so that backspacing to one of them (or cycling
+# through the suggestion list) does not query the commands again.
+# Set to 0 to disable.
+QUASIMODE_SUGGESTION_HISTORY_SIZE = 16
+
+# How much the commands the user runs often (and recently) are ranked
+# above other suggestions of similar nearness; the most used command
+# gets this much added to its nearness, which is between 0 and 1.
+# Set to 0 to rank by nearness only.
+COMMAND_USAGE_RANKING_WEIGHT = 0.25
+
+# Number of days after which a command run counts half as much for
+# the above ranking.
+COMMAND_USAGE_HALF_LIFE_DAYS = 14
+
 # Highlight trailing space in the input area.
 # To disable the feature set this to None.
 QUASIMODE_TRAILING_SPACE_STRING = u"\u00b7"  # MIDDLE DOT
@@ -0,0 +1,264 @@
+# Copyright (c) 2008, Humanized, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#    3. Neither the name of Enso nor the names of its contributors may
+#       be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Humanized, Inc. ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Humanized, Inc. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ----------------------------------------------------------------------------
+#
+#   enso.eventprofiler
+#
+# ----------------------------------------------------------------------------
+
+"""
+    Profiler of the event responders called by the EventManager.
+
+    While enabled, every call of a responder is recorded, with its
+    event type and duration, in a ring buffer of the most recent
+    calls.  Recording takes no lock: the buffer is a preallocated list
+    that is only ever written one slot at a time, so concurrent
+    recorders can at worst overwrite each other's record, and readers
+    copy it in a single step.  The statistics (counts, latency
+    histograms and the slowest calls) are computed from the buffer
+    when they are queried, which keeps the cost of a responder call
+    down to a clock read and a list store.
+
+    The profiler can be enabled and disabled at any time, by default
+    from the EVENT_PROFILER_ENABLED setting, and its results can be
+    looked at on the /profiler page of the web UI.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+import time
+from bisect import bisect_left
+
+import enso.config
+
+
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# Number of responder calls remembered by the profiler.
+DEFAULT_BUFFER_SIZE = 4096
+
+# Upper bounds of the buckets of the latency histograms, in
+# milliseconds; the last bucket holds the calls slower than that.
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+# ----------------------------------------------------------------------------
+# Utility functions
+# ----------------------------------------------------------------------------
+
+def getResponderName(func):
+    """
+    Returns a readable name of the responder function func, including
+    the class of the object it is a method of, if any.
+
+    >>> class Window( object ):
+    ...   def onTick( self, msPassed ): pass
+    >>> getResponderName( Window().onTick )
+    'Window.onTick'
+    >>> getResponderName( getResponderName )
+    'enso.eventprofiler.getResponderName'
+    """
+
+    name = getattr(func, "__name__", None)
+    if name is None:
+        return repr(func)
+    instance = getattr(func, "im_self", None)
+    if instance is not None:
+        return "%s.%s" % (instance.__class__.__name__, name)
+    module = getattr(func, "__module__", None)
+    if module:
+        return "%s.%s" % (module, name)
+    return name
+
+
+# ----------------------------------------------------------------------------
+# The Event Profiler
+# ----------------------------------------------------------------------------
+
+class EventProfiler(object):
+    """
+    Records the responder calls of the EventManager, and computes
+    statistics about them.
+
+    >>> profiler = EventProfiler( bufferSize=3 )
+    >>> profiler.record( "timer", "onTick", 0.002 )
+    >>> profiler.getStats()
+    []
+    >>> profiler.setEnabled( True )
+    >>> for elapsed in [ 0.002, 0.030, 0.004, 0.0005 ]:
+    ...   profiler.record( "timer", "onTick", elapsed )
+    >>> stats = profiler.getStats()[0]
+    >>> stats["count"], stats["maxMs"], stats["totalCount"]
+    (3, 30.0, 4)
+    >>> [ round( elapsedMs ) for when, eventType, responder, elapsedMs
+    ...   in profiler.getSlowestCalls( 2 ) ]
+    [30.0, 4.0]
+    """
+
+    __instance = None
+
+    @classmethod
+    def get(cls):
+        if not cls.__instance:
+            cls.__instance = cls(enso.config.EVENT_PROFILER_BUFFER_SIZE)
+            cls.__instance.setEnabled(enso.config.EVENT_PROFILER_ENABLED)
+        return cls.__instance
+
+    def __init__(self, bufferSize=DEFAULT_BUFFER_SIZE):
+        self.__bufferSize = bufferSize
+        # Whether the responder calls are recorded; read directly by
+        # the responder wrappers, for speed.
+        self.enabled = False
+        self.clear()
+
+    def setEnabled(self, isEnabled):
+        """
+        Enables or disables the recording of responder calls.
+        """
+
+        self.enabled = bool(isEnabled)
+
+    def isEnabled(self):
+        return self.enabled
+
+    def clear(self):
+        """
+        Forgets all the calls recorded so far.
+        """
+
+        # Each slot holds a (time, event type, responder name,
+        # duration in seconds) tuple, or None.  Names rather than the
+        # functions are kept, so as not to keep their objects alive.
+        self.__buffer = [None] * self.__bufferSize
+        self.__recordCount = 0
+        # Number of calls recorded per (event type, responder name),
+        # counted when the records are about to be overwritten, so
+        # that the counts cover the whole time the profiler has run.
+        self.__expiredCounts = {}
+
+    def record(self, eventType, responderName, elapsed):
+        """
+        Records a call of the named responder to an event of the given
+        type, which took elapsed seconds (see getResponderName()).
+        """
+
+        if not self.enabled:
+            return
+        index = self.__recordCount
+        self.__recordCount = index + 1
+        slot = index % self.__bufferSize
+        expired = self.__buffer[slot]
+        if expired is not None:
+            key = (expired[1], expired[2])
+            self.__expiredCounts[key] = self.__expiredCounts.get(key, 0) + 1
+        self.__buffer[slot] = (time.time(), eventType, responderName, elapsed)
+
+    def __getRecords(self):
+        """
+        Returns a list of the records in the buffer.
+        """
+
+        # Copying the list is atomic, so this needs no lock.
+        return [record for record in list(self.__buffer)
+                if record is not None]
+
+    def getStats(self, eventType=None):
+        """
+        Returns a list of dictionaries describing the calls of each
+        responder (of the given event type, if any) still in the
+        buffer, slowest in total first.  Each dictionary holds the
+        event type, responder name, number of calls in the buffer
+        ('count') and since the profiler was last cleared
+        ('totalCount'), the total, mean and maximum duration of the
+        calls in milliseconds, and their histogram: a list of the
+        number of calls in each bucket of HISTOGRAM_BOUNDS_MS.
+        """
+
+        expiredCounts = dict(self.__expiredCounts)
+        statsByKey = {}
+        for when, recordEventType, responderName, elapsed in \
+                self.__getRecords():
+            if eventType is not None and recordEventType != eventType:
+                continue
+            elapsedMs = elapsed * 1000
+            key = (recordEventType, responderName)
+            stats = statsByKey.get(key)
+            if stats is None:
+                stats = statsByKey[key] = {
+                    "eventType": recordEventType,
+                    "responder": responderName,
+                    "count": 0,
+                    "totalCount": expiredCounts.get(key, 0),
+                    "totalMs": 0.0,
+                    "maxMs": 0.0,
+                    "histogram": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1),
+                }
+            stats["count"] += 1
+            stats["totalCount"] += 1
+            stats["totalMs"] += elapsedMs
+            stats["maxMs"] = max(stats["maxMs"], elapsedMs)
+            stats["histogram"][
+                bisect_left(HISTOGRAM_BOUNDS_MS, elapsedMs)] += 1
+
+        statsList = statsByKey.values()
+        for stats in statsList:
+            stats["meanMs"] = stats["totalMs"] / stats["count"]
+        statsList.sort(key=lambda stats: stats["totalMs"], reverse=True)
+        return statsList
+
+    def getSlowestCalls(self, count=10, eventType=None):
+        """
+        Returns a list of (time, event type, responder name, duration
+        in milliseconds) tuples of the count slowest calls still in
+        the buffer (of the given event type, if any), slowest first.
+        """
+
+        records = [record for record in self.__getRecords()
+                   if eventType is None or record[1] == eventType]
+        records.sort(key=lambda record: record[3], reverse=True)
+        return [(when, recordEventType, responderName, elapsed * 1000)
+                for when, recordEventType, responderName, elapsed
+                in records[:count]]
+
+    def getSummary(self):
+        """
+        Returns a dictionary describing the profiler state.
+        """
+
+        return dict(
+            enabled=self.enabled,
+            recorded=self.__recordCount,
+            bufferSize=self.__bufferSize,
+            histogramBoundsMs=list(HISTOGRAM_BOUNDS_MS),
+        )
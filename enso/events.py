@@ -56,10 +56,14 @@
 # Imports
 # ----------------------------------------------------------------------------
 
+import heapq
 import logging
+from collections import OrderedDict
+import threading
 import time
 
 from enso import input
+from enso.eventprofiler import EventProfiler, getResponderName
 
 
 # ----------------------------------------------------------------------------
@@ -90,21 +94,47 @@ class EventResponderFuncWrapper(object):
     Event responder function wrapper
     It serves only one purpose: to provide is_running() function to the responder functions
     so that the function execution can be tracked and synchronized.
+    Once removed, it no longer calls the function, even from an event
+    dispatch that started before.  It also reports the duration of the
+    calls to the given EventProfiler, if any, while that is enabled.
     """
 
-    def __init__(self, func):
+    def __init__(self, func, eventType=None, profiler=None):
         self.__func = func
         self.__is_running = False
+        self.__is_removed = False
+        self.__event_type = eventType
+        self.__profiler = profiler
+        self.__name = None
 
     def is_running(self):
         return self.__is_running
 
+    def set_removed(self):
+        self.__is_removed = True
+
     def __call__(self, *args, **kwargs):
+        if self.__is_removed:
+            return None
+        if self.__profiler is not None and self.__profiler.enabled:
+            return self.__profiled_call(*args, **kwargs)
+        self.__is_running = True
+        try:
+            return self.__func(*args, **kwargs)
+        finally:
+            self.__is_running = False
+
+    def __profiled_call(self, *args, **kwargs):
+        if self.__name is None:
+            self.__name = getResponderName(self.__func)
         self.__is_running = True
+        started = time.time()
         try:
             return self.__func(*args, **kwargs)
         finally:
             self.__is_running = False
+            self.__profiler.record(
+                self.__event_type, self.__name, time.time() - started)
 
     """ Mandatory functions for a wrapper """
 
@@ -148,6 +178,109 @@ class EventResponderFuncWrapper(object):
         raise AttributeError()
 
 
+# ----------------------------------------------------------------------------
+# Responder registry
+# ----------------------------------------------------------------------------
+
+class ResponderRegistry(object):
+    """
+    The event responders of an EventManager, indexed both by event
+    type and by responder function, so that neither registering nor
+    removing a responder needs to look through the others.
+
+    The responders of an event type are kept in the order they were
+    registered in.  Dispatching iterates over a tuple snapshot of
+    them, which is only rebuilt after they change, so responders can
+    be registered and removed while an event is being dispatched,
+    without copying the responders on every dispatch: the ones
+    registered meanwhile respond from the next event on, and the ones
+    removed are not called anymore.
+
+    >>> registry = ResponderRegistry( [ "timer", "key" ] )
+    >>> def onTick( msPassed ): pass
+    >>> def onKey( eventType, keyCode ): pass
+    >>> wrapper = registry.add( "timer", onTick )
+    >>> wrapper = registry.add( "key", onTick )
+    >>> wrapper = registry.add( "key", onKey )
+    >>> [ func.__name__ for func in registry.get( "key" ) ]
+    ['onTick', 'onKey']
+    >>> registry.has( "timer", onTick )
+    True
+    >>> removed = registry.remove( onTick )
+    >>> sorted( eventType for eventType, wrapper in removed )
+    ['key', 'timer']
+    >>> registry.get( "timer" )
+    ()
+    >>> registry.remove( onTick )
+    []
+    """
+
+    def __init__(self, eventTypes, profiler=None):
+        # Profiler the responder calls are reported to, if any.
+        self.__profiler = profiler
+        # For each event type, an ordered dictionary mapping the
+        # responder functions to their wrappers.
+        self.__byEventType = {}
+        # For each event type, a tuple of the wrappers, or None if it
+        # needs rebuilding.
+        self.__snapshots = {}
+        # For each responder function, the set of event types it is
+        # registered for.
+        self.__byFunc = {}
+
+        for eventType in eventTypes:
+            self.addEventType(eventType)
+
+    def addEventType(self, eventType):
+        """
+        Adds an event type with no responders.
+        """
+        self.__byEventType[eventType] = OrderedDict()
+        self.__snapshots[eventType] = ()
+
+    def has(self, eventType, func):
+        """
+        Returns whether func is a responder of the given event type.
+        """
+        return func in self.__byEventType[eventType]
+
+    def get(self, eventType):
+        """
+        Returns a tuple of the wrappers of the responders of the given
+        event type, in the order they were registered in.
+        """
+        snapshot = self.__snapshots[eventType]
+        if snapshot is None:
+            snapshot = tuple(self.__byEventType[eventType].itervalues())
+            self.__snapshots[eventType] = snapshot
+        return snapshot
+
+    def add(self, eventType, func):
+        """
+        Registers func as a responder of the given event type, and
+        returns its wrapper.
+        """
+        wrapper = EventResponderFuncWrapper(func, eventType, self.__profiler)
+        self.__byEventType[eventType][func] = wrapper
+        self.__snapshots[eventType] = None
+        self.__byFunc.setdefault(func, set()).add(eventType)
+        return wrapper
+
+    def remove(self, func):
+        """
+        Removes func from the responders of all event types, and
+        returns a list of (event type, wrapper) tuples of the
+        responders removed.
+        """
+        removed = []
+        for eventType in self.__byFunc.pop(func, ()):
+            wrapper = self.__byEventType[eventType].pop(func)
+            wrapper.set_removed()
+            removed.append((eventType, wrapper))
+            self.__snapshots[eventType] = None
+        return removed
+
+
 # ----------------------------------------------------------------------------
 # EventManager class
 # ----------------------------------------------------------------------------
@@ -182,13 +315,19 @@ class EventManager(input.InputManager):
         # which can be extended with the createEventType() method.
         self._dynamicEventTypes = EVENT_TYPES[:]
 
-        self.__responders = {}
-        for evt in self._dynamicEventTypes:
-            self.__responders[evt] = []
+        self.__responders = ResponderRegistry(self._dynamicEventTypes,
+                                              EventProfiler.get())
 
-        self.__currIdleTime = 0
+        self.__lastInputTime = time.time()
         self.__idling = False
 
+        # Heap of (time, sequence number, function) tuples of the
+        # functions to call on the first timer event after the given
+        # time; see scheduleTimerCall().
+        self.__timerCalls = []
+        self.__timerCallsLock = threading.Lock()
+        self.__timerCallCount = 0
+
     def createEventType(self, typeName):
         """
         Creates a new event type to be responded to.
@@ -199,7 +338,7 @@ class EventManager(input.InputManager):
         """
         assert typeName not in self._dynamicEventTypes,\
             "dynamic-event-type '%s' has been already created." % typeName
-        self.__responders[typeName] = []
+        self.__responders.addEventType(typeName)
         self._dynamicEventTypes.append(typeName)
 
     def triggerEvent(self, eventType, *args, **kwargs):
@@ -210,10 +349,10 @@ class EventManager(input.InputManager):
             "dynamic-event-type '%s' is uknown" % eventType
         perf = []
 
-        # Act on copy of the responders list, as the responder function might
-        # change the original list (by calling registerResponder or removeReponder)
-        # while we are iterating over it
-        for func in self.__responders[eventType][:]:
+        # The responder functions might change the responders (by
+        # calling registerResponder or removeReponder) while we are
+        # iterating over them; the registry gives us a snapshot.
+        for func in self.__responders.get(eventType):
             started = time.time()
             try:
                 sub_perf = func(*args, **kwargs)
@@ -228,11 +367,11 @@ class EventManager(input.InputManager):
 
     def getResponders(self, eventType):
         """
-        Returns a list of all responders of the given type.
+        Returns a tuple of all responders of the given type.
         """
         assert eventType in self._dynamicEventTypes,\
             "dynamic-event-type '%s' is uknown" % eventType
-        return self.__responders[eventType]
+        return self.__responders.get(eventType)
 
     def registerResponder(self, responderFunc, eventType):
         """
@@ -240,11 +379,10 @@ class EventManager(input.InputManager):
         """
         assert eventType in self._dynamicEventTypes,\
             "dynamic-event-type '%s' is uknown" % eventType
-        assert responderFunc not in self.getResponders(eventType),\
+        assert not self.__responders.has(eventType, responderFunc),\
             "responder-function '%s' for event-type '%s' is already registered in the responder"\
             % (responderFunc.__name__, eventType)
 
-        responderList = self.__responders[eventType]
         assert logging.debug("Added a responder function!") or True
 
         # If this is a dismissal responder and we don't currently have
@@ -253,8 +391,12 @@ class EventManager(input.InputManager):
         if eventType in ["dismissal", "mousemove"]:
             self.enableMouseEvents(True)  # IGNORE:E1101
 
-        # Wrap the responder-function to provide is_running() function
-        responderList.append(EventResponderFuncWrapper(responderFunc))
+        # The registry wraps the responder-function to provide
+        # is_running() function
+        self.__responders.add(eventType, responderFunc)
+
+        if eventType == "timer":
+            self.__onTickDemandChanged()
 
     def removeResponder(self, responderFunc, sync=False):
         """
@@ -262,43 +404,98 @@ class EventManager(input.InputManager):
 
         NOTE: Removes responderFunc from responding to ALL types of events.
         """
-        def removeResponderFunc(responderList, responderFunc, sync):
-            # Update original list
-            responderList.remove(responderFunc)
-            assert logging.debug(
-                "Removed a responder function %s!", responderFunc.__name__) or True
-            if sync:
+        removed = self.__responders.remove(responderFunc)
+        if not removed:
+            return
+        assert logging.debug(
+            "Removed a responder function %s!", responderFunc.__name__) or True
+
+        if sync:
+            for eventType, wrapper in removed:
                 try:
                     assert logging.debug(
-                        "Syncing %s responder wrapper", responderFunc) or True
-                    while responderFunc.is_running():
+                        "Syncing %s responder wrapper", wrapper) or True
+                    while wrapper.is_running():
                         # This is mandatory, otherwise the performance goes down
                         time.sleep(0.01)
                 except Exception:
                     logging.error(
                         "Error calling is_running() function for responder-wrapper %s",
-                        responderFunc
+                        wrapper
                     )
-            
-        for eventType in self.__responders.keys():
-            # Save the original list...
-            responderList = self.__responders[eventType]
-            # ...and iterate over its copy
-            for responderWrapper in self.__responders[eventType][:]:
-                # Unregister responder-function
-                if responderWrapper == responderFunc:
-                    removeResponderFunc(responderList, responderWrapper, sync)
-                    break
 
-        if eventType in ["dismissal", "mousemove"]:
+        if any(eventType in ["dismissal", "mousemove"]
+               for eventType, wrapper in removed):
             # If we're removing our only dismissal responder,
             # disable mouse events since we only need to know
             # about them for the purposes of dismissal events.
-            numMouseResponders = len(self.__responders["mousemove"])
-            numDismissResponders = len(self.__responders["dismissal"])
-            if (numMouseResponders + numDismissResponders) == 0:
+            if not (self.__responders.get("mousemove")
+                    or self.__responders.get("dismissal")):
                 self.enableMouseEvents(False)  # IGNORE:E1101
 
+    def scheduleTimerCall(self, func, msFromNow=0):
+        """
+        Calls func (with no arguments) on the first timer event at
+        least msFromNow milliseconds from now, making sure that there
+        is one even when no timer responders are registered.  Unlike
+        the other methods, this one may be called from any thread.
+        """
+        with self.__timerCallsLock:
+            self.__timerCallCount += 1
+            heapq.heappush(self.__timerCalls, (
+                time.time() + msFromNow / 1000.0,
+                self.__timerCallCount,
+                func
+            ))
+        self.__onTickDemandChanged()
+
+    def getTickDelay(self):
+        """
+        Returns the number of milliseconds until a timer event is
+        next needed: 0 while there are timer responders, and otherwise
+        the time until the next scheduled call or the idle timeout, or
+        None if no timer event is needed until the next input event.
+        Input managers which can suspend their timer use this to only
+        run it on demand.
+        """
+        if self.__responders.get("timer"):
+            return 0
+
+        now = time.time()
+        deadlines = []
+        if not self.__idling:
+            deadlines.append(self.__lastInputTime + IDLE_TIMEOUT)
+        with self.__timerCallsLock:
+            if self.__timerCalls:
+                deadlines.append(self.__timerCalls[0][0])
+        if not deadlines:
+            return None
+        return max(0, int((min(deadlines) - now) * 1000))
+
+    def __onTickDemandChanged(self):
+        """
+        Tells the input manager, if it can suspend its timer, that a
+        timer event may be needed sooner than it thinks.
+        """
+        wakeTimer = getattr(self, "wakeTimer", None)
+        if wakeTimer is not None:
+            wakeTimer()
+
+    def __runTimerCalls(self):
+        """
+        Calls the scheduled functions whose time has come.
+        """
+        now = time.time()
+        dueCalls = []
+        with self.__timerCallsLock:
+            while self.__timerCalls and self.__timerCalls[0][0] <= now:
+                dueCalls.append(heapq.heappop(self.__timerCalls)[2])
+        for func in dueCalls:
+            try:
+                func()
+            except Exception as e:
+                logging.error(e)
+
     def run(self):
         """
         Runs the main event loop.
@@ -315,7 +512,7 @@ class EventManager(input.InputManager):
         High-level event handler called whenever we haven't received
         any useful input events for IDLE_TIMEOUT seconds.
         """
-        for func in self.__responders["idle"]:
+        for func in self.__responders.get("idle"):
             func()
 
     def onInit(self):
@@ -323,7 +520,7 @@ class EventManager(input.InputManager):
         Low-level event handler called as soon as the event manager
         starts running.
         """
-        for func in self.__responders["init"]:
+        for func in self.__responders.get("init"):
             func()
 
     def onExitRequested(self):
@@ -339,9 +536,10 @@ class EventManager(input.InputManager):
         number of milliseconds passed since the last onTick() call is
         passed in, although this value may not be 100% accurate.
         """
-        self.__currIdleTime += msPassed
-
-        if self.__currIdleTime >= 1000 * IDLE_TIMEOUT:
+        # The timer may not run while nothing needs it, so the idle
+        # time is measured by the clock rather than by adding up
+        # msPassed.
+        if time.time() - self.__lastInputTime >= IDLE_TIMEOUT:
             if not self.__idling:
                 self.__idling = True
                 try:
@@ -351,7 +549,10 @@ class EventManager(input.InputManager):
         elif self.__idling:
             self.__idling = False
 
-        for func in self.__responders["timer"]:
+        if self.__timerCalls:
+            self.__runTimerCalls()
+
+        for func in self.__responders.get("timer"):
             func(msPassed)
 
     def onTrayMenuItem(self, menuId):
@@ -360,7 +561,7 @@ class EventManager(input.InputManager):
         menu item on the popup menu of the Tray Icon.
         """
         self._onDismissalEvent()
-        for func in self.__responders["traymenu"]:
+        for func in self.__responders.get("traymenu"):
             func(menuId)
 
     def _onDismissalEvent(self):
@@ -368,10 +569,13 @@ class EventManager(input.InputManager):
         High-level event handler called whenever a keypress, mouse
         movement, or mouse button click is made.
         """
-        self.__currIdleTime = 0
-        self.__idling = False
+        self.__lastInputTime = time.time()
+        if self.__idling:
+            self.__idling = False
+            # The next idle timeout needs a timer event again.
+            self.__onTickDemandChanged()
 
-        for func in self.__responders["dismissal"]:
+        for func in self.__responders.get("dismissal"):
             func()
 
     def onKeypress(self, eventType, keyCode):
@@ -379,11 +583,8 @@ class EventManager(input.InputManager):
         Low-level event handler called whenever a quasimodal keypress
         is made.
         """
-        self.__currIdleTime = 0
-        self.__idling = False
-
         self._onDismissalEvent()
-        for func in self.__responders["key"]:
+        for func in self.__responders.get("key"):
             func(eventType, keyCode)
 
         # The following message may be used by system tests.
@@ -396,7 +597,7 @@ class EventManager(input.InputManager):
         passed in.
         """
         self._onDismissalEvent()
-        for func in self.__responders["mousemove"]:
+        for func in self.__responders.get("mousemove"):
             func(x, y)
 
     def onSomeMouseButton(self):
@@ -411,6 +612,6 @@ class EventManager(input.InputManager):
         Low-level event handler called whenever a non-quasimodal
         keypress is made.
         """
-        for func in self.__responders["somekey"]:
+        for func in self.__responders.get("somekey"):
             func()
         self._onDismissalEvent()
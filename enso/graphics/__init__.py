@@ -13,6 +13,13 @@ __desktop_size = None
 __workarea_offset = None
 __workarea_size = None
 
+# The backend's geometry generation and current monitor when the
+# above were last fetched.  Backends that watch the screen for
+# geometry changes provide getGeometryGeneration(), which returns a
+# number that changes whenever the geometry may have changed.
+__geometry_generation = None
+__current_monitor = None
+
 
 def refreshDesktopOffset():
     global __desktop_offset
@@ -56,13 +63,58 @@ def refreshWorkareaInfo():
     refreshWorkareaSize()
 
 
+def _getGeometryGeneration():
+    getGeometryGeneration = getattr(_graphics, "getGeometryGeneration", None)
+    if getGeometryGeneration is None:
+        return None
+    return getGeometryGeneration()
+
+
+def _isGeometryOutdated():
+    """
+    Returns whether the backend tells that the cached desktop and
+    workarea info may be out of date.
+    """
+    generation = _getGeometryGeneration()
+    return generation is not None and generation != __geometry_generation
+
+
+def _refreshGeometry(generation, monitor):
+    global __geometry_generation, __current_monitor
+    refreshDesktopInfo()
+    refreshWorkareaInfo()
+    __geometry_generation = generation
+    __current_monitor = monitor
+
+
+def updateDesktopInfo():
+    """
+    Makes sure that the cached desktop and workarea info is up to date
+    and describes the current monitor.  Unlike refreshDesktopInfo()
+    and refreshWorkareaInfo(), it only queries the backend again if
+    the backend tells that the geometry or the current monitor
+    changed; backends that cannot tell are always queried.
+    """
+    generation = _getGeometryGeneration()
+    getCurrentMonitor = getattr(_graphics, "getCurrentMonitor", None)
+    monitor = getCurrentMonitor() if getCurrentMonitor else None
+    if (generation is None
+            or generation != __geometry_generation
+            or monitor != __current_monitor
+            or __desktop_size is None
+            or __workarea_size is None):
+        _refreshGeometry(generation, monitor)
+
+
 def getDesktopOffset(force_refresh=False):
     """ Return primary monitor desktop offset in points. 
     WARNING: This is very expensive operation on Linux
     We cache it here. Call refreshWorkareaSize() to refresh the cache.
     """
     global __desktop_offset
-    if __desktop_offset is None or force_refresh:
+    if _isGeometryOutdated():
+        _refreshGeometry(_getGeometryGeneration(), __current_monitor)
+    elif __desktop_offset is None or force_refresh:
         refreshDesktopOffset()
     return __desktop_offset
 
@@ -73,7 +125,9 @@ def getDesktopSize(force_refresh=False):
     We cache it here. Call refreshWorkareaSize() to refresh the cache.
     """
     global __desktop_size
-    if __desktop_size is None or force_refresh:
+    if _isGeometryOutdated():
+        _refreshGeometry(_getGeometryGeneration(), __current_monitor)
+    elif __desktop_size is None or force_refresh:
         refreshDesktopSize()
     return __desktop_size
 
@@ -86,7 +140,9 @@ def getWorkareaOffset(force_refresh=False):
     We cache it here. Call refreshWorkareaSize() to refresh the cache.
     """
     global __workarea_offset
-    if __workarea_offset is None or force_refresh:
+    if _isGeometryOutdated():
+        _refreshGeometry(_getGeometryGeneration(), __current_monitor)
+    elif __workarea_offset is None or force_refresh:
         refreshWorkareaOffset()
     return __workarea_offset
 
@@ -99,7 +155,9 @@ def getWorkareaSize(force_refresh=False):
     We cache it here. Call refreshWorkareaSize() to refresh the cache.
     """
     global __workarea_size
-    if __workarea_size is None or force_refresh:
+    if _isGeometryOutdated():
+        _refreshGeometry(_getGeometryGeneration(), __current_monitor)
+    elif __workarea_size is None or force_refresh:
         refreshWorkareaSize()
     return __workarea_size
 
@@ -46,8 +46,12 @@
 
 from __future__ import division
 
+import hashlib
 import logging
+import os
+import struct
 import sys
+from array import array
 
 import enso
 from enso import cairo, config
@@ -57,6 +61,100 @@ from enso.utils.memoize import memoized
 _graphics = enso.providers.getInterface("graphics")
 
 
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# The glyph metrics atlas measures characters in blocks of this many
+# consecutive code points (a power of two).
+ATLAS_BLOCK_SIZE = 128
+
+# Whether glyph metrics atlases are saved in the Enso cache directory,
+# so that later processes do not have to measure the characters again.
+PERSIST_GLYPH_METRICS = True
+
+# Subdirectory of the Enso cache directory holding the atlas files.
+ATLAS_CACHE_DIR_NAME = "glyph_metrics"
+
+
+# ----------------------------------------------------------------------------
+# Font Options
+# ----------------------------------------------------------------------------
+
+# The cairo font options built from enso.config, keyed by the config
+# values they were built from.
+_fontOptions = {}
+
+
+def _getFontOptions():
+    """
+    Returns the cairo FontOptions object reflecting the font settings
+    in enso.config, or None if none of them could be applied.  The
+    object is built once and shared by all fonts.
+    """
+
+    key = (getattr(config, "FONT_ANTIALIASING", None),
+           getattr(config, "FONT_HINTING", None))
+    try:
+        return _fontOptions[key]
+    except KeyError:
+        pass
+
+    fo = cairo.FontOptions()  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+    font_options_set = False
+    try:
+        font_antialias = config.FONT_ANTIALIASING.lower()
+        fo.set_antialias(
+            {
+                "default": cairo.ANTIALIAS_DEFAULT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                "none": cairo.ANTIALIAS_NONE,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                "gray": cairo.ANTIALIAS_GRAY,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                "subpixel": cairo.ANTIALIAS_SUBPIXEL  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+            }[font_antialias]
+        )
+    except Exception as e:
+        do_once(
+            logging.warning,
+            "Error setting the font antialiasing method to %s; %s",
+            font_antialias,
+            e
+        )
+    else:
+        font_options_set = True
+
+    try:
+        fo.set_hint_metrics(cairo.HINT_METRICS_ON)  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+    except Exception as e:
+        do_once(
+            logging.warning,
+            "Error enabling the font hint metrics: %s",
+            e
+        )
+    else:
+        font_hint_style = None
+        try:
+            font_hint_style = config.FONT_HINTING.lower()
+            fo.set_hint_style(
+                {
+                    "default": cairo.HINT_STYLE_DEFAULT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                    "none": cairo.HINT_STYLE_NONE,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                    "slight": cairo.HINT_STYLE_SLIGHT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                    "medium": cairo.HINT_STYLE_MEDIUM,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                    "full": cairo.HINT_STYLE_FULL  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+                }[font_hint_style]
+            )
+        except Exception as e:
+            logging.error("Error setting the font hinting method to %s; %s", font_hint_style, e)
+        else:
+            font_options_set = True
+
+    if not font_options_set:
+        fo = None
+
+    _fontOptions[key] = fo
+    return fo
+
+
 # ----------------------------------------------------------------------------
 # Fonts
 # ----------------------------------------------------------------------------
@@ -72,12 +170,15 @@ class Font(object):
         'ascent',
         'cairoContext',
         'descent',
+        'font_file',
         'font_name',
         'font_opts',
+        'glyphs',
         'height',
         'isItalic',
         'maxXAdvance',
         'maxYAdvance',
+        'metricsAtlas',
         'name',
         'size',
         'slant',
@@ -93,9 +194,12 @@ class Font(object):
         self.name = name
         self.size = size
         self.isItalic = isItalic
+        self.font_file = None
         self.font_name = None
         self.font_opts = {}
-        
+        self.glyphs = {}
+        self.metricsAtlas = None
+
         if self.isItalic:
             self.slant = cairo.FONT_SLANT_ITALIC  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
         else:
@@ -132,13 +236,28 @@ class Font(object):
         """
         return cls(name, size, isItalic)
 
-    @memoized
     def getGlyph(self, char):
         """
         Returns a glyph of the font corresponding to the given Unicode
         character.
         """
-        return FontGlyph(char, self, self.cairoContext)
+        try:
+            return self.glyphs[char]
+        except KeyError:
+            glyph = self.glyphs[char] = FontGlyph(char, self)
+            _atlasStats["glyphsCreated"] += 1
+            return glyph
+
+    def getMetricsAtlas(self):
+        """
+        Returns the GlyphMetricsAtlas of this font.
+        """
+        if self.metricsAtlas is None:
+            fileName = None
+            if PERSIST_GLYPH_METRICS:
+                fileName = GlyphMetricsAtlas.getCacheFileName(self)
+            self.metricsAtlas = GlyphMetricsAtlas(self, fileName)
+        return self.metricsAtlas
 
     def getKerningDistance(self, charLeft, charRight):
         """
@@ -192,8 +311,11 @@ class Font(object):
             Find out if the font with given font_id exists on the system
             Font_id is the font name like "Input Consensed Light" or "Arial"
             """
-            if sys.platform.startswith("win"):
-                return _graphics.FontRegistry.get().get_font_detail(font_id) is not None
+            if hasattr(_graphics, "FontRegistry"):
+                font_detail = _graphics.FontRegistry.get().get_font_detail(font_id)
+                if font_detail:
+                    self.font_file = font_detail.filepath
+                return font_detail is not None
             else:
                 # FIXME: Provide OSX code
                 from enso.platform.linux.utils import get_cmd_output
@@ -232,72 +354,22 @@ class Font(object):
             self.font_name = font_name
             self.font_opts = font_opts
 
+            # Log the used font name once
+            if font_name:
+                do_once(
+                    logging.info,
+                    "Using font ({0}): {1}".format(
+                        "italic" if self.isItalic else "normal",
+                        self.font_name)
+                )
+
         # Still not set, leave default
         if not self.font_name:
             return
 
-        # Log the used font name once            
-        if self.isItalic:
-            do_once(
-                logging.info,
-                "Using font (italic): {0}".format(self.font_name)
-            )
-        else:
-            do_once(
-                logging.info,
-                "Using font (normal): {0}".format(self.font_name)
-            )
-
         # Set custom font options from enso.config, if possible
-        fo = cairo.FontOptions()  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-        font_options_set = False
-        try:
-            font_antialias = config.FONT_ANTIALIASING.lower()
-            fo.set_antialias(
-                {
-                    "default": cairo.ANTIALIAS_DEFAULT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                    "none": cairo.ANTIALIAS_NONE,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                    "gray": cairo.ANTIALIAS_GRAY,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                    "subpixel": cairo.ANTIALIAS_SUBPIXEL  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                }[font_antialias]
-            )
-        except Exception as e:
-            do_once(
-                logging.warning,
-                "Error setting the font antialiasing method to %s; %s",
-                font_antialias,
-                e
-            )
-        else:
-            font_options_set = True
-
-        try:
-            fo.set_hint_metrics(cairo.HINT_METRICS_ON)  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-        except Exception as e:
-            do_once(
-                logging.warning,
-                "Error enabling the font hint metrics: %s",
-                e
-            )
-        else:
-            font_hint_style = None
-            try:
-                font_hint_style = config.FONT_HINTING.lower()
-                fo.set_hint_style(
-                    {
-                        "default": cairo.HINT_STYLE_DEFAULT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                        "none": cairo.HINT_STYLE_NONE,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                        "slight": cairo.HINT_STYLE_SLIGHT,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                        "medium": cairo.HINT_STYLE_MEDIUM,  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                        "full": cairo.HINT_STYLE_FULL  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
-                    }[font_hint_style]
-                )
-            except Exception as e:
-                logging.error("Error setting the font hinting method to %s; %s", font_hint_style, e)
-            else:
-                font_options_set = True
-
-        if font_options_set:
+        fo = _getFontOptions()
+        if fo is not None:
             try:
                 cairoContext.set_font_options(fo)
             except Exception as e:
@@ -313,6 +385,266 @@ class Font(object):
         cairoContext.set_font_size(self.size)
 
 
+# ----------------------------------------------------------------------------
+# Glyph Metrics Atlas
+# ----------------------------------------------------------------------------
+
+# Counts of the work done by all glyph metrics atlases.
+_atlasStats = {
+    "blocksMeasured": 0,
+    "blocksLoaded": 0,
+    "glyphsCreated": 0,
+}
+
+
+def getGlyphMetricsStats():
+    """
+    Returns a dict counting the blocks of characters measured with
+    cairo and the blocks loaded from atlas files by all glyph metrics
+    atlases, and the FontGlyph objects created from them.
+    """
+
+    return dict(_atlasStats)
+
+
+class GlyphMetricsAtlas(object):
+    """
+    Stores the cairo text extents of the characters of a font.
+
+    Measuring a character takes a round trip through cairo, and
+    setting up the font for it used to cost even more, so the atlas
+    measures whole blocks of ATLAS_BLOCK_SIZE consecutive code points
+    with one font setup and keeps their extents in a flat array of
+    single-precision floats per block.  The blocks can be saved to a
+    file, keyed by the font face, size and rendering options, so that
+    a new Enso process does not have to measure them again.  Blocks
+    measured later are appended to the file.
+    """
+
+    # Number of values stored per character; these are the values
+    # returned by cairo's text_extents(), in the same order.
+    VALUES = 6
+
+    # The file starts with this magic string, followed by each block
+    # as a little-endian 32-bit block number and the block's values as
+    # little-endian 32-bit floats.
+    FILE_MAGIC = "EnsoGMA1"
+
+    def __init__(self, font, fileName=None):
+        """
+        Creates an atlas for the given Font object, loading the
+        blocks saved in fileName, if any.  If fileName is None, the
+        atlas is not persisted.
+        """
+
+        self.__font = font
+        self.__fileName = fileName
+        self.__blocks = {}
+        # Whether the file holds valid records that blocks can be
+        # appended to.
+        self.__fileIsValid = False
+
+        # User can specify custom spacing between letters
+        xAdvanceModifier = 1.0
+        try:
+            xAdvanceModifier = font.font_opts.get("xAdvanceModifier", xAdvanceModifier) * 1.0
+        except:
+            pass
+        if xAdvanceModifier < 0.5 or xAdvanceModifier > 1.5:
+            logging.error("config.FONT_NAME option 'xAdvanceModifier' must be decimal number between 0.0 and 1.0")
+            xAdvanceModifier = 1.0
+        self.xAdvanceModifier = xAdvanceModifier
+
+        if fileName is not None and os.path.isfile(fileName):
+            self.__load()
+
+    @classmethod
+    def getCacheFileName(cls, font):
+        """
+        Returns the name of the file in which the atlas of the given
+        Font object is saved.
+        """
+
+        key = repr((
+            font.font_name,
+            cls.__getFontFileStamp(font),
+            font.size,
+            font.isItalic,
+            getattr(config, "FONT_ANTIALIASING", None),
+            getattr(config, "FONT_HINTING", None),
+            cairo.cairo_version(),  # IGNORE:E1101 @UndefinedVariable Keep PyLint and PyDev happy
+            ATLAS_BLOCK_SIZE,
+        ))
+        return os.path.join(
+            enso.providers.getInterface("system").get_enso_cache_dir(),
+            ATLAS_CACHE_DIR_NAME,
+            "%s.metrics" % hashlib.md5(key).hexdigest()
+        )
+
+    @staticmethod
+    def __getFontFileStamp(font):
+        """
+        Returns the path, modification time and size of the file of
+        the given Font object, so that its saved atlas is not used
+        once the font behind its name changes, or None if the file is
+        not known.
+        """
+
+        fontFile = font.font_file
+        if fontFile is None and font.font_name:
+            if os.path.isfile(font.font_name):
+                # The font name is the file name on Windows.
+                fontFile = font.font_name
+            elif hasattr(_graphics, "FontRegistry"):
+                fontDetail = _graphics.FontRegistry.get().get_font_detail(
+                    font.font_name)
+                if fontDetail:
+                    fontFile = fontDetail.filepath
+        if fontFile is None:
+            return None
+
+        try:
+            fileStat = os.stat(fontFile)
+        except OSError:
+            return fontFile
+        return fontFile, fileStat.st_mtime, fileStat.st_size
+
+    def getExtents(self, char):
+        """
+        Returns the (xBearing, yBearing, width, height, xAdvance,
+        yAdvance) extents of the given Unicode character.
+        """
+
+        code = ord(char)
+        blockNumber = code // ATLAS_BLOCK_SIZE
+        block = self.__blocks.get(blockNumber)
+        if block is None:
+            block = self.__measureBlock(blockNumber)
+        offset = (code % ATLAS_BLOCK_SIZE) * self.VALUES
+        return block[offset:offset + self.VALUES]
+
+    def __measureBlock(self, blockNumber):
+        """
+        Measures all characters of the given block with cairo.
+        """
+
+        font = self.__font
+        cairoContext = font.cairoContext
+        textExtents = cairoContext.text_extents
+        noExtents = (0.0,) * self.VALUES
+
+        block = array("f")
+        cairoContext.save()
+        try:
+            font.loadInto(cairoContext)
+            first = blockNumber * ATLAS_BLOCK_SIZE
+            for code in xrange(first, first + ATLAS_BLOCK_SIZE):
+                try:
+                    block.extend(textExtents(unichr(code).encode("UTF-8")))
+                except Exception:
+                    # Not a character cairo can measure (e.g., a lone
+                    # surrogate); it is never drawn anyway.
+                    block.extend(noExtents)
+        finally:
+            cairoContext.restore()
+
+        self.__blocks[blockNumber] = block
+        _atlasStats["blocksMeasured"] += 1
+        if self.__fileName is not None:
+            if self.__fileIsValid:
+                self.__append(blockNumber, block)
+            else:
+                self.__save()
+        return block
+
+    def __load(self):
+        try:
+            with open(self.__fileName, "rb") as f:
+                data = f.read()
+        except IOError as e:
+            logging.warning("Error reading glyph metrics %s; %s",
+                            self.__fileName, e)
+            return
+
+        magic = self.FILE_MAGIC
+        headerSize = struct.calcsize("<I")
+        blockBytes = ATLAS_BLOCK_SIZE * self.VALUES * array("f").itemsize
+        recordSize = headerSize + blockBytes
+        if not data.startswith(magic):
+            logging.warning("Ignoring invalid glyph metrics file %s",
+                            self.__fileName)
+            return
+        if (len(data) - len(magic)) % recordSize:
+            # An append was cut short; the file is rewritten with the
+            # complete records when the next block is measured.
+            logging.warning("Ignoring a truncated record in glyph "
+                            "metrics file %s", self.__fileName)
+        else:
+            self.__fileIsValid = True
+
+        end = len(data) - (len(data) - len(magic)) % recordSize
+        for position in xrange(len(magic), end, recordSize):
+            blockNumber, = struct.unpack_from("<I", data, position)
+            block = array("f")
+            block.fromstring(
+                data[position + headerSize:position + recordSize])
+            if sys.byteorder != "little":
+                block.byteswap()
+            self.__blocks[blockNumber] = block
+            _atlasStats["blocksLoaded"] += 1
+
+    @staticmethod
+    def __packBlock(blockNumber, block):
+        """
+        Returns the file record of the given block.
+        """
+
+        if sys.byteorder != "little":
+            block = array("f", block)
+            block.byteswap()
+        return struct.pack("<I", blockNumber) + block.tostring()
+
+    def __append(self, blockNumber, block):
+        """
+        Appends the given block to the atlas file.  Other processes
+        may append the same block; the last record of a block wins.
+        """
+
+        try:
+            with open(self.__fileName, "ab") as f:
+                f.write(self.__packBlock(blockNumber, block))
+        except (IOError, OSError) as e:
+            logging.warning("Error saving glyph metrics %s; %s",
+                            self.__fileName, e)
+            self.__fileIsValid = False
+
+    def __save(self):
+        """
+        Atomically replaces the atlas file with the current blocks.
+        """
+
+        records = [self.FILE_MAGIC]
+        for blockNumber, block in sorted(self.__blocks.iteritems()):
+            records.append(self.__packBlock(blockNumber, block))
+
+        fileName = self.__fileName
+        tempFileName = "%s.%d.tmp" % (fileName, os.getpid())
+        try:
+            directory = os.path.dirname(fileName)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tempFileName, "wb") as f:
+                f.write("".join(records))
+            if sys.platform.startswith("win") and os.path.exists(fileName):
+                # Windows does not replace existing files on rename.
+                os.remove(fileName)
+            os.rename(tempFileName, fileName)
+            self.__fileIsValid = True
+        except (IOError, OSError) as e:
+            logging.warning("Error saving glyph metrics %s; %s",
+                            fileName, e)
+
+
 # ----------------------------------------------------------------------------
 # Font Glyphs
 # ----------------------------------------------------------------------------
@@ -336,11 +668,10 @@ class FontGlyph(object):
         'yMin',
     )
 
-    def __init__(self, char, font, cairoContext):
+    def __init__(self, char, font):
         """
         Creates the font glyph corresponding to the given Unicode
-        character, using the font specified by the given Font object
-        and the given cairo context.
+        character, using the font specified by the given Font object.
         """
 
         # Encode the character to UTF-8 because that's what the cairo
@@ -349,28 +680,15 @@ class FontGlyph(object):
         self.char = char
         self.font = font
 
-        cairoContext.save()
-
-        self.font.loadInto(cairoContext)
-
         # Make our font glyph metrics information visible to the client.
 
-        # User can specify custom spacing between letters
-        xAdvanceModifier = 1.0
-        try:
-            xAdvanceModifier = self.font.font_opts.get("xAdvanceModifier", xAdvanceModifier) * 1.0
-        except:
-            pass
-        if xAdvanceModifier < 0.5 or xAdvanceModifier > 1.5:
-            logging.error("config.FONT_NAME option 'xAdvanceModifier' must be decimal number between 0.0 and 1.0")
-            xAdvanceModifier = 1.0
-
+        atlas = font.getMetricsAtlas()
         (xBearing,
          yBearing,
          width,
          height,
          xAdvance,
-         yAdvance) = cairoContext.text_extents(self.charAsUtf8)
+         yAdvance) = atlas.getExtents(char)
         # The xMin, xMax, yMin, yMax, and advance attributes are used
         # here to correspond to their values in this image:
         # http://freetype.sourceforge.net/freetype2/docs/glyphs/Image3.png
@@ -381,6 +699,4 @@ class FontGlyph(object):
         self.xMax = (xBearing + width)
         self.yMin = -yBearing + height
         self.yMax = -yBearing
-        self.advance = xAdvance * xAdvanceModifier
-
-        cairoContext.restore()
+        self.advance = xAdvance * atlas.xAdvanceModifier
@@ -55,6 +55,8 @@
 
 from __future__ import division
 
+from bisect import bisect_right
+
 # ----------------------------------------------------------------------------
 # The Document Element
 # ----------------------------------------------------------------------------
@@ -139,7 +141,9 @@ class Block(object):
     __slots__ = (
         '__dict__',
         '__weakref__',
-        '__glyphs',
+        '__colors',
+        '__fontGlyphs',
+        '__text',
         'ellipsify',
         'ellipsisGlyph',
         'height',
@@ -177,9 +181,12 @@ class Block(object):
         self.maxLines = maxLines
         self.ellipsify = ellipsify
 
-        # Temporary list of glyphs that need to be laid out into
-        # lines.
-        self.__glyphs = []
+        # Temporary lists of the text that needs to be laid out into
+        # lines: its pieces, and the font glyph and color of each of
+        # its characters.
+        self.__text = []
+        self.__fontGlyphs = []
+        self.__colors = []
 
         # List of lines in the block.
         self.lines = []
@@ -204,7 +211,21 @@ class Block(object):
         """
         Adds the given glyphs to the block.
         """
-        self.__glyphs.extend(glyphs)
+
+        for glyph in glyphs:
+            self.addText(glyph.char, glyph.font, glyph.color)
+
+    def addText(self, text, font, color):
+        """
+        Adds a run of the given Unicode text, in the given font and
+        color, to the block.  Unlike addGlyphs(), no Glyph objects are
+        made until the text is laid out, and then only for the text
+        that ends up on a line.
+        """
+
+        self.__text.append(text)
+        self.__fontGlyphs.extend(map(font.getGlyph, text))
+        self.__colors.extend([color] * len(text))
 
     def __addLine(self, line, isPartialLine=False):
         """
@@ -224,113 +245,89 @@ class Block(object):
         line.layout(alignment, self.width, self.lineHeight)
         self.lines.append(line)
 
+    def __makeLine(self, start, end):
+        """
+        Private method that returns a new line holding the characters
+        of the block text from index 'start' up to 'end'.
+        """
+
+        line = Line()
+        line.addGlyphs([
+            Glyph(fontGlyph, color)
+            for fontGlyph, color in zip(self.__fontGlyphs[start:end],
+                                        self.__colors[start:end])
+        ])
+        return line
+
     def layout(self):
         """
         Lays out the block. This method should be called before the
         block is drawn, yet after all glyphs have been added to the
         block.
-        """
 
-        currLineLength = 0
-        currWordStartIndex = 0
-        currWordLength = 0
-        currLine = Line()
-
-        for i in range(len(self.__glyphs)):
-            assert(currLineLength >= currWordLength)
-
-            glyph = self.__glyphs[i]
-            advance = glyph.fontGlyph.advance
-
-            if currLineLength + advance > self.width:
-                # If we don't have *any* characters on this line yet,
-                # that means the glyph advance is greater than this
-                # block's width--we're in big trouble!
-                if currLineLength == 0:
-                    raise GlyphWiderThanBlockError(glyph)
-
-                # Time to make a new line.
-
-                if len(self.lines) == self.maxLines - 1:
-                    # We've hit the max # of lines!
-                    if not self.ellipsify:
-                        raise MaxLinesExceededError()
-                    else:
-                        # We'll put an ellipsis at the end of this
-                        # line and then break out of this loop,
-                        # ignoring the rest of the glyphs.
-                        currLine.addGlyphs(
-                            self.__glyphs[currWordStartIndex:i]
-                        )
-                        currWordLength = 0
-                        currLine.ellipsify(self.ellipsisGlyph,
-                                           self.width)
-                        break
-
-                # Determine whether our current line has a word in it.
-                currLineHasWord = (currLineLength != currWordLength)
-
-                # If our current line has no words in it, just add
-                # what we've got so far (not including the glyph we're
-                # looking at) and count it as a "word".
-
-                # Alternatively, if this character is whitespace, then
-                # we're at the end of a word; we'll effectively
-                # replace the whitespace with a newline.
-                if not currLineHasWord or glyph.isWhitespace:
-                    currLine.addGlyphs(
-                        self.__glyphs[currWordStartIndex:i]
-                    )
-
-                    # If the current character we're looking at is
-                    # whitespace, pretend it doesn't exist because
-                    # we're at the end of a line.
-                    if glyph.isWhitespace:
-                        currWordStartIndex = i + 1
-                        currWordLength = 0
-                    else:
-                        currWordStartIndex = i
-                        currWordLength = advance
-                else:
-                    # This character is part of a word.
-                    currWordLength += advance
-
-                # Now, create a new line.
-                self.__addLine(currLine)
-                currLineLength = currWordLength
-                currLine = Line()
-            elif glyph.isWhitespace:
-                # We've reached the end of our word, and the beginning
-                # of another.  Add this word, including this
-                # whitespace character, to the current line.
-                currLine.addGlyphs(
-                    self.__glyphs[currWordStartIndex:i + 1]
+        Rather than looking at every character, the text is broken
+        into lines by bisecting the cumulative advances of its
+        characters for the last one that fits on each line, and then
+        looking back from there for a space to break the line at.
+        """
+
+        text = u"".join(self.__text)
+        fontGlyphs = self.__fontGlyphs
+        textLength = len(text)
+
+        # advances[i] is the advance of the first i characters.
+        advances = [0.0]
+        total = 0.0
+        for fontGlyph in fontGlyphs:
+            total += fontGlyph.advance
+            advances.append(total)
+
+        start = 0
+        while start < textLength:
+            # The characters from start up to end fit on this line.
+            end = bisect_right(advances, advances[start] + self.width) - 1
+            if end >= textLength:
+                self.__addLine(self.__makeLine(start, textLength),
+                               isPartialLine=True)
+                break
+
+            if end == start:
+                # The glyph advance is greater than this block's
+                # width--we're in big trouble!
+                raise GlyphWiderThanBlockError(
+                    Glyph(fontGlyphs[start], self.__colors[start])
                 )
-                currLineLength += advance
-                currWordStartIndex = i + 1
-                currWordLength = 0
-            else:
-                # We're still building a word.
-                currLineLength += advance
-                currWordLength += advance
 
-            assert(currLineLength >= currWordLength)
-
-        assert(currLineLength >= currWordLength)
-
-        # Now that we're done looking through all the glyphs, we can
-        # safely add the last remaining word to the current line.
-        if currWordLength > 0:
-            currLine.addGlyphs(
-                self.__glyphs[currWordStartIndex:]
-            )
+            if len(self.lines) == self.maxLines - 1:
+                # We've hit the max # of lines!
+                if not self.ellipsify:
+                    raise MaxLinesExceededError()
+                # We'll put an ellipsis at the end of this line,
+                # ignoring the rest of the text.
+                line = self.__makeLine(start, end)
+                line.ellipsify(self.ellipsisGlyph, self.width)
+                self.__addLine(line, isPartialLine=True)
+                break
+
+            if text[end] == " ":
+                # The line ends just before a space, which we'll
+                # effectively replace with a newline.
+                nextStart = end + 1
+            else:
+                # Break the line after the last space on it, if any,
+                # and otherwise in the middle of the (long) word.
+                space = text.rfind(u" ", start, end)
+                if space >= 0:
+                    end = nextStart = space + 1
+                else:
+                    nextStart = end
 
-        # If our current (i.e., last) line has anything on it, we're
-        # going to add it to the block.
-        if currLineLength > 0:
-            self.__addLine(currLine, isPartialLine=True)
+            self.__addLine(self.__makeLine(start, end))
+            start = nextStart
 
-        self.__glyphs = None
+        self.__text = None
+        self.__fontGlyphs = None
+        self.__colors = None
         self.height = self.marginTop + \
             self.lineHeight * len(self.lines) + \
             self.marginBottom
@@ -657,3 +654,72 @@ class Glyph(object):
 
         char = self.char.encode("ascii", "replace")
         return "<TextLayout Glyph '%s'>" % char
+
+
+# ----------------------------------------------------------------------------
+# Size Fitting
+# ----------------------------------------------------------------------------
+
+def fitLargestSize(sizes, layout, fillRatio=None):
+    """
+    Finds the largest of the given sizes (font sizes or anything
+    else a layout depends on, in increasing order) at which
+    layout(size) succeeds, and returns (size, result of layout); if it
+    fails at every size, returns (None, None).
+
+    layout(size) fails by raising MaxLinesExceededError or
+    GlyphWiderThanBlockError, and must fail at every size above one at
+    which it fails.  Instead of trying the
+    sizes from the largest to the smallest, which takes a layout per
+    size that is too large, the sizes are bisected, which takes
+    O(log(len(sizes))) layouts.
+
+    If given, fillRatio(size) is a cheap estimate that does not
+    decrease with size and is above 1 only if layout(size) would
+    fail; the sizes are bisected with it first, so that usually, the
+    first layout is the last one needed.
+
+    Examples:
+
+    >>> def layout( size ):
+    ...     if size > 5:
+    ...         raise MaxLinesExceededError()
+    ...     return "laid out at %d" % size
+    >>> fitLargestSize( range( 10 ), layout )
+    (5, 'laid out at 5')
+    >>> fitLargestSize( range( 10 ), layout, lambda size: size / 7.0 )
+    (5, 'laid out at 5')
+    >>> fitLargestSize( range( 6, 10 ), layout )
+    (None, None)
+    """
+
+    # sizes[fit] is known to fit, and sizes[tooLarge] not to.
+    fit = -1
+    tooLarge = len(sizes)
+
+    if fillRatio is not None:
+        lower = fit
+        while tooLarge - lower > 1:
+            middle = (lower + tooLarge) // 2
+            if fillRatio(sizes[middle]) > 1:
+                tooLarge = middle
+            else:
+                lower = middle
+        probe = tooLarge - 1
+    else:
+        probe = (fit + tooLarge) // 2
+
+    result = None
+    while tooLarge - fit > 1:
+        try:
+            probeResult = layout(sizes[probe])
+        except (MaxLinesExceededError, GlyphWiderThanBlockError):
+            tooLarge = probe
+        else:
+            fit = probe
+            result = probeResult
+        probe = (fit + tooLarge) // 2
+
+    if fit < 0:
+        return None, None
+    return sizes[fit], result
@@ -213,6 +213,9 @@ class StyleRegistry(object):
 
         self._styleDict = {}
 
+        # Cached result of getFingerprint(); None when out of date.
+        self.__fingerprint = None
+
     def __validateKeys(self, style_dict):
         """
         Makes sure that the keys of dict are the names of valid style
@@ -254,6 +257,7 @@ class StyleRegistry(object):
 
         self.__validateKeys(properties)
         self._styleDict[selector] = properties
+        self.__fingerprint = None
 
     def findMatch(self, selector):
         """
@@ -294,7 +298,38 @@ class StyleRegistry(object):
         assert selector in self._styleDict
 
         self.__validateKeys(properties)
-        self._styleDict[selector].update(properties)
+        style = self._styleDict[selector]
+        for key, value in properties.iteritems():
+            if style.get(key, self) != value:
+                style.update(properties)
+                self.__fingerprint = None
+                break
+
+    def getFingerprint(self):
+        """
+        Returns a hashable value that is equal for two registries (or
+        for one registry at two points in time) if and only if they
+        define the same styles; used as a cache key for layouts.
+
+        Examples:
+
+        >>> styles = StyleRegistry()
+        >>> styles.add( 'document', width = '1000pt' )
+        >>> before = styles.getFingerprint()
+        >>> styles.update( 'document', width = '1000pt' )
+        >>> styles.getFingerprint() is before
+        True
+        >>> styles.update( 'document', width = '500pt' )
+        >>> styles.getFingerprint() == before
+        False
+        """
+
+        if self.__fingerprint is None:
+            self.__fingerprint = tuple(sorted(
+                (selector, tuple(sorted(properties.iteritems())))
+                for selector, properties in self._styleDict.iteritems()
+            ))
+        return self.__fingerprint
 
 
 class InvalidPropertyError(Exception):
@@ -440,20 +475,34 @@ class CascadingStyleStack(object):
 
         return block
 
-    def makeNewGlyphs(self, characters):
+    def getFont(self):
         """
-        Makes new glyphs with the current style.
+        Returns the font of the current style.
         """
 
-        glyphs = []
-
-        fontObj = font.Font.get(
+        return font.Font.get(
             self._property("font_family"),
             self._propertyToPoints("font_size"),
             self._property("font_style") == "italic"
         )
 
-        color = self._propertyToColor("color")
+    def getColor(self):
+        """
+        Returns the (r, g, b, a) color of the current style.
+        """
+
+        return self._propertyToColor("color")
+
+    def makeNewGlyphs(self, characters):
+        """
+        Makes new glyphs with the current style.
+        """
+
+        glyphs = []
+
+        fontObj = self.getFont()
+
+        color = self.getColor()
 
         for char in characters:
             fontGlyph = fontObj.getGlyph(char)
@@ -549,122 +598,41 @@ class XmlMarkupTagAliases(object):
 # XML Markup Content Handler
 # ----------------------------------------------------------------------------
 
-class _XmlMarkupHandler(xml.sax.handler.ContentHandler):
-    """
-    XML content handler for XML text layout markup.
+class _XmlMarkupRecorder(xml.sax.handler.ContentHandler):
     """
+    Records the parse events of XML text layout markup, so that they
+    can be replayed into an _LXmlMarkupHandler later on, with any
+    style registry.  Serves both as a SAX content handler and as an
+    lxml parser target.
 
-    def __init__(self, styleRegistry, tagAliases=None):
-        """
-        Initializes the content handler with the given style registry
-        and tag aliases.
-        """
+    The events are tuples: (_START, name, style attribute or None),
+    (_END, name) and (_DATA, characters).
+    """
 
+    def __init__(self):
         xml.sax.handler.ContentHandler.__init__(self)
-        self.styleRegistry = styleRegistry
-
-        if not tagAliases:
-            tagAliases = XmlMarkupTagAliases()
-        self.tagAliases = tagAliases
-
-    def startDocument(self):
-        """
-        Called by the XML parser at the beginning of parsing the XML
-        document.
-        """
-
-        self.style = CascadingStyleStack()
-        self.document = None
-        self.block = None
-        self.glyphs = None
-
-    def _pushStyle(self, name, attrs):
-        """
-        Sets the current style to the style defined by the "style"
-        attribute of the given tag.  If that style doesn't exist, we
-        use the style named by the tag.
-        """
-
-        styleDict = None
-
-        styleAttr = attrs.get("style", None)
-        if styleAttr:
-            styleDict = self.styleRegistry.findMatch(styleAttr)
-
-        if styleDict is None:
-            styleDict = self.styleRegistry.findMatch(name)
-
-        if styleDict is None:
-            raise ValueError, "No style found for: %s, %s" % (
-                name,
-                str(styleAttr)
-            )
-
-        self.style.push(styleDict)
+        self.events = []
 
     def startElement(self, name, attrs):
-        """
-        Handles the beginning of an XML element.
-        """
-
-        if name == "document":
-            self._pushStyle(name, attrs)
-            self.document = self.style.makeNewDocument()
-        elif name == "block":
-            if not self.document:
-                raise XmlMarkupUnexpectedElementError(
-                    "Block element encountered outside of document element."
-                )
-            self._pushStyle(name, attrs)
-            self.block = self.style.makeNewBlock()
-            self.glyphs = []
-        elif name == "inline":
-            if not self.block:
-                raise XmlMarkupUnexpectedElementError(
-                    "Inline element encountered outside of block element."
-                )
-            self._pushStyle(name, attrs)
-        elif self.tagAliases.has(name):
-            baseElement = self.tagAliases.get(name)
-            self.startElement(baseElement, {"style": name})
-        else:
-            raise XmlMarkupUnknownElementError(name)
+        self.events.append((_START, name, attrs.get("style", None)))
 
     def endElement(self, name):
-        """
-        Handles the end of an XML element.
-        """
-
-        if name == "document":
-            self.style.pop()
-            self.document.layout()
-        elif name == "block":
-            ellipsisGlyph = self.style.makeNewGlyphs(u"\u2026")[0]
-            self.block.setEllipsisGlyph(ellipsisGlyph)
+        self.events.append((_END, name))
 
-            self.style.pop()
-            self.block.addGlyphs(self.glyphs)
-            self.document.addBlock(self.block)
-            self.block = None
-            self.glyphs = None
-        elif name == "inline":
-            self.style.pop()
+    def characters(self, content):
+        events = self.events
+        if events and events[-1][0] == _DATA:
+            # The SAX parser may report text in several chunks.
+            events[-1] = (_DATA, events[-1][1] + content)
         else:
-            baseElement = self.tagAliases.get(name)
-            self.endElement(baseElement)
+            events.append((_DATA, content))
 
-    def characters(self, content):
-        """
-        Handles XML character data.
-        """
+    start = startElement
+    end = endElement
+    data = characters
 
-        if self.glyphs != None:
-            self.glyphs.extend(self.style.makeNewGlyphs(content))
-        else:
-            # Hopefully, the content is just whitespace...
-            content = content.strip()
-            if content:
-                raise XmlMarkupUnexpectedCharactersError(content)
+    def close(self):
+        return self.events
 
 
 class _LXmlMarkupHandler(object):
@@ -717,7 +685,6 @@ class _LXmlMarkupHandler(object):
             self.style = CascadingStyleStack()
             self.document = None
             self.block = None
-            self.glyphs = None
             self._pushStyle(name, attrs)
             self.document = self.style.makeNewDocument()
         elif name == "block":
@@ -727,7 +694,6 @@ class _LXmlMarkupHandler(object):
                 )
             self._pushStyle(name, attrs)
             self.block = self.style.makeNewBlock()
-            self.glyphs = []
         elif name == "inline":
             if not self.block:
                 raise XmlMarkupUnexpectedElementError(
@@ -753,10 +719,8 @@ class _LXmlMarkupHandler(object):
             self.block.setEllipsisGlyph(ellipsisGlyph)
 
             self.style.pop()
-            self.block.addGlyphs(self.glyphs)
             self.document.addBlock(self.block)
             self.block = None
-            self.glyphs = None
         elif name == "inline":
             self.style.pop()
         else:
@@ -768,8 +732,9 @@ class _LXmlMarkupHandler(object):
         Handles XML character data.
         """
 
-        if self.glyphs != None:
-            self.glyphs.extend(self.style.makeNewGlyphs(content))
+        if self.block is not None:
+            self.block.addText(content, self.style.getFont(),
+                               self.style.getColor())
         else:
             # Hopefully, the content is just whitespace...
             content = content.strip()
@@ -781,6 +746,61 @@ class _LXmlMarkupHandler(object):
         pass
 
 
+class _MarkupFillHandler(_LXmlMarkupHandler):
+    """
+    Replays XML text layout markup like _LXmlMarkupHandler, but only
+    measures how full its blocks are (see getMarkupFillRatio()),
+    without creating any glyphs or lines.
+    """
+
+    def start(self, name, attrs):
+        if name == "document":
+            self.style = CascadingStyleStack()
+            self.fillRatio = 0.0
+            self.advance = None
+            self._pushStyle(name, attrs)
+        elif name == "block":
+            self._pushStyle(name, attrs)
+            self.advance = 0.0
+            self.spaceAdvance = 0.0
+        elif name == "inline":
+            self._pushStyle(name, attrs)
+        elif self.tagAliases.has(name):
+            self.start(self.tagAliases.get(name), {"style": name})
+        else:
+            raise XmlMarkupUnknownElementError(name)
+
+    def end(self, name):
+        if name == "block":
+            try:
+                maxLines = self.style._propertyToInt("max_lines")
+            except KeyError:
+                maxLines = 0
+            if maxLines > 0:
+                # A line holds at most the block width; the space a
+                # line is broken at is dropped.
+                minWidth = self.advance - (maxLines - 1) * self.spaceAdvance
+                self.fillRatio = max(
+                    self.fillRatio,
+                    minWidth / (maxLines * self.style._propertyToPoints("width"))
+                )
+            self.advance = None
+            self.style.pop()
+        elif name in ("document", "inline"):
+            self.style.pop()
+        else:
+            self.end(self.tagAliases.get(name))
+
+    def data(self, content):
+        if self.advance is not None:
+            fontObj = self.style.getFont()
+            for char in content:
+                advance = fontObj.getGlyph(char).advance
+                self.advance += advance
+                if char == " " and advance > self.spaceAdvance:
+                    self.spaceAdvance = advance
+
+
 class XmlMarkupUnknownElementError(Exception):
     """
     Exception raised when an unknown XML text layout markup element is
@@ -812,11 +832,18 @@ class XmlMarkupUnexpectedCharactersError(Exception):
 # XML Markup to Document Conversion
 # ----------------------------------------------------------------------------
 
-def _sax_xmlMarkupToDocument(text, styleRegistry, tagAliases=None):
+# Parse event types of _XmlMarkupRecorder.
+_START = 0
+_END = 1
+_DATA = 2
+
+# Maximum number of parsed markup texts kept by the parse cache.
+PARSE_CACHE_SIZE = 256
+
+
+def _prepareMarkup(text):
     """
-    Converts the given XML text into a textlayout.Document object that
-    has been fully laid out and is ready for rendering, using the
-    given style registry and tag aliases.
+    Returns the given XML text as an ASCII string ready to be parsed.
     """
 
     # Convert all occurrences of multiple contiguous whitespace
@@ -828,47 +855,99 @@ def _sax_xmlMarkupToDocument(text, styleRegistry, tagAliases=None):
     # doesn't recognize this one on its own, sadly).
     text = text.replace("&nbsp;", NON_BREAKING_SPACE)
 
-    text = text.encode("ascii", "xmlcharrefreplace")
+    return text.encode("ascii", "xmlcharrefreplace")
+
+
+def _sax_parseMarkup(text):
+    """
+    Parses the given XML text into a list of parse events (see
+    _XmlMarkupRecorder), using the SAX parser.
+    """
+
+    text = _prepareMarkup(text)
 
-    xmlMarkupHandler = _XmlMarkupHandler(styleRegistry, tagAliases)
+    recorder = _XmlMarkupRecorder()
     try:
-        xml.sax.parseString(text, xmlMarkupHandler)
+        xml.sax.parseString(text, recorder)
     except SAXParseException as e:
         logging.error("Error parsing XML: '%s'; %s", text, e)
         raise
 
-    return xmlMarkupHandler.document
+    return recorder.events
 
 
-def _lxml_xmlMarkupToDocument(text, styleRegistry, tagAliases=None):
+def _lxml_parseMarkup(text):
     """
-    Converts the given XML text into a textlayout.Document object that
-    has been fully laid out and is ready for rendering, using the
-    given style registry and tag aliases.
+    Parses the given XML text into a list of parse events (see
+    _XmlMarkupRecorder), using the lxml parser.
     """
 
-    # Convert all occurrences of multiple contiguous whitespace
-    # characters to a single space character.
-    text = RE_REDUCESPACE.sub(" ", text)
-
-    # Convert all occurrences of the non-breaking space character
-    # entity reference into its unicode equivalent (the SAX XML parser
-    # doesn't recognize this one on its own, sadly).
-    text = text.replace("&nbsp;", NON_BREAKING_SPACE)
-
-    text = text.encode("ascii", "xmlcharrefreplace")
+    text = _prepareMarkup(text)
 
-    # TODO: Cache this?
-    handler = _LXmlMarkupHandler(styleRegistry, tagAliases)
     parser = etree.XMLParser(
         strip_cdata=False, resolve_entities=False, remove_blank_text=False,
-        huge_tree=False, target=handler
+        huge_tree=False, target=_XmlMarkupRecorder()
     )
 
-    etree.fromstring(text, parser)
+    return etree.fromstring(text, parser)
+
+# lxml parser is preferred for its speed
+_parseMarkup = _lxml_parseMarkup if LXML_AVAILABLE else _sax_parseMarkup
+
+# Parse events of recently laid out markup texts.  Nothing in the
+# events depends on the styles, so the size search of the quasimode
+# layout, which lays out the same text at several font sizes, and
+# texts recurring with other styles only parse it once.  Like the
+# cache of the re module, the cache is emptied when it gets full.
+_parseCache = {}
+
+
+def _replayMarkup(text, handler):
+    """
+    Replays the parse events of the given XML text into handler.
+    """
+
+    events = _parseCache.get(text)
+    if events is None:
+        events = tuple(_parseMarkup(text))
+        if len(_parseCache) >= PARSE_CACHE_SIZE:
+            _parseCache.clear()
+        _parseCache[text] = events
+
+    for event in events:
+        if event[0] == _DATA:
+            handler.data(event[1])
+        elif event[0] == _START:
+            handler.start(event[1], {"style": event[2]} if event[2] else {})
+        else:
+            handler.end(event[1])
+
 
+def xmlMarkupToDocument(text, styleRegistry, tagAliases=None):
+    """
+    Converts the given XML text into a textlayout.Document object that
+    has been fully laid out and is ready for rendering, using the
+    given style registry and tag aliases.
+    """
+
+    handler = _LXmlMarkupHandler(styleRegistry, tagAliases)
+    _replayMarkup(text, handler)
     return handler.document
 
-# lxml parser is preferred for its speed
-xmlMarkupToDocument = _lxml_xmlMarkupToDocument if LXML_AVAILABLE \
-    else _sax_xmlMarkupToDocument
+
+def getMarkupFillRatio(text, styleRegistry, tagAliases=None):
+    """
+    Returns how full the fullest block of the given XML text is, with
+    the given style registry and tag aliases: the width its glyphs
+    take at the least, divided by the total width of the lines it may
+    have.  If the ratio is above 1, xmlMarkupToDocument() cannot lay
+    out the text without exceeding the maximum number of lines; the
+    ratio grows with the font size.
+
+    Only the glyph advances are looked up, which makes this much
+    cheaper than a layout; used by textlayout.fitLargestSize().
+    """
+
+    handler = _MarkupFillHandler(styleRegistry, tagAliases)
+    _replayMarkup(text, handler)
+    return handler.fillRatio
@@ -44,13 +44,12 @@
 # Imports
 # ----------------------------------------------------------------------------
 
-import logging
-
 from enso import config, graphics
 from enso.graphics import rounded_rect
 from enso.graphics.measurement import pixelsToPoints, pointsToPixels
+from enso.graphics.textlayout import fitLargestSize
 from enso.messages import Message
-from enso.messages.primarywindow import layoutMessageXml
+from enso.messages.primarywindow import getMessageFillRatio, layoutMessageXml
 from enso.messages.windows import MessageWindow, computeWidth
 
 
@@ -250,7 +249,6 @@ class MiniMessageQueue(object):
         self.__status = self.EMPTY
 
     def __startAppearing(self, msg):
-        # FIXME: This is slowing it down, call it only when it changes
         wa_left, wa_top = graphics.getWorkareaOffset()
         wa_width, wa_height = graphics.getWorkareaSize()
 
@@ -468,17 +466,21 @@ class MiniMessageWindow(MessageWindow):
     def __layout(msg, width, height):
         text = msg.getMiniXml()
         text = "<document>%s</document>" % text
-        for size in reversed(MINI_SCALE[1:]):
-            try:
-                doc = layoutMessageXml(xmlMarkup=text,
-                                       width=width,
-                                       size=size,
-                                       height=height, )
-                return doc
-            except Exception as e:
-                # TODO: Lookup actual errors and catch them.
-                logging.error(e)
 
+        def layout(size):
+            return layoutMessageXml(xmlMarkup=text,
+                                    width=width,
+                                    size=size,
+                                    height=height, )
+
+        def fillRatio(size):
+            return getMessageFillRatio(text, width, size, height)
+
+        size, doc = fitLargestSize(MINI_SCALE[1:], layout, fillRatio)
+        if doc is not None:
+            return doc
+
+        size = MINI_SCALE[1]
         doc = layoutMessageXml(xmlMarkup=text,
                                width=width,
                                size=size,
@@ -46,7 +46,7 @@ from collections import namedtuple
 from enso import graphics
 from enso.graphics import rounded_rect, xmltextlayout
 from enso.graphics.measurement import inchesToPoints
-from enso.graphics.textlayout import MaxLinesExceededError
+from enso.graphics.textlayout import MaxLinesExceededError, fitLargestSize
 from enso.messages.windows import MessageWindow, computeWidth
 from enso.utils.xml_tools import escape_xml
 
@@ -335,27 +335,32 @@ class PrimaryMsgWind(MessageWindow):
         root = "<document>%s</document>"
         LayoutText = namedtuple('LayoutText', 'msgDoc capDoc')
 
-        for msgSize, capSize in reversed(SCALE[1:]):
-            try:
-                msgDoc = layoutMessageXml(
-                    xmlMarkup=root % msgText,
+        def layout(sizes):
+            msgSize, capSize = sizes
+            msgDoc = layoutMessageXml(
+                xmlMarkup=root % msgText,
+                width=width,
+                height=height,
+                size=msgSize,
+            )
+            if capText is not None:
+                capDoc = layoutMessageXml(
+                    xmlMarkup=root % capText,
                     width=width,
-                    height=height,
-                    size=msgSize,
+                    height=height - msgDoc.height,
+                    size=capSize,
                 )
-                if capText is not None:
-                    capDoc = layoutMessageXml(
-                        xmlMarkup=root % capText,
-                        width=width,
-                        height=height - msgDoc.height,
-                        size=capSize
-                    )
-                else:
-                    capDoc = None
-                return LayoutText(msgDoc, capDoc)
-            except Exception:
-                # TODO: Lookup exact error.
-                pass
+            else:
+                capDoc = None
+            return LayoutText(msgDoc, capDoc)
+
+        def fillRatio(sizes):
+            msgSize, capSize = sizes
+            return getMessageFillRatio(root % msgText, width, msgSize, height)
+
+        usedSizes, layoutText = fitLargestSize(SCALE[1:], layout, fillRatio)
+        if layoutText is not None:
+            return layoutText
 
         # This time, ellipsify.
         msgSize, capSize = SCALE[0]
@@ -525,6 +530,38 @@ _tagAliases.add("b", baseElement="inline")
 _tagAliases.add("error", baseElement="inline")
 
 
+def _updateMessageStyles(width, size, height, ellipsify="false"):
+    """
+    Sets up the message styles for a block that is width wide and
+    height high, with text of the given size.
+    """
+
+    maxLines = int(height / (size * LINE_SPACING))
+
+    _styles.update("document",
+                   width="%fpt" % width,
+                   line_height="%spt" % int(size * LINE_SPACING),
+                   max_lines=maxLines,
+                   font_size="%spt" % size,
+                   ellipsify=ellipsify,
+                   )
+
+
+def getMessageFillRatio(xmlMarkup, width, size, height):
+    """
+    Returns the xmltextlayout.getMarkupFillRatio() of xmlMarkup when
+    laid out by layoutMessageXml() with the given parameters.
+    """
+
+    _updateMessageStyles(width, size, height)
+    try:
+        return xmltextlayout.getMarkupFillRatio(
+            xmlMarkup, _styles, _tagAliases)
+    except Exception:
+        # Broken markup; layoutMessageXml() deals with it.
+        return 0.0
+
+
 def layoutMessageXml(xmlMarkup, width, size, height, ellipsify="false",
                      raiseLayoutExceptions=False):
     """
@@ -538,15 +575,7 @@ def layoutMessageXml(xmlMarkup, width, size, height, ellipsify="false",
     any exceptions raised will be passed through to the caller.
     """
 
-    maxLines = int(height / (size * LINE_SPACING))
-
-    _styles.update("document",
-                   width="%fpt" % width,
-                   line_height="%spt" % int(size * LINE_SPACING),
-                   max_lines=maxLines,
-                   font_size="%spt" % size,
-                   ellipsify=ellipsify,
-                   )
+    _updateMessageStyles(width, size, height, ellipsify)
 
     try:
         document = xmltextlayout.xmlMarkupToDocument(
@@ -555,7 +584,7 @@ def layoutMessageXml(xmlMarkup, width, size, height, ellipsify="false",
             _tagAliases
         )
     except MaxLinesExceededError:
-        pass
+        raise
     except Exception as e:
         if raiseLayoutExceptions:
             raise
@@ -0,0 +1,289 @@
+"""
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  1. Redistributions of source code must retain the above copyright
+     notice, this list of conditions and the following disclaimer.
+
+  2. Redistributions in binary form must reproduce the above copyright
+     notice, this list of conditions and the following disclaimer in the
+     documentation and/or other materials provided with the distribution.
+
+  3. Neither the name of Enso nor the names of its contributors may
+     be used to endorse or promote products derived from this
+     software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+"""
+Font registry for Linux, the counterpart of the win32 FontRegistry.
+
+The fonts installed on the system are enumerated once per process,
+through the fontconfig library (or, if it cannot be loaded, a single
+fc-list call), and the list is saved in the Enso cache directory
+together with the modification times of the fontconfig caches, so
+that later processes only enumerate the fonts again after fontconfig
+has seen a change.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import re
+import threading
+
+import enso.providers
+
+__updated__ = "2017-02-23"
+
+
+# Name of the font list file in the Enso cache directory.
+FONT_LIST_FILE_NAME = "fonts.json"
+
+# Files and directories whose modification times tell whether the
+# fonts known to fontconfig may have changed.
+FONTCONFIG_STAMP_PATHS = (
+    "/etc/fonts",
+    "/etc/fonts/conf.d",
+    "/var/cache/fontconfig",
+    "/usr/lib/fontconfig/cache",
+    os.path.expanduser("~/.cache/fontconfig"),
+    os.path.expanduser("~/.fontconfig"),
+    os.path.expanduser("~/.config/fontconfig"),
+)
+
+
+class FontDetail(object):
+
+    def __init__(self, names, filepath, filename):
+        self._names = names
+        self._filepath = filepath
+        self._filename = filename
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    def __repr__(self):
+        return "%s, %s, %s" % (self.filepath, self.filename, "['%s']" % "', '".join(self.names))
+
+
+# ----------------------------------------------------------------------------
+# Font enumeration
+# ----------------------------------------------------------------------------
+
+class _FcFontSet(ctypes.Structure):
+    _fields_ = [
+        ("nfont", ctypes.c_int),
+        ("sfont", ctypes.c_int),
+        ("fonts", ctypes.POINTER(ctypes.c_void_p)),
+    ]
+
+
+def _list_fonts_with_fontconfig():
+    """
+    Returns a list of (file, families, styles) tuples of all fonts
+    known to fontconfig, or None if the library is not available.
+    """
+    lib_name = ctypes.util.find_library("fontconfig")
+    if not lib_name:
+        return None
+    try:
+        lib = ctypes.CDLL(lib_name)
+    except OSError:
+        return None
+
+    lib.FcInitLoadConfigAndFonts.restype = ctypes.c_void_p
+    lib.FcPatternCreate.restype = ctypes.c_void_p
+    lib.FcObjectSetBuild.restype = ctypes.c_void_p
+    lib.FcFontList.restype = ctypes.POINTER(_FcFontSet)
+    lib.FcFontList.argtypes = [ctypes.c_void_p] * 3
+    lib.FcPatternGetString.argtypes = [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_char_p)]
+    lib.FcFontSetDestroy.argtypes = [ctypes.POINTER(_FcFontSet)]
+    lib.FcObjectSetDestroy.argtypes = [ctypes.c_void_p]
+    lib.FcPatternDestroy.argtypes = [ctypes.c_void_p]
+    lib.FcConfigDestroy.argtypes = [ctypes.c_void_p]
+
+    def get_strings(pattern, name):
+        values = []
+        value = ctypes.c_char_p()
+        # FcResultMatch == 0
+        while lib.FcPatternGetString(pattern, name, len(values), ctypes.byref(value)) == 0:
+            values.append(value.value.decode("UTF-8", "replace"))
+        return values
+
+    config = lib.FcInitLoadConfigAndFonts()
+    if not config:
+        return None
+    pattern = lib.FcPatternCreate()
+    object_set = lib.FcObjectSetBuild("family", "style", "file", None)
+    font_set = lib.FcFontList(config, pattern, object_set)
+    try:
+        fonts = []
+        if font_set:
+            for i in range(font_set.contents.nfont):
+                font = font_set.contents.fonts[i]
+                files = get_strings(font, "file")
+                fonts.append((
+                    files[0] if files else u"",
+                    get_strings(font, "family"),
+                    get_strings(font, "style"),
+                ))
+        return fonts
+    finally:
+        if font_set:
+            lib.FcFontSetDestroy(font_set)
+        lib.FcObjectSetDestroy(object_set)
+        lib.FcPatternDestroy(pattern)
+        lib.FcConfigDestroy(config)
+
+
+def _list_fonts_with_fc_list():
+    """
+    Returns a list of (file, families, styles) tuples of all fonts
+    listed by fc-list.
+    """
+    from enso.platform.linux.utils import get_cmd_output
+    rc, output = get_cmd_output("fc-list --format '%{file}\\t%{family}\\t%{style}\\n'")
+    if rc != 0:
+        logging.error("Error listing the system fonts: %s", output)
+        return []
+    fonts = []
+    for line in output.decode("UTF-8", "replace").splitlines():
+        fields = line.split(u"\t")
+        if len(fields) == 3:
+            fonts.append((
+                fields[0],
+                [f for f in fields[1].split(u",") if f],
+                [s for s in fields[2].split(u",") if s],
+            ))
+    return fonts
+
+
+def _get_fontconfig_stamp():
+    """
+    Returns the modification times of the fontconfig configuration
+    and caches, which change whenever the installed fonts do.
+    """
+    stamp = []
+    for path in FONTCONFIG_STAMP_PATHS:
+        try:
+            stamp.append([path, os.path.getmtime(path)])
+        except OSError:
+            pass
+    return stamp
+
+
+# ----------------------------------------------------------------------------
+# The FontRegistry
+# ----------------------------------------------------------------------------
+
+class FontRegistry(object):
+
+    __instance = None
+
+    @classmethod
+    def get(cls):
+        if not cls.__instance:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def __init__(self, cache_file=None):
+        if cache_file is None:
+            cache_file = os.path.join(
+                enso.providers.getInterface("system").get_enso_cache_dir(),
+                FONT_LIST_FILE_NAME)
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        self._fonts = None
+        self._font_detail_cache = {}
+
+    def _load_fonts(self):
+        """
+        Returns the list of installed fonts, from the cache file if it
+        is up to date, and otherwise from fontconfig.
+        """
+        stamp = _get_fontconfig_stamp()
+        try:
+            with open(self._cache_file, "rb") as f:
+                cached = json.load(f)
+            if cached["stamp"] == stamp:
+                return cached["fonts"]
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        fonts = _list_fonts_with_fontconfig()
+        if fonts is None:
+            fonts = _list_fonts_with_fc_list()
+        logging.info("Found %d fonts", len(fonts))
+
+        try:
+            directory = os.path.dirname(self._cache_file)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp_file = "%s.%d.tmp" % (self._cache_file, os.getpid())
+            with open(temp_file, "wb") as f:
+                json.dump({"stamp": stamp, "fonts": fonts}, f)
+            os.rename(temp_file, self._cache_file)
+        except (IOError, OSError) as e:
+            logging.warning("Error saving the font list: %s", e)
+
+        return fonts
+
+    def get_fonts(self):
+        """
+        Returns a list of (file, families, styles) tuples of all
+        installed fonts.
+        """
+        with self._lock:
+            if self._fonts is None:
+                self._fonts = self._load_fonts()
+            return self._fonts
+
+    def get_font_detail(self, font_id):
+        """
+        Returns the FontDetail of the first installed font matching
+        font_id, or None.  Like "fc-list | grep", font_id matches if it
+        occurs in the fc-list description of the font; any space in it
+        may be missing from the description.
+        """
+        assert font_id is not None and len(font_id.strip()) > 0
+
+        try:
+            return self._font_detail_cache[font_id]
+        except KeyError:
+            pass
+
+        regexp = re.compile(re.escape(font_id).replace("\\ ", " ?"))
+        font_detail = None
+        for font_file, families, styles in self.get_fonts():
+            description = u"%s: %s:style=%s" % (
+                font_file, u",".join(families), u",".join(styles))
+            if regexp.search(description):
+                font_detail = FontDetail(
+                    families, font_file, os.path.basename(font_file))
+                break
+
+        self._font_detail_cache[font_id] = font_detail
+        return font_detail
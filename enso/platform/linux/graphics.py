@@ -36,6 +36,8 @@ from time import sleep
 import gtk
 import cairo
 from enso.platform.linux import utils
+from enso.platform.linux.font_registry import FontRegistry
+from enso.platform.linux.surface_pool import SurfacePool
 
 from enso.events import EventManager
 
@@ -209,9 +211,10 @@ please use a compositing manager to get proper blending.''')
         def makeCairoSurface(self):
             '''Prepare a Cairo Surface large enough for this window'''
             if not self.__surface:
-                self.__surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-                                                    self.__maxWidth,
-                                                    self.__maxHeight)
+                # The surface may be larger than the window; drawing
+                # it is clipped to the window size.
+                self.__surface = SurfacePool.get().acquire(self.__maxWidth,
+                                                           self.__maxHeight)
                 self.update_shape()
 #                self.show ()
             return self.__surface
@@ -275,10 +278,10 @@ please use a compositing manager to get proper blending.''')
                 self.__isVisible = False
 
         def finish(self):
-            '''Finish this window: delete the Cairo surface, ungrab pointer
+            '''Finish this window: return the Cairo surface to the pool, ungrab pointer
 and destroy it.'''
             if self.__surface:
-                self.__surface.finish()
+                SurfacePool.get().release(self.__surface)
                 self.__surface = None
             self.ensure_pointer_ungrabbed()
             self.destroy()
@@ -301,8 +304,53 @@ and destroy it.'''
         self.finish()
 
 
+# ----------------------------------------------------------------------------
+# Screen geometry
+# ----------------------------------------------------------------------------
+
+# Incremented whenever the screen geometry may have changed; Enso core
+# only asks for the geometry again when it has.
+_geometry_generation = 0
+_geometry_watched = False
+
+
+def _invalidate_geometry(*args):
+    global _geometry_generation
+    _geometry_generation += 1
+
+
+def _watch_geometry():
+    """
+    Starts watching the screen for RandR changes through the GDK
+    screen signals, so that the geometry does not need to be queried
+    from the X server anew every time it is used.
+    """
+    global _geometry_watched
+    if _geometry_watched:
+        return
+    _geometry_watched = True
+
+    screen = gtk.gdk.screen_get_default()
+    for signal in ("size-changed", "monitors-changed"):
+        try:
+            screen.connect(signal, _invalidate_geometry)
+        except TypeError:
+            # "monitors-changed" needs GTK 2.14.
+            logging.warning("Cannot watch the screen for %s", signal)
+
+
+def getGeometryGeneration():
+    '''Returns a number which changes whenever the geometry may have changed'''
+    _watch_geometry()
+    return _geometry_generation
+
+
 def getCurrentMonitor():
     '''Helper fetching the current monitor of focus'''
+    screen = gtk.gdk.screen_get_default()
+    if screen.get_n_monitors() == 1:
+        # No need to ask the X server where the focus is.
+        return 0
     display = utils.get_display()
     input_focus = display.get_input_focus()
     if input_focus is not None and input_focus.focus:
@@ -322,7 +370,7 @@ def getCurrentMonitor():
             y = trans.y
     else:
         x, y = 0, 0
-    return gtk.gdk.screen_get_default().get_monitor_at_point(x, y)
+    return screen.get_monitor_at_point(x, y)
 
 
 def getDesktopOffset():
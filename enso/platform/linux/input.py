@@ -36,16 +36,17 @@ __updated__ = "2017-02-23"
 
 import atexit
 import logging
-import os
+import time
 from threading import Thread
 
 import gobject
 import gtk
 from CharMaps import STANDARD_ALLOWED_KEYCODES as CASE_INSENSITIVE_KEYCODE_MAP
 from Xlib import X
-from shutilwhich import which
-from utils import get_display, get_keycode, get_cmd_output, sanitize_char
+from Xlib.display import Display
+from utils import get_display, get_keycode, sanitize_char
 
+import enso.config
 from enso.utils.decorators import suppress
 
 
@@ -57,6 +58,16 @@ _TIMER_INTERVAL = 0.010
 # Timer interval in milliseconds.
 _TIMER_INTERVAL_IN_MS = int(_TIMER_INTERVAL * 1000)
 
+# Number of attempts at changing the modifier mapping while the X
+# server reports it busy (a modifier key is held down), and delay
+# between them in seconds.
+_MODIFIER_MAPPING_ATTEMPTS = 5
+_MODIFIER_MAPPING_RETRY_DELAY = 0.020
+
+# Names of the modifiers, in the order of the X modifier mapping
+_MODIFIER_NAMES = ["shift", "lock", "control",
+                   "mod1", "mod2", "mod3", "mod4", "mod5"]
+
 # Input modes
 QUASI_MODAL = 0
 MODAL = 1
@@ -224,23 +235,31 @@ class _KeyListener (Thread):
 
     __lock = False
 
-    __caps_lock = None
+    __modifier_display = None
+
+    __lock_keycodes = None
+    __caps_lock_enabled = True
+    __caps_lock_restore_registered = False
     __num_lock_mod = None
     __key_mod = None
 
+    __num_lock_mask = 0
+    __key_mod_mask = 0
+
     def __init__(self, parent, callback):
         '''Initialize object'''
         Thread.__init__(self)
         self.__parent = parent
         self.__callback = callback
+        # Keycode to report for each (keycode, state) pair of the key
+        # events seen so far, or None for the keys to ignore; built
+        # as keys are pressed, and emptied when the keymap changes
+        self.__key_table = {}
+        # Events read from the display but not handled yet
+        self.__pending = []
 
     def run(self):
         '''Main keyboard event loop'''
-        def make_event(event_type, keycode=None):
-            return {
-                "event": event_type,
-                "keycode": keycode,
-            }
         self.__display = get_display()
         self.__display.set_error_handler(self.error_handler)
         '''Outter loop, used for configuration handling'''
@@ -252,56 +271,81 @@ class _KeyListener (Thread):
             self.__restart = False
             '''Inner loop, used for event processing'''
             while not self.__restart:
-                event = self.__display.next_event()
+                if not self.__pending:
+                    self.__pending = self.read_events()
+                '''Handle all the events read under a single lock, so that
+                fast typing does not contend with the GTK main loop for
+                each key'''
                 self.__lock = True
                 with gtk.gdk.lock:
-                    if hasattr(event, "detail") and \
-                       event.detail == trigger_keycode and \
-                       event.type in events:
-                        if self.__parent.getModality():
-                            continue
-                        elif event.type == X.KeyPress:
-                            self.__callback(make_event("quasimodeStart"))
-                            self.__capture = True
-                        elif event.type == X.KeyRelease:
-                            self.__callback(make_event("quasimodeEnd"))
-                            self.__capture = False
-                    elif not self.__parent.getModality() and self.__capture \
-                            and event.type in events:
-                        modifiers_mask = gtk.gdk.MODIFIER_MASK
-                        if self.__key_mod:
-                            mod_str = self.__key_mod.upper()
-                            mod = eval("gtk.gdk.%s_MASK" % mod_str)
-                            modifiers_mask &= ~mod
-                        state = event.state & modifiers_mask
-                        keyval = self.__display.keycode_to_keysym(event.detail,
-                                                                  state)
-                        if not keyval and self.__num_lock_mod:
-                            # print "numlock mod"
-                            mod_str = self.__num_lock_mod.upper()
-                            mod = eval("gtk.gdk.%s_MASK" % mod_str)
-                            modifiers_mask &= ~mod
-                            state = event.state & modifiers_mask
-                            keyval = \
-                                self.__display.keycode_to_keysym(event.detail,
-                                                                 state)
-                        # print keyval, event.detail
-                        # FIXME: Handling of numpad "5" key, converting it to
-                        # normal "5" key
-                        if keyval == 65437:
-                            keyval, event.detail = 53, 14
-                        if event.detail in EXTRA_KEYCODES \
-                           or sanitize_char(keyval):
-                            if event.type == X.KeyPress:
-                                self.__callback(make_event("keyDown",
-                                                           event.detail))
-                            else:
-                                self.__callback(make_event("keyUp",
-                                                           event.detail))
-
+                    while self.__pending and not self.__restart:
+                        self.handle_event(self.__pending.pop(0),
+                                          trigger_keycode, events)
                 self.__lock = False
             self.ungrab(QUASIMODE_TRIGGER_KEYS)
 
+    def read_events(self):
+        '''Wait for an event, and return it with any others already queued'''
+        display = self.__display
+        events = [display.next_event()]
+        for _ in range(display.pending_events()):
+            events.append(display.next_event())
+        return events
+
+    def handle_event(self, event, trigger_keycode, events):
+        '''Handle an Xlib event'''
+        def make_event(event_type, keycode=None):
+            return {
+                "event": event_type,
+                "keycode": keycode,
+            }
+        if event.type == X.MappingNotify:
+            self.__display.refresh_keyboard_mapping(event)
+            self.__key_table.clear()
+        elif hasattr(event, "detail") and \
+                event.detail == trigger_keycode and \
+                event.type in events:
+            if self.__parent.getModality():
+                return
+            elif event.type == X.KeyPress:
+                self.__callback(make_event("quasimodeStart"))
+                self.__capture = True
+            elif event.type == X.KeyRelease:
+                self.__callback(make_event("quasimodeEnd"))
+                self.__capture = False
+        elif not self.__parent.getModality() and self.__capture \
+                and event.type in events:
+            keycode = self.translate_key(event.detail, event.state)
+            if keycode is not None:
+                if event.type == X.KeyPress:
+                    self.__callback(make_event("keyDown", keycode))
+                else:
+                    self.__callback(make_event("keyUp", keycode))
+
+    def translate_key(self, keycode, state):
+        '''Return the keycode to report for a key event, or None if the
+        key is to be ignored'''
+        try:
+            return self.__key_table[(keycode, state)]
+        except KeyError:
+            pass
+        modifiers_mask = gtk.gdk.MODIFIER_MASK & ~self.__key_mod_mask
+        keyval = self.__display.keycode_to_keysym(keycode,
+                                                  state & modifiers_mask)
+        if not keyval and self.__num_lock_mask:
+            modifiers_mask &= ~self.__num_lock_mask
+            keyval = self.__display.keycode_to_keysym(keycode,
+                                                      state & modifiers_mask)
+        # FIXME: Handling of numpad "5" key, converting it to
+        # normal "5" key
+        translated = keycode
+        if keyval == 65437:
+            keyval, translated = 53, 14
+        if not (translated in EXTRA_KEYCODES or sanitize_char(keyval)):
+            translated = None
+        self.__key_table[(keycode, state)] = translated
+        return translated
+
     def unlock(self):
         '''Unlock GDK threading lock'''
         if self.__lock:
@@ -325,48 +369,39 @@ class _KeyListener (Thread):
         '''Grab specific keys'''
         root_window = self.__display.screen().root
         keycode = 0
-        xset_cmd = which("xset")
-        xmodmap_cmd = which("xmodmap")
-        if not xset_cmd:
-            logging.warn(
-                "xset not found, you might experience some bad key-repeat problems")
+        mapping = self.__display.get_modifier_mapping()
+        num_lock_keycode = get_keycode("Num_Lock", self.__display)
+        '''Keep the keys of the Lock modifier, to give them back when
+        Caps Lock is enabled again; once Caps Lock is disabled, the
+        mapping read on restart has none'''
+        lock_keycodes = [k for k in mapping[X.LockMapIndex] if k]
+        if lock_keycodes:
+            self.__lock_keycodes = lock_keycodes
+            self.__caps_lock_enabled = True
         for key in keys:
             keycode = get_keycode(key)
             if not keycode:
                 continue
-            if xset_cmd:
-                # FIXME: revert on exit
-                os.system("%s -r %d" % (xset_cmd, keycode))
-            if xmodmap_cmd:
-                cmd_status, cmd_stdout = get_cmd_output(
-                    "%s -pm" % xmodmap_cmd)
-                if cmd_status == 0 and cmd_stdout:
-                    lines = cmd_stdout.splitlines()
-                else:
-                    lines = []
-                lock_line = [l.strip().split()
-                             for l in lines if l.startswith("lock")]
-                num_line = [l.strip().split()
-                            for l in lines if "Num_Lock" in l]
-                key_line = [l.strip().split() for l in lines if key in l]
-                if lock_line:
-                    parts = lock_line[0]
-                    if len(parts) > 1:
-                        self.__caps_lock = parts[1]
-                if num_line:
-                    parts = num_line[0]
-                    if len(parts) > 1:
-                        self.__num_lock_mod = parts[0]
-                if key_line:
-                    parts = key_line[0]
-                    if len(parts) > 1:
-                        self.__key_mod = parts[0]
+            # FIXME: revert on exit
+            self.__display.change_keyboard_control(
+                auto_repeat_mode=X.AutoRepeatModeOff, key=keycode)
+            '''The trigger key is no longer a modifier once Caps Lock is
+            disabled, so keep what was found before'''
+            self.__num_lock_mod = self.get_modifier_name(
+                mapping, num_lock_keycode) or self.__num_lock_mod
+            self.__key_mod = self.get_modifier_name(
+                mapping, keycode) or self.__key_mod
+            self.__num_lock_mask = self.get_modifier_mask(self.__num_lock_mod)
+            self.__key_mod_mask = self.get_modifier_mask(self.__key_mod)
+            self.__key_table.clear()
             if key == "Caps_Lock":
-                if not self.__caps_lock:
+                if not self.__lock_keycodes:
                     logging.debug("Caps Lock already disabled!")
                 else:
                     self.disable_caps_lock()
-                    atexit.register(self.enable_caps_lock)
+                    if not self.__caps_lock_restore_registered:
+                        atexit.register(self.enable_caps_lock)
+                        self.__caps_lock_restore_registered = True
             ownev = not self.__parent.getModality()
             root_window.grab_key(keycode, X.AnyModifier, ownev,
                                  X.GrabModeAsync, X.GrabModeAsync)
@@ -375,23 +410,66 @@ class _KeyListener (Thread):
         self.__parent.stop()
         return None, None
 
+    def get_modifier_name(self, mapping, keycode):
+        '''Return the name of the modifier (such as "mod2") that keycode
+        is a key of in the X modifier mapping, or None'''
+        if keycode:
+            for index, keycodes in enumerate(mapping):
+                if keycode in keycodes:
+                    return _MODIFIER_NAMES[index]
+        return None
+
+    def get_modifier_mask(self, modifier):
+        '''Return the GDK mask of the named modifier (such as "mod2"), or 0'''
+        if not modifier:
+            return 0
+        return getattr(gtk.gdk, "%s_MASK" % modifier.upper(), 0)
+
     def ungrab(self, keys):
         '''Ungrab specific keys'''
         root_window = self.__display.screen().root
         for keycode in keys:
             root_window.ungrab_key(keycode, 0)
 
+    def get_modifier_display(self):
+        '''Return the display connection used to change the modifier
+        mapping; the listener thread blocks reading events from the
+        shared one, so the requests made from other threads go through
+        a connection of their own'''
+        if self.__modifier_display is None:
+            self.__modifier_display = Display()
+        return self.__modifier_display
+
+    def set_lock_keycodes(self, keycodes):
+        '''Make keycodes the keys of the Lock modifier, leaving the
+        others as they are; return whether the X server accepted it'''
+        display = self.get_modifier_display()
+        for attempt in range(_MODIFIER_MAPPING_ATTEMPTS):
+            if attempt:
+                time.sleep(_MODIFIER_MAPPING_RETRY_DELAY)
+            mapping = display.get_modifier_mapping()
+            mapping = [list(k) for k in mapping]
+            mapping[X.LockMapIndex] = list(keycodes)
+            status = display.set_modifier_mapping(mapping)
+            if status != X.MappingBusy:
+                break
+        if status != X.MappingSuccess:
+            logging.warn("Couldn't change the Lock modifier (status %d)"
+                         % status)
+            return False
+        return True
+
     def disable_caps_lock(self):
         '''Disable Caps Lock'''
-        if self.__caps_lock:
-            assert logging.debug("Using xmodmap to disable Caps Lock") or True
-            os.system('xmodmap -e "clear Lock"')
+        if self.__lock_keycodes and self.__caps_lock_enabled:
+            if self.set_lock_keycodes([]):
+                self.__caps_lock_enabled = False
 
     def enable_caps_lock(self):
         '''Enable Caps Lock'''
-        if self.__caps_lock:
-            assert logging.debug("Using xmodmap to enable Caps Lock") or True
-            os.system('xmodmap -e "add Lock = %s"' % self.__caps_lock)
+        if self.__lock_keycodes and not self.__caps_lock_enabled:
+            if self.set_lock_keycodes(self.__lock_keycodes):
+                self.__caps_lock_enabled = True
 
 
 class InputManager (object):
@@ -404,6 +482,10 @@ class InputManager (object):
 
     __keyListener = None
 
+    __timerSource = None
+    __timerInterval = None
+    __timerWakePending = False
+
     def __init__(self):
         '''Initialize object'''
         pass
@@ -417,7 +499,51 @@ class InputManager (object):
                 gtk.main_quit()
                 return False
             finally:
-                return True  # Return true to keep the timeout running
+                # Keep the timeout running, unless it needs another
+                # interval now
+                return self.__updateTimer(in_timer=True)
+
+    def __getTimerInterval(self):
+        '''Return the timer interval needed in ms, or None to suspend the timer'''
+        if not enso.config.ADAPTIVE_TIMER:
+            return _TIMER_INTERVAL_IN_MS
+        delay = self.getTickDelay()
+        if delay is None:
+            return None
+        return max(_TIMER_INTERVAL_IN_MS, delay)
+
+    def __updateTimer(self, in_timer=False):
+        '''(Re)schedule the timer at the interval needed, and return whether
+the current timeout may keep running'''
+        interval = self.__getTimerInterval()
+        if self.__timerSource is not None and interval == self.__timerInterval:
+            return True
+        if self.__timerSource is not None and not in_timer:
+            gobject.source_remove(self.__timerSource)
+        self.__timerSource = None
+        self.__timerInterval = interval
+        if interval is not None:
+            self.__timerSource = gobject.timeout_add(interval,
+                                                     self.__timerCallback)
+        return False
+
+    def __timerWakeCallback(self):
+        '''Handle gobject idle callback scheduled by wakeTimer'''
+        self.__timerWakePending = False
+        self.__updateTimer()
+        return False
+
+    def wakeTimer(self):
+        '''Make the timer adapt to a change of getTickDelay; may be called
+from any thread'''
+        if not self.__timerWakePending:
+            self.__timerWakePending = True
+            gobject.idle_add(self.__timerWakeCallback)
+
+    def getTickDelay(self):
+        '''Return the ms until onTick is next needed, or None if it is not
+needed until some input; the timer runs at its full rate while this is 0'''
+        return 0
 
     def __keyCallback(self, info):
         '''Handle callbacks from KeyListener'''
@@ -443,8 +569,7 @@ class InputManager (object):
         '''Main input events processing loop'''
         logging.info("Entering InputManager.run ()")
 
-        timeout_source = gobject.timeout_add(_TIMER_INTERVAL_IN_MS,
-                                             self.__timerCallback)
+        self.__updateTimer()
 
         self.__keyListener = _KeyListener(self, self.__keyCallback)
         self.__keyListener.start()
@@ -461,7 +586,9 @@ class InputManager (object):
                 logging.error(e)
         finally:
             self.__keyListener.stop()
-            gobject.source_remove(timeout_source)
+            if self.__timerSource is not None:
+                gobject.source_remove(self.__timerSource)
+                self.__timerSource = None
 
         logging.info("Exiting InputManager.run ()")
         exit(1)
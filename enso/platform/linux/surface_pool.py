@@ -0,0 +1,175 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#    3. Neither the name of Enso nor the names of its contributors may
+#       be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ----------------------------------------------------------------------------
+#
+#   enso.platform.linux.surface_pool
+#
+# ----------------------------------------------------------------------------
+
+"""
+    Pool of the cairo image surfaces backing the transparent windows.
+
+    Message windows and the quasimode line windows are created and
+    destroyed over and over, each with a surface as large as the
+    window may get, which is a large ARGB buffer on big displays.
+    Rather than being freed, the surface of a destroyed window is kept
+    in the pool and given to the next window that needs a surface of
+    the same size bucket, up to a cap on the memory held by unused
+    surfaces (config.SURFACE_POOL_MAX_BYTES).
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+import cairo
+
+import enso.config
+
+__updated__ = "2017-02-25"
+
+
+# ----------------------------------------------------------------------------
+# Constants
+# ----------------------------------------------------------------------------
+
+# Surface sizes are rounded up to multiples of this many pixels, so
+# that windows of slightly different sizes share surfaces.
+SURFACE_SIZE_GRANULARITY = 64
+
+# Bytes per pixel of cairo.FORMAT_ARGB32.
+_BYTES_PER_PIXEL = 4
+
+
+def _round_up(size):
+    size = max(int(size), 1)
+    return -(-size // SURFACE_SIZE_GRANULARITY) * SURFACE_SIZE_GRANULARITY
+
+
+# ----------------------------------------------------------------------------
+# The Surface Pool
+# ----------------------------------------------------------------------------
+
+class SurfacePool(object):
+    """
+    Size-bucketed pool of cairo ARGB image surfaces.  A surface taken
+    with acquire() is at least as large as asked for, and fully
+    transparent; it should be given back with release() once no one
+    draws on it any more.
+    """
+
+    __instance = None
+
+    @classmethod
+    def get(cls):
+        if not cls.__instance:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = enso.config.SURFACE_POOL_MAX_BYTES
+        self._max_bytes = max_bytes
+        # Unused surfaces by size bucket, least recently released
+        # bucket first.
+        self._free = OrderedDict()
+        self._free_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def acquire(self, width, height):
+        """
+        Returns a transparent ARGB surface of at least width x height
+        pixels.
+        """
+        bucket = (_round_up(width), _round_up(height))
+        surfaces = self._free.get(bucket)
+        if not surfaces:
+            self._misses += 1
+            return cairo.ImageSurface(cairo.FORMAT_ARGB32, *bucket)
+
+        self._hits += 1
+        surface = surfaces.pop()
+        if not surfaces:
+            del self._free[bucket]
+        self._free_bytes -= self._get_bytes(bucket)
+
+        # Clear what the previous window left, like a new surface.
+        context = cairo.Context(surface)
+        context.set_operator(cairo.OPERATOR_CLEAR)
+        context.paint()
+        return surface
+
+    def release(self, surface):
+        """
+        Takes back a surface returned by acquire(), keeping it for
+        reuse unless that would exceed the memory cap.
+        """
+        bucket = (surface.get_width(), surface.get_height())
+        size = self._get_bytes(bucket)
+        if size > self._max_bytes:
+            surface.finish()
+            return
+
+        while self._free_bytes + size > self._max_bytes:
+            oldest_bucket, surfaces = next(self._free.iteritems())
+            surfaces.pop(0).finish()
+            if not surfaces:
+                del self._free[oldest_bucket]
+            self._free_bytes -= self._get_bytes(oldest_bucket)
+
+        surfaces = self._free.pop(bucket, [])
+        surfaces.append(surface)
+        self._free[bucket] = surfaces
+        self._free_bytes += size
+
+    def clear(self):
+        """
+        Frees all unused surfaces.
+        """
+        for surfaces in self._free.itervalues():
+            for surface in surfaces:
+                surface.finish()
+        self._free.clear()
+        self._free_bytes = 0
+
+    def get_stats(self):
+        """
+        Returns a dict of pool statistics, for diagnostics.
+        """
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "free_surfaces": sum(len(s) for s in self._free.itervalues()),
+            "free_bytes": self._free_bytes,
+            "max_bytes": self._max_bytes,
+        }
+
+    @staticmethod
+    def _get_bytes(bucket):
+        return bucket[0] * bucket[1] * _BYTES_PER_PIXEL
@@ -55,6 +55,7 @@ import traceback
 import weakref
 
 from enso import config, graphics, input, messages
+from enso.commands.usage import UsageStore
 from enso.messages.windows import computeWidth
 from enso.quasimode import layout
 from enso.quasimode.charmaps import STANDARD_ALLOWED_KEYCODES as ALLOWED_KEYCODES
@@ -395,8 +396,9 @@ class Quasimode(object):
 
         self.__quasimodeID = time.time()
 
-        graphics.refreshDesktopInfo()
-        graphics.refreshWorkareaInfo()
+        # Only queries the backend when the screen or the current
+        # monitor has changed.
+        graphics.updateDesktopInfo()
 
         if (config.QUASIMODE_DOUBLETAP_DELAY > 0 and
                 config.QUASIMODE_DOUBLETAP_COMMAND is not None):
@@ -516,6 +518,14 @@ class Quasimode(object):
             logging.error(traceback.format_exc())
             raise
 
+        try:
+            UsageStore.get().recordRun(cmdName)
+        except Exception:
+            # The command did run; failing to rank it is not its fault.
+            logging.error("Could not record the use of command \"%s\"."
+                          % cmdName)
+            logging.error(traceback.format_exc())
+
     def __showBadCommandMsg(self, userText):
         """
         Displays an error message telling the user that userText does
@@ -40,13 +40,14 @@
 # Imports
 # ----------------------------------------------------------------------------
 
+import copy
 import logging
+from collections import OrderedDict
 from time import clock
 
 from enso import config, graphics
 from enso.graphics import xmltextlayout
-from enso.graphics.textlayout import MaxLinesExceededError
-from enso.utils.html_tools import strip_html_tags
+from enso.graphics.textlayout import fitLargestSize
 from enso.utils.xml_tools import escape_xml
 from enso.utils.strings import smart_quote
 
@@ -282,7 +283,98 @@ def retrieveSuggestionStyles(active=True, size=SMALL_SCALE[-1]):
     return _updateStyles(_SUGGESTION_STYLES_A if active else _SUGGESTION_STYLES_I, SUGGESTION_SCALE, size)
 
 
-_size_scale_map = {}
+# ----------------------------------------------------------------------------
+# Layout Cache
+# ----------------------------------------------------------------------------
+
+# Bound of the layout cache, in characters of XML markup; the memory
+# taken by a laid out document is roughly proportional to the length
+# of its text.
+LAYOUT_CACHE_MAX_CHARS = 32 * 1024
+
+
+class LayoutCache(object):
+    """
+    Least-recently-used cache of laid out Documents.
+
+    While the user types, most lines of the quasimode (the description,
+    the hint and the suggestions that are still shown) have the same
+    markup and styles as on the previous keystroke, so their layout
+    can be reused.  The keys are tuples whose first element is the
+    XML markup; the cache holds documents for at most maxChars
+    characters of markup in total.
+    """
+
+    def __init__(self, maxChars=LAYOUT_CACHE_MAX_CHARS):
+        self.__maxChars = maxChars
+        self.__chars = 0
+        self.__documents = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key):
+        """
+        Returns the document stored for key, or None.
+        """
+
+        try:
+            document = self.__documents.pop(key)
+        except KeyError:
+            self.__misses += 1
+            return None
+        # Re-inserting the document makes it the most recently used.
+        self.__documents[key] = document
+        self.__hits += 1
+        return document
+
+    def put(self, key, document):
+        """
+        Stores document for key, evicting the least recently used
+        documents if the cache gets too big.
+        """
+
+        documents = self.__documents
+        if key in documents:
+            del documents[key]
+            self.__chars -= len(key[0])
+        if len(key[0]) > self.__maxChars:
+            return
+
+        documents[key] = document
+        self.__chars += len(key[0])
+        while self.__chars > self.__maxChars:
+            oldKey, _ = documents.popitem(last=False)
+            self.__chars -= len(oldKey[0])
+
+    def clear(self):
+        self.__documents.clear()
+        self.__chars = 0
+        self.__hits = 0
+        self.__misses = 0
+
+    def getStats(self):
+        """
+        Returns a dictionary describing the cache usage so far.
+        """
+
+        return dict(
+            hits=self.__hits,
+            misses=self.__misses,
+            size=len(self.__documents),
+            chars=self.__chars,
+            maxChars=self.__maxChars,
+        )
+
+
+_layoutCache = LayoutCache()
+
+
+def getLayoutCacheStats():
+    """
+    Returns the usage statistics of the quasimode layout cache.
+    """
+
+    return _layoutCache.getStats()
 
 
 def layoutXmlLine(xml_data, styles, scale):
@@ -292,71 +384,60 @@ def layoutXmlLine(xml_data, styles, scale):
     size allowed by scale (a list of font sizes).  If the text will
     not fit even at the smallest size of scale, then ellipsifies
     the text at that size.
+
+    Layouts are cached (see LayoutCache); callers get a shallow copy
+    of the cached document, so setting attributes on it is fine, but
+    its blocks must be left alone.
     """
 
-    # OPTIMIZATION BEGIN:
-    # Caching of largest working size for given scale and xml_data
-    xml_hash = hash("|".join(
-        ",".join(map(str, scale)) +
-        strip_html_tags(xml_data)
-    ))
-    usedSize = _size_scale_map.get(xml_hash, None)
-    if usedSize:
-        try:
-            _updateStyles(styles, scale, usedSize)
-            document = xmltextlayout.xmlMarkupToDocument(
-                xml_data,
-                styles,
-                XML_ALIASES,
-            )
-            document.shrinkOffset = scale[-1] - usedSize
-        except MaxLinesExceededError:
-            raise
-        else:
-            return document
-    hasFailed = False
-    # OPTIMIZATION END
+    cacheKey = (
+        xml_data,
+        id(styles),
+        styles.getFingerprint(),
+        graphics.getDesktopSize()[0],
+        tuple(scale),
+    )
+    document = _layoutCache.get(cacheKey)
+    if document is None:
+        document = _layoutXmlLine(xml_data, styles, scale)
+        _layoutCache.put(cacheKey, document)
+    return copy.copy(document)
 
-    document = None
-    for size in reversed(scale):
-        try:
-            _updateStyles(styles, scale, size)
-            document = xmltextlayout.xmlMarkupToDocument(
-                xml_data,
-                styles,
-                XML_ALIASES,
-            )
-            usedSize = size
-            break
-        except MaxLinesExceededError:
-            hasFailed = True
-            # NOTE: If the error is fundamental (not size-related),
-            # then it will be raised again below
-
-            # TODO: Figure out what exact types of exceptions are
-            # "non-fundamental" and catch those instead of using
-            # a blanket catch like this.
-            # print xml_data
-            # logging.error(e)
 
-    if document is None:
-        # no size above worked; use the smallest size
-        _updateStyles(styles, scale, scale[0])
-        document = xmltextlayout.xmlMarkupToDocument(
+def _layoutXmlLine(xml_data, styles, scale):
+    """
+    Performs the layout of layoutXmlLine(), without the cache.
+    """
+
+    def layout(size):
+        _updateStyles(styles, scale, size)
+        return xmltextlayout.xmlMarkupToDocument(
+            xml_data,
+            styles,
+            XML_ALIASES,
+        )
+
+    def fillRatio(size):
+        _updateStyles(styles, scale, size)
+        return xmltextlayout.getMarkupFillRatio(
             xml_data,
             styles,
             XML_ALIASES,
         )
+
+    usedSize, document = fitLargestSize(scale[1:], layout, fillRatio)
+    if document is None:
+        # No size above worked; use the smallest size, at which the
+        # text is ellipsified.
         usedSize = scale[0]
+        document = layout(usedSize)
+    else:
+        # Leave the styles at the size used, as the size search may
+        # have tried others last.
+        _updateStyles(styles, scale, usedSize)
 
     document.shrinkOffset = scale[-1] - usedSize
 
-    # OPTIMIZATION BEGIN:
-    # Caching of largest working size for given scale and xml_data
-    if hasFailed:
-        _size_scale_map[xml_hash] = usedSize
-    # OPTIMIZATION END
-
     return document
 
 
@@ -93,6 +93,30 @@ class TextWindow(object):
             logging.error(e)
         self.__context = self.__window.makeCairoContext()
         self.__is_visible = True
+        # What the window shows (see __getDrawnKey()), or None if it
+        # has to be drawn anew.
+        self.__drawnKey = None
+
+    @staticmethod
+    def __getDrawnKey(document):
+        """
+        Returns a value that is equal for two documents if and only if
+        drawing them gives the same picture.
+        """
+
+        # Laid out documents come from the layout cache as shallow
+        # copies, which share their blocks as long as the text and
+        # styles are the same; the blocks are never changed once laid
+        # out.
+        return (
+            document.blocks,
+            document.ragWidth,
+            document.shrinkOffset,
+            tuple(document.background),
+            document.roundUpperRight,
+            document.roundLowerRight,
+            document.roundLowerLeft,
+        )
 
     def getHeight(self):
         """
@@ -117,12 +141,18 @@ class TextWindow(object):
         Draws the text described by document.
 
         An updating call; at the end of this method, the displayed
-        window should reflect the drawn content.
+        window should reflect the drawn content.  If the window shows
+        the same content already, it is left as it is.
         """
         if self.__width != graphics.getDesktopSize()[0]:
             del self.__window
             self.__setupWindow()
 
+        # Only repaint if something changed since the last drawing.
+        drawnKey = self.__getDrawnKey(document)
+        if self.__is_visible and drawnKey == self.__drawnKey:
+            return
+
         width = document.ragWidth + layout.L_MARGIN + layout.R_MARGIN
         height = self.__window.getMaxHeight()
         cr = self.__context
@@ -169,6 +199,7 @@ class TextWindow(object):
         self.__window.setSize(width, height)
         self.__window.update()
         self.__is_visible = True
+        self.__drawnKey = drawnKey
 
     def hide(self):
         """
@@ -195,3 +226,4 @@ class TextWindow(object):
         self.__window.hide()
 
         self.__is_visible = False
+        self.__drawnKey = None
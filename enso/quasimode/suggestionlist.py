@@ -43,8 +43,6 @@
 # ----------------------------------------------------------------------------
 # Imports
 # ----------------------------------------------------------------------------
-from heapq import nsmallest
-
 from enso import commands, config
 from enso.commands.suggestions import AutoCompletion, Suggestion
 
@@ -117,6 +115,9 @@ class SuggestionList(object):
         # auto-completion attributes above need to be updated.
         self.__isDirty = False
 
+        # Recently computed states, most recent last; see __update().
+        self.__history = []
+
     def getUserText(self, prefixed=False):
         if prefixed and self.__userTextPrefix:
             return self.__userTextPrefix + " " + self.__userText
@@ -210,18 +211,37 @@ class SuggestionList(object):
         if not self.__isDirty:
             return
 
-        # NOTE: in the next line, ".lstrip()" is called because the
-        # autcompletions hould ignore heading whitespace.
-        # Leaving the trailing space intact so we can indicate it by dot
-        # in special cases (user typing command parameter).
-        self.__autoCompletion = self.__autoComplete(
-            self.getUserText().lstrip()
-        )
-        # NOTE: in the next line, ".strip()" is called because the
-        # suggestions should ignore trailing whitespace.
-        self.__suggestions = self.__findSuggestions(
-            self.getUserText().strip()
-        )
+        # The history holds the results for recent user texts, so
+        # that deleting characters, or merely changing the active
+        # index, restores the earlier results instead of querying the
+        # command manager again.
+        sourceKey = (self.__userText, self.__userTextPrefix)
+        for index, state in enumerate(self.__history):
+            if state[0] == sourceKey:
+                del self.__history[index]
+                (self.__userText, self.__userTextPrefix,
+                 self.__autoCompletion, self.__suggestions) = state[1:]
+                break
+        else:
+            # NOTE: in the next line, ".lstrip()" is called because the
+            # autcompletions hould ignore heading whitespace.
+            # Leaving the trailing space intact so we can indicate it by
+            # dot in special cases (user typing command parameter).
+            self.__autoCompletion = self.__autoComplete(
+                self.getUserText().lstrip()
+            )
+            # NOTE: in the next line, ".strip()" is called because the
+            # suggestions should ignore trailing whitespace.
+            self.__suggestions = self.__findSuggestions(
+                self.getUserText().strip()
+            )
+            state = (sourceKey, self.__userText, self.__userTextPrefix,
+                     self.__autoCompletion, self.__suggestions)
+
+        if config.QUASIMODE_SUGGESTION_HISTORY_SIZE > 0:
+            self.__history.append(state)
+            del self.__history[:-config.QUASIMODE_SUGGESTION_HISTORY_SIZE]
+
         # We need to verify that it is a valid index; if the
         # namespace changed, then the suggestionss in the above
         # getSuggestions() line might be different than the
@@ -258,6 +278,16 @@ class SuggestionList(object):
 
         return autoCompletion
 
+    def __autoCompleteVariant(self, userText):
+        """
+        Like __autoComplete(), but first checks whether userText has
+        any suggestions at all, which is cheaper to rule out.
+        """
+
+        if not self.__cmdManager.hasSuggestions(userText):
+            return AutoCompletion(userText, "")
+        return self.__autoComplete(userText)
+
     def __findSuggestions(self, userText):
         """
         Uses the command manager to determine if there are any inexact
@@ -278,12 +308,13 @@ class SuggestionList(object):
         auto = self.__autoCompletion
 
         # If no command matches the user text, offer "open <usertext>" variant
-        # as the autocompletion
+        # as the autocompletion.  Variants without any suggestions cannot
+        # have an auto-completion either, which is much cheaper to find out.
         if not auto.hasCompletion():
             # TODO: Handle this dynamically
             if ((userText[0].isdigit() or userText[0] in ("+", "-", ".", "=", "("))
                     and not userText.startswith("calculate ")):
-                _a = self.__autoComplete("calculate %s" % userText)
+                _a = self.__autoCompleteVariant("calculate %s" % userText)
                 if _a.hasCompletion():
                     auto = _a
                     userText = "calculate %s" % userText
@@ -292,7 +323,7 @@ class SuggestionList(object):
             # TODO: Handle this dynamically
             elif (config.QUASIMODE_SUGGEST_OPEN_COMMAND_IF_NO_OTHER_MATCH
                   and not userText.startswith("open ")):
-                _a = self.__autoComplete("open %s" % userText)
+                _a = self.__autoCompleteVariant("open %s" % userText)
                 if _a.hasCompletion():
                     auto = _a
                     userText = "open %s" % userText
@@ -301,11 +332,11 @@ class SuggestionList(object):
 
         # Get N top suggestions based on nearness
         # __cmp__() function on Suggestion object takes care of proper sort
-        suggestions = nsmallest(
+        suggestions = self.__cmdManager.retrieveTopSuggestions(
+            userText,
             # Get max+1 as the auto-completion can appear in the suggestions
             # list and we will remove it later
-            config.QUASIMODE_MAX_SUGGESTIONS + 1,
-            self.__cmdManager.retrieveSuggestions(userText)
+            config.QUASIMODE_MAX_SUGGESTIONS + 1
         )
 
         # Remove the auto-completion entry from the list
@@ -317,10 +348,12 @@ class SuggestionList(object):
                 del suggestions[-1]
 
         if len(suggestions) < config.QUASIMODE_MAX_SUGGESTIONS:
-            if (config.QUASIMODE_APPEND_OPEN_COMMAND or len(suggestions) == 0) and not userText.startswith("open "):
-                opencmd_suggestions = nsmallest(
-                    config.QUASIMODE_MAX_SUGGESTIONS - len(suggestions),
-                    self.__cmdManager.retrieveSuggestions("open %s" % userText)
+            if ((config.QUASIMODE_APPEND_OPEN_COMMAND or len(suggestions) == 0)
+                    and not userText.startswith("open ")
+                    and self.__cmdManager.hasSuggestions("open %s" % userText)):
+                opencmd_suggestions = self.__cmdManager.retrieveTopSuggestions(
+                    "open %s" % userText,
+                    config.QUASIMODE_MAX_SUGGESTIONS - len(suggestions)
                 )
                 if opencmd_suggestions:
                     suggestions.extend(opencmd_suggestions)
@@ -333,6 +366,12 @@ class SuggestionList(object):
         return suggestions
 
     def markDirty(self):
+        """
+        Forces the suggestion list to be recomputed from the commands,
+        e.g., because their suggestions have changed in the meantime.
+        """
+
+        self.__history = []
         self.__isDirty = True
 
     def __markDirty(self):
@@ -2,15 +2,19 @@
 from __future__ import with_statement
 import Queue
 import cgi
+import json
 import logging
 import os
 import socket
 import threading
+import time
 import urllib
 import urllib2
+import urlparse
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
 import enso.config
+from enso.eventprofiler import EventProfiler, HISTOGRAM_BOUNDS_MS
 from enso.contrib.scriptotron import cmdretriever, tracker
 from enso.contrib.scriptotron.tracebacks import safetyNetted
 from enso.messages import displayMessage as display_xml_message
@@ -102,6 +106,99 @@ def serve_js(request, file_name):
     request.wfile.write(content)
 
 
+PROFILER_PAGE = u"""<html>
+<head>
+<title>Enso event profiler</title>
+<style>
+body { font-family: sans-serif; font-size: 10pt; }
+table { border-collapse: collapse; margin-bottom: 2em; }
+th, td { border: 1px solid #ccc; padding: 2px 6px; text-align: right; }
+th.name, td.name { text-align: left; }
+</style>
+</head>
+<body>
+<h1>Enso event profiler</h1>
+<form method="post" action="/profiler">
+<input type="hidden" name="action" value="profiler">
+Profiler is <b>%(state)s</b>, %(recorded)d responder calls recorded
+(the last %(bufferSize)d are kept).
+<button name="enabled" value="%(toggleValue)s">%(toggleLabel)s</button>
+<button name="clear" value="1">Clear</button>
+<a href="/profiler.json">JSON</a>
+</form>
+<h2>Responders</h2>
+<table>
+<tr><th class="name">Event</th><th class="name">Responder</th>
+<th>Calls kept</th><th>Calls</th><th>Total ms</th><th>Mean ms</th>
+<th>Max ms</th>%(histogramHeaders)s</tr>
+%(statsRows)s
+</table>
+<h2>Slowest calls</h2>
+<table>
+<tr><th class="name">Time</th><th class="name">Event</th>
+<th class="name">Responder</th><th>ms</th></tr>
+%(slowestRows)s
+</table>
+</body>
+</html>
+"""
+
+
+def serve_profiler(request, query):
+    """
+    Serves the results of the event profiler, as an HTML page or, if
+    the path ends with .json, as JSON.  The 'event' query parameter
+    restricts them to the responders of an event type.
+    """
+    profiler = EventProfiler.get()
+    params = urlparse.parse_qs(query)
+    event_type = params.get("event", [None])[0]
+    stats = profiler.getStats(event_type)
+    slowest = profiler.getSlowestCalls(20, event_type)
+    summary = profiler.getSummary()
+
+    if request.path.split("?")[0].endswith(".json"):
+        content = json.dumps(dict(summary=summary, responders=stats,
+                                  slowest=slowest))
+        content_type = "application/json"
+    else:
+        def row(cells):
+            return u"<tr>%s</tr>" % u"".join(
+                u"<td class=\"name\">%s</td>" % cgi.escape(cell)
+                if isinstance(cell, basestring)
+                else u"<td>%s</td>" % (
+                    (u"%.3f" % cell) if isinstance(cell, float) else cell)
+                for cell in cells)
+
+        content = PROFILER_PAGE % dict(
+            state="on" if summary["enabled"] else "off",
+            recorded=summary["recorded"],
+            bufferSize=summary["bufferSize"],
+            toggleValue="0" if summary["enabled"] else "1",
+            toggleLabel="Disable" if summary["enabled"] else "Enable",
+            histogramHeaders=u"".join(
+                u"<th>&le; %s ms</th>" % bound for bound in HISTOGRAM_BOUNDS_MS)
+            + u"<th>&gt; %s ms</th>" % HISTOGRAM_BOUNDS_MS[-1],
+            statsRows=u"\n".join(
+                row([s["eventType"], s["responder"], s["count"],
+                     s["totalCount"], s["totalMs"], s["meanMs"], s["maxMs"]]
+                    + s["histogram"])
+                for s in stats),
+            slowestRows=u"\n".join(
+                row([time.strftime("%H:%M:%S", time.localtime(when)),
+                     call_event_type, responder, elapsed_ms])
+                for when, call_event_type, responder, elapsed_ms in slowest),
+        )
+        content = content.encode("UTF-8")
+        content_type = "text/html; charset=UTF-8"
+
+    request.send_response(200)
+    request.send_header("Content-Type", content_type)
+    request.send_header("Cache-Control", "no-cache")
+    request.end_headers()
+    request.wfile.write(content)
+
+
 class myhandler(BaseHTTPRequestHandler):
 
     def __init__(self, request, client_address, server, queue):
@@ -111,8 +208,11 @@ class myhandler(BaseHTTPRequestHandler):
     def do_GET(self):
         webdir = os.path.realpath(
             os.path.join(os.path.split(__file__)[0], "..", "web"))
+        path, _, query = self.path.partition("?")
         if self.path == "/install.js":
             serve_install_js(self)
+        elif path in ("/profiler", "/profiler.json"):
+            serve_profiler(self, query)
         elif self.path.startswith("/help/command/"):
             self.send_response(200)
             self.send_header("Content-Type", "text/html")
@@ -152,6 +252,7 @@ class myhandler(BaseHTTPRequestHandler):
             url = form.getfirst("url", None)
             if url:
                 self.queue.put(url)
+                schedule_pollqueue()
                 self.send_response(200)
                 self.end_headers()
                 self.wfile.write("""OK""")
@@ -159,7 +260,16 @@ class myhandler(BaseHTTPRequestHandler):
                 self.send_response(401)
                 self.end_headers()
                 self.wfile.write("""Bad Request""")
-
+        elif action == "profiler":
+            profiler = EventProfiler.get()
+            enabled = form.getfirst("enabled", None)
+            if enabled is not None:
+                profiler.setEnabled(enabled == "1")
+            if form.getfirst("clear", None):
+                profiler.clear()
+            self.send_response(303)
+            self.send_header("Location", "/profiler")
+            self.end_headers()
         else:
             self.send_response(401)
             self.end_headers()
@@ -314,16 +424,20 @@ def install_command_from_url(command_url):
 
 
 commandq = Queue.Queue()
-_poll_ms_accumulator = 0
+_event_manager = None
 
 
-def pollqueue(ms):
-    global _poll_ms_accumulator
-    _poll_ms_accumulator += ms
-    if _poll_ms_accumulator < 500:
-        return
-    _poll_ms_accumulator = 0
+def schedule_pollqueue():
+    """
+    Has pollqueue() called on the main thread; called by the server
+    thread whenever it queues a command URL, so that the main loop
+    need not poll the queue all the time.
+    """
+    if _event_manager is not None:
+        _event_manager.scheduleTimerCall(pollqueue)
+
 
+def pollqueue():
     try:
         command_url = commandq.get(False, 0)
     except Queue.Empty:
@@ -334,9 +448,10 @@ def pollqueue(ms):
 
 
 def start(eventManager):
+    global _event_manager
     logging.info("Starting WebUI")
+    _event_manager = eventManager
     httpd_server = Httpd(commandq)
     httpd_server.setDaemon(True)
     httpd_server.start()
-    eventManager.registerResponder(pollqueue, "timer")
     return httpd_server
@@ -0,0 +1,333 @@
+#! /usr/bin/env python
+# vim:set tabstop=4 shiftwidth=4 expandtab:
+# -*- coding: utf-8 -*-
+
+"""
+    Keystroke-replay benchmark for command matching.
+
+    Builds a synthetic command corpus (named commands plus many command
+    factories with generated postfixes), replays typing sessions
+    through the CommandManager and through a SuggestionList, the way
+    the quasimode does on every keystroke, and reports the latency
+    percentiles and object allocations per keystroke.
+
+    Runs headless: neither an X server nor the graphics backend is
+    needed.  Typical use, from the top-level directory:
+
+      PYTHONPATH=. python scripts/bench_matching.py -f 2000 -p 200000
+
+    Sessions can be recorded in a text file given with --sessions: one
+    session per line, holding the characters typed, with the two
+    characters \\b standing for a backspace.  Lines starting with #
+    are ignored.  By default, sessions are generated from the corpus.
+"""
+
+import gc
+import imp
+import os
+import random
+import sys
+from optparse import OptionParser
+from timeit import default_timer
+
+import enso.config
+from enso.commands.factories import GenericPrefixFactory
+from enso.commands.interfaces import CommandObject
+from enso.commands.manager import CommandManager
+
+
+ENSO_DIR = os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), ".."))
+
+SYLLABLES = [
+    "ab", "ac", "al", "an", "ar", "ba", "be", "bi", "bo", "ca", "ce", "co",
+    "da", "de", "di", "do", "el", "en", "er", "fa", "fi", "fo", "ga", "ge",
+    "go", "ha", "he", "hi", "in", "is", "ka", "ke", "la", "le", "li", "lo",
+    "ma", "me", "mi", "mo", "na", "ne", "ni", "no", "on", "or", "pa", "pe",
+    "pi", "po", "ra", "re", "ri", "ro", "sa", "se", "si", "so", "ta", "te",
+    "ti", "to", "un", "ur", "va", "ve", "vi", "wa", "we", "xi", "ya", "zo",
+]
+
+BACKSPACE = "\b"
+
+
+def load_suggestion_list_class():
+    """
+    Returns the SuggestionList class.  Importing the enso.quasimode
+    package loads the graphics backend, so if that is not available,
+    the module is loaded on its own; it only needs enso.commands.
+    """
+
+    try:
+        from enso.quasimode.suggestionlist import SuggestionList
+    except ImportError:
+        module = imp.load_source(
+            "_bench_suggestionlist",
+            os.path.join(ENSO_DIR, "enso", "quasimode", "suggestionlist.py"))
+        SuggestionList = module.SuggestionList
+    return SuggestionList
+
+
+# ----------------------------------------------------------------------------
+# Corpus
+# ----------------------------------------------------------------------------
+
+class BenchCommand(CommandObject):
+
+    def __init__(self):
+        CommandObject.__init__(self)
+        self.setDescription("Does nothing.")
+
+    def run(self):
+        pass
+
+
+class BenchFactory(GenericPrefixFactory):
+    HELP_TEXT = "parameter"
+
+    def __init__(self, prefix, postfixes):
+        self.PREFIX = prefix
+        GenericPrefixFactory.__init__(self)
+        self.setPostfixes(postfixes)
+
+    def update(self):
+        pass
+
+    def _generateCommandObj(self, postfix):
+        return BenchCommand()
+
+
+def make_word(rnd):
+    return "".join(rnd.choice(SYLLABLES)
+                   for i in range(rnd.randint(1, 4)))
+
+
+def make_phrase(rnd):
+    return " ".join(make_word(rnd) for i in range(rnd.randint(1, 4)))
+
+
+def build_corpus(rnd, factoryCount, postfixCount, commandCount):
+    """
+    Returns a CommandManager holding commandCount named commands and
+    factoryCount factories sharing postfixCount postfixes, and the
+    list of all command names.  The "open" factory gets half of the
+    postfixes, as it does in practice; the other factories share the
+    rest unevenly.
+    """
+
+    manager = CommandManager()
+    names = []
+
+    for name in set(make_phrase(rnd) for i in range(commandCount)):
+        manager.registerCommand(name, BenchCommand())
+        names.append(name)
+
+    prefixes = ["open"]
+    seen = set(prefixes)
+    while len(prefixes) < factoryCount:
+        prefix = make_word(rnd) + rnd.choice(["", " " + make_word(rnd)])
+        if prefix not in seen:
+            seen.add(prefix)
+            prefixes.append(prefix)
+
+    # Factory i (but the first) gets a share proportional to 1 / i.
+    weights = [0.0] + [1.0 / i for i in range(1, len(prefixes))]
+    total = sum(weights) or 1.0
+    shares = [postfixCount // 2] + [
+        int(postfixCount / 2 * weight / total) for weight in weights[1:]]
+
+    for prefix, share in zip(prefixes, shares):
+        postfixes = list(set(make_phrase(rnd) for i in range(share)))
+        factory = BenchFactory(prefix + " ", postfixes)
+        manager.registerCommand(prefix + " {parameter}", factory)
+        names.extend(prefix + " " + postfix for postfix in postfixes[:100])
+
+    return manager, names
+
+
+# ----------------------------------------------------------------------------
+# Sessions
+# ----------------------------------------------------------------------------
+
+def generate_sessions(rnd, names, count, typoRate):
+    """
+    Returns count sessions typing (part of) random command names,
+    with an occasional typo that is corrected with a backspace.
+    """
+
+    sessions = []
+    for i in range(count):
+        name = rnd.choice(names)
+        typed = []
+        for char in name[:rnd.randint(1, len(name))]:
+            if rnd.random() < typoRate:
+                typed.append(rnd.choice(SYLLABLES)[0])
+                typed.append(BACKSPACE)
+            typed.append(char)
+        sessions.append("".join(typed))
+    return sessions
+
+
+def read_sessions(fileName):
+    sessions = []
+    for line in open(fileName):
+        line = line.rstrip("\r\n")
+        if line and not line.startswith("#"):
+            sessions.append(line.replace("\\b", BACKSPACE))
+    return sessions
+
+
+def iter_texts(session):
+    """
+    Yields the user text after every keystroke of session.
+    """
+
+    text = ""
+    for char in session:
+        if char == BACKSPACE:
+            text = text[:-1]
+        else:
+            text += char
+        yield text
+
+
+# ----------------------------------------------------------------------------
+# Replay
+# ----------------------------------------------------------------------------
+
+def replay(sessions, start, keystroke):
+    """
+    Replays sessions, calling start() at the beginning of each one
+    and keystroke(text) after every keystroke, and returns the lists
+    of per-keystroke latencies (in seconds) and net allocations of
+    garbage-collected objects.
+    """
+
+    latencies = []
+    allocations = []
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for session in sessions:
+            start()
+            for text in iter_texts(session):
+                # Collecting resets the allocation count; it is kept
+                # out of the measured time.
+                gc.collect()
+                before = gc.get_count()[0]
+                began = default_timer()
+                keystroke(text)
+                latencies.append(default_timer() - began)
+                allocations.append(gc.get_count()[0] - before)
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return latencies, allocations
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of the sorted list values.
+    """
+
+    if not values:
+        return 0
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[rank]
+
+
+def report(name, latencies, allocations):
+    latencies = sorted(latencies)
+    allocations = sorted(allocations)
+    print "%-16s %7d keys  p50 %8.3f ms  p95 %8.3f ms  p99 %8.3f ms  " \
+          "max %8.3f ms  alloc p50 %6d  p99 %6d" % (
+              name, len(latencies),
+              percentile(latencies, 0.50) * 1000,
+              percentile(latencies, 0.95) * 1000,
+              percentile(latencies, 0.99) * 1000,
+              (latencies[-1] if latencies else 0) * 1000,
+              percentile(allocations, 0.50),
+              percentile(allocations, 0.99))
+
+
+def process_options(argv):
+    usageStr = "%prog [options]\n\n" + __doc__.strip().split("\n")[0]
+    parser = OptionParser(usage=usageStr)
+
+    parser.add_option("-f", "--factories", action="store", type="int",
+                      dest="factories", default=1000,
+                      help="number of command factories")
+    parser.add_option("-p", "--postfixes", action="store", type="int",
+                      dest="postfixes", default=100000,
+                      help="total number of factory postfixes")
+    parser.add_option("-c", "--commands", action="store", type="int",
+                      dest="commands", default=500,
+                      help="number of named commands")
+    parser.add_option("-n", "--sessions-count", action="store", type="int",
+                      dest="sessions_count", default=200,
+                      help="number of generated typing sessions")
+    parser.add_option("-s", "--sessions", action="store", dest="sessions",
+                      default=None,
+                      help="file of recorded typing sessions to replay")
+    parser.add_option("", "--typo-rate", action="store", type="float",
+                      dest="typo_rate", default=0.05,
+                      help="typo probability per generated keystroke")
+    parser.add_option("", "--seed", action="store", type="int",
+                      dest="seed", default=1, help="random seed")
+    parser.add_option("", "--usage-weight", action="store", type="float",
+                      dest="usage_weight", default=0.0,
+                      help="COMMAND_USAGE_RANKING_WEIGHT to use; the "
+                      "default ignores the user's command usage")
+
+    opts, args = parser.parse_args(argv)
+    return opts, args
+
+
+def main(argv=None):
+    opts, args = process_options(argv[1:])
+
+    enso.config.COMMAND_USAGE_RANKING_WEIGHT = opts.usage_weight
+    maxSuggestions = enso.config.QUASIMODE_MAX_SUGGESTIONS + 1
+    rnd = random.Random(opts.seed)
+
+    began = default_timer()
+    manager, names = build_corpus(
+        rnd, opts.factories, opts.postfixes, opts.commands)
+    print "Corpus: %d factories, %d postfixes, %d commands" % (
+        opts.factories, opts.postfixes, opts.commands)
+
+    if opts.sessions:
+        sessions = read_sessions(opts.sessions)
+    else:
+        sessions = generate_sessions(
+            rnd, names, opts.sessions_count, opts.typo_rate)
+
+    # The first query of each factory builds its postfix index; do
+    # that up front so that it is not attributed to a keystroke.
+    manager.retrieveTopSuggestions("", maxSuggestions)
+    print "Setup: %.2f s, %d sessions" % (default_timer() - began,
+                                          len(sessions))
+
+    def noop():
+        pass
+
+    def manager_keystroke(text):
+        manager.autoComplete(text)
+        manager.retrieveTopSuggestions(text, maxSuggestions)
+
+    report("CommandManager", *replay(sessions, noop, manager_keystroke))
+
+    suggestionList = load_suggestion_list_class()(manager)
+
+    def list_keystroke(text):
+        suggestionList.setUserText(text)
+        suggestionList.getSuggestions()
+        suggestionList.getDescription()
+
+    report("SuggestionList",
+           *replay(sessions, suggestionList.clearState, list_keystroke))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,350 @@
+#! /usr/bin/env python
+# vim:set tabstop=4 shiftwidth=4 expandtab:
+# -*- coding: utf-8 -*-
+
+"""
+    Headless rendering benchmark.
+
+    Lays out and draws a corpus of quasimode suggestion lines and of
+    primary and mini messages with the Enso text layout code, onto
+    offscreen cairo image surfaces, and reports the layouts (or draws)
+    per second, the glyph measurement work and the peak memory use of
+    each part.
+
+    Runs without an X server: the script provides the "cairo" and
+    "graphics" interfaces to Enso itself, with a fixed desktop size,
+    so only pycairo and the fonts are needed.  Typical use, from the
+    top-level directory:
+
+      PYTHONPATH=. python scripts/bench_rendering.py -n 20
+
+    The glyph metrics are measured anew on every run unless
+    --persist-metrics is given, so that the measurement counts are
+    comparable between runs.
+"""
+
+import gc
+import imp
+import os
+import resource
+import sys
+from optparse import OptionParser
+from timeit import default_timer
+
+import enso.config
+
+ENSO_DIR = os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), ".."))
+
+DESKTOP_SIZE = (1920, 1080)
+
+SUGGESTIONS = [
+    # (user text, suggested text, help text)
+    ("o", "open", "name"),
+    ("op", "open firefox", None),
+    ("open fi", "open firefox", None),
+    ("open ter", "open terminal", None),
+    ("open lib", "open libreoffice writer", None),
+    ("cal", "calculate", "expression"),
+    ("calculate 2+", "calculate 2+2*3", None),
+    ("go", "google", "search terms"),
+    ("google enso la", "google enso launcher linux", None),
+    ("wik", "wikipedia", "search terms"),
+    ("wikipedia lin", "wikipedia linear algebra", None),
+    ("lea", "learn as open", "name"),
+    ("learn as open proj", "learn as open projects folder", None),
+    ("tr", "translate", "text"),
+    ("translate bonjour to en", "translate bonjour tout le monde to english",
+     None),
+    ("cl", "close", None),
+    ("minim", "minimize all windows", None),
+    ("spel", "spellcheck", "word"),
+    ("sys", "system information", None),
+    ("undo op", "undo open", None),
+    ("opn fierfox", "open firefox", None),
+    ("define pro", "define procrastination", None),
+    ("map", "map", "address"),
+    ("map 1600 penn", "map 1600 pennsylvania avenue washington dc", None),
+    ("emai", "email to", "contact"),
+    ("email to jo", "email to john.doe@example.com", None),
+    ("en", "enso", "command"),
+    ("enso ab", "enso about", None),
+    ("rec", "recent documents", None),
+    ("ope", u"open Caf\u00e9 Crem\u00e9 menu.pdf", None),
+    ("open ", u"open \u00dcbersicht \u2013 Q3 Planung.odt", None),
+]
+
+MESSAGES = [
+    ("<p>Enso is ready.</p>", "<caption>enso</caption>"),
+    ("<p>Copied <command>2+2*3 = 8</command> to the clipboard.</p>", None),
+    ("<p>No command matches <b>opn fierfox</b>.</p>"
+     "<p>Did you mean <command>open firefox</command>?</p>",
+     "<caption>command not found</caption>"),
+    ("<p>Learned <command>projects folder</command> as a shortcut to "
+     "<b>/home/user/projects</b>. Type <command>open projects folder"
+     "</command> to open it.</p>", "<caption>learn as open</caption>"),
+    ("<p>The <command>translate</command> command needs some text to "
+     "translate. Select some text in any application or type it after "
+     "the command name, followed by <b>to</b> and the language to "
+     "translate it to.</p>", "<caption>help</caption>"),
+    ("<p>" + " ".join(["A long message, wrapping over many lines to make "
+                       "the layout shrink its text to fit in the window."]
+                      * 12) + "</p>", "<caption>long message</caption>"),
+    ("<p><error>Error:</error> could not connect to the translation "
+     "service; check your network connection and try again.</p>", None),
+    (u"<p>Opening \u00dcbersicht \u2013 Q3 Planung.odt\u2026</p>", None),
+]
+
+
+# ----------------------------------------------------------------------------
+# Headless graphics provider
+# ----------------------------------------------------------------------------
+
+def provideInterface(name):
+    """
+    Provides Enso with the interfaces that would need an X server;
+    this module is put first in enso.config.PROVIDERS.
+    """
+
+    if name == "cairo":
+        import cairo
+        return cairo
+    elif name == "graphics":
+        return sys.modules[__name__]
+    return None
+
+
+def getDesktopOffset():
+    return 0, 0
+
+
+def getDesktopSize():
+    return DESKTOP_SIZE
+
+
+getWorkareaOffset = getDesktopOffset
+getWorkareaSize = getDesktopSize
+
+
+def processWindowManagerPendingEvents():
+    pass
+
+
+if sys.platform.startswith("linux"):
+    # Fonts are looked up through fontconfig, as the Linux graphics
+    # backend does; it needs no X server.
+    from enso.platform.linux.font_registry import FontRegistry
+
+
+# ----------------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------------
+
+def get_peak_memory():
+    """
+    Returns the peak resident memory of the process, in kilobytes.
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes there.
+        peak //= 1024
+    return peak
+
+
+def run_suite(name, items, passes, run, setup=None):
+    """
+    Calls run(item) for each item of items, passes times, calling
+    setup() (if given) before each call, outside of the measured time,
+    and reports the results.
+    """
+
+    from enso.graphics import font
+
+    gc.collect()
+    statsBefore = font.getGlyphMetricsStats()
+    elapsed = 0.0
+    count = 0
+    for i in range(passes):
+        for item in items:
+            if setup is not None:
+                setup()
+            began = default_timer()
+            run(item)
+            elapsed += default_timer() - began
+            count += 1
+    stats = font.getGlyphMetricsStats()
+
+    print "%-22s %7d ops  %9.1f ops/s  %7.3f ms/op  blocks measured %4d  " \
+          "loaded %4d  glyphs %5d  peak %7d KiB" % (
+              name, count, count / elapsed if elapsed else 0.0,
+              elapsed / count * 1000 if count else 0.0,
+              stats["blocksMeasured"] - statsBefore["blocksMeasured"],
+              stats["blocksLoaded"] - statsBefore["blocksLoaded"],
+              stats["glyphsCreated"] - statsBefore["glyphsCreated"],
+              get_peak_memory())
+
+
+# ----------------------------------------------------------------------------
+# Suites
+# ----------------------------------------------------------------------------
+
+def load_quasimode_layout():
+    """
+    Returns the enso.quasimode.layout module.  Importing the
+    enso.quasimode package loads the input backend, which needs an X
+    server, so the module is loaded on its own; it only needs the
+    graphics code.
+    """
+
+    return imp.load_source(
+        "_bench_quasimode_layout",
+        os.path.join(ENSO_DIR, "enso", "quasimode", "layout.py"))
+
+
+def make_suggestion_lines(layout):
+    """
+    Returns the quasimode line markup of the suggestion corpus.
+    """
+
+    from enso.commands.suggestions import Suggestion
+
+    lines = []
+    for userText, suggestedText, helpText in SUGGESTIONS:
+        xml = Suggestion(userText, suggestedText, helpText).toXml()
+        lines.append(layout.QuasimodeLayout.LINE_XML % xml)
+    return lines
+
+
+def run_benchmarks(passes):
+    import cairo
+    from enso.graphics import measurement, xmltextlayout
+    from enso.messages import Message
+    from enso.messages.miniwindows import MINI_MARGIN, MINI_WIND_SIZE, \
+        MiniMessageWindow
+    from enso.messages.primarywindow import MAX_MSG_HEIGHT, \
+        PRIM_MSG_MARGIN, PRIM_MSG_WIDTH, PrimaryMsgWind, splitContent
+
+    layout = load_quasimode_layout()
+    lines = make_suggestion_lines(layout)
+    styles = layout.retrieveSuggestionStyles(active=False)
+
+    def clear_caches():
+        xmltextlayout._parseCache.clear()
+        layout._layoutCache.clear()
+
+    # Parsing and laying out at a fixed size.
+    def xml_layout(line):
+        xmltextlayout.xmlMarkupToDocument(line, styles, layout.XML_ALIASES)
+
+    run_suite("xmltextlayout", lines, passes, xml_layout, clear_caches)
+    run_suite("xmltextlayout cached", lines, passes, xml_layout)
+
+    # Fitting the quasimode lines to the largest size.
+    def quasimode_line(line):
+        layout.layoutXmlLine(
+            xml_data=line,
+            styles=layout.retrieveAutocompleteStyles(active=True),
+            scale=layout.AUTOCOMPLETE_SCALE,
+        )
+
+    run_suite("quasimode lines", lines, passes, quasimode_line, clear_caches)
+    run_suite("quasimode cached", lines, passes, quasimode_line)
+
+    # Drawing laid out lines.
+    width, height = DESKTOP_SIZE
+    surface = cairo.ImageSurface(
+        cairo.FORMAT_ARGB32, width,
+        int(measurement.pointsToPixels(
+            layout.AUTOCOMPLETE_SCALE[-1] * layout.HEIGHT_FACTOR)))
+    context = cairo.Context(surface)
+    measurement.convertUserSpaceToPoints(context)
+    documents = [layout.layoutXmlLine(
+        xml_data=line,
+        styles=layout.retrieveAutocompleteStyles(active=True),
+        scale=layout.AUTOCOMPLETE_SCALE,
+    ) for line in lines]
+
+    def draw(document):
+        context.save()
+        context.set_operator(cairo.OPERATOR_CLEAR)
+        context.paint()
+        context.restore()
+        document.draw(layout.L_MARGIN, document.shrinkOffset, context)
+        surface.flush()
+
+    run_suite("textlayout draw", documents, passes, draw)
+
+    # Primary messages, as laid out by PrimaryMsgWind.
+    primWidth = min(PRIM_MSG_WIDTH, measurement.pixelsToPoints(width) - 1) \
+        - 2 * PRIM_MSG_MARGIN
+    primHeight = min(MAX_MSG_HEIGHT, measurement.pixelsToPoints(height) - 1) \
+        - 2 * PRIM_MSG_MARGIN
+    layoutText = getattr(PrimaryMsgWind, "_PrimaryMsgWind__layoutText")
+
+    def primary_message(message):
+        msgText, capText = splitContent(message)
+        layoutText(msgText, capText, primWidth, primHeight)
+
+    messages = [msgText + (capText or "") for msgText, capText in MESSAGES]
+    run_suite("primary messages", messages, passes, primary_message,
+              clear_caches)
+
+    # Mini messages, as laid out by MiniMessageWindow.
+    miniWidth = MINI_WIND_SIZE[0] - 2 * MINI_MARGIN
+    miniHeight = MINI_WIND_SIZE[1] - 2 * MINI_MARGIN
+    miniLayout = getattr(MiniMessageWindow, "_MiniMessageWindow__layout")
+
+    def mini_message(message):
+        miniLayout(message, miniWidth, miniHeight)
+
+    miniMessages = [Message(fullXml=msgText, miniXml=msgText, isMini=True)
+                    for msgText, capText in MESSAGES]
+    run_suite("mini messages", miniMessages, passes, mini_message,
+              clear_caches)
+
+
+def process_options(argv):
+    usageStr = "%prog [options]\n\n" + __doc__.strip().split("\n")[0]
+    parser = OptionParser(usage=usageStr)
+
+    parser.add_option("-n", "--passes", action="store", type="int",
+                      dest="passes", default=20,
+                      help="number of passes over each corpus")
+    parser.add_option("-W", "--width", action="store", type="int",
+                      dest="width", default=DESKTOP_SIZE[0],
+                      help="desktop width, in pixels")
+    parser.add_option("-H", "--height", action="store", type="int",
+                      dest="height", default=DESKTOP_SIZE[1],
+                      help="desktop height, in pixels")
+    parser.add_option("", "--persist-metrics", action="store_true",
+                      dest="persist_metrics", default=False,
+                      help="load and save the glyph metrics in the Enso "
+                      "cache directory, as Enso does")
+
+    opts, args = parser.parse_args(argv)
+    return opts, args
+
+
+def main(argv=None):
+    global DESKTOP_SIZE
+
+    opts, args = process_options(argv[1:])
+    DESKTOP_SIZE = (opts.width, opts.height)
+
+    enso.config.PROVIDERS.insert(0, __name__)
+
+    from enso.graphics import font
+    font.PERSIST_GLYPH_METRICS = opts.persist_metrics
+
+    print "Desktop: %dx%d pixels, %d passes" % (
+        DESKTOP_SIZE[0], DESKTOP_SIZE[1], opts.passes)
+    began = default_timer()
+    run_benchmarks(opts.passes)
+    print "Total: %.2f s, peak %d KiB" % (default_timer() - began,
+                                          get_peak_memory())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
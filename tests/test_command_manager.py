@@ -9,9 +9,12 @@
 import unittest
 import os
 
+from enso.commands.manager import CommandManager
 from enso.commands.manager import CommandObjectRegistry
 from enso.commands.manager import CommandAlreadyRegisteredError
+from enso.commands.manager import CommandPrefixIndex
 from enso.commands.interfaces import CommandExpression
+from enso.commands.factories import ArbitraryPostfixFactory
 
 
 # ----------------------------------------------------------------------------
@@ -51,9 +54,81 @@ class RegistryTester( unittest.TestCase ):
         self.failUnlessEqual( set( self.registry.getCommandList() ),
                               set( self.TESTS ) )
 
+    def testHasSuggestions( self ):
+        for userText in [ "", "a", "b", "z", "ab", "1" ]:
+            self.failUnlessEqual(
+                self.registry.hasSuggestions( userText ),
+                len( self.registry.retrieveSuggestions( userText ) ) > 0
+                )
+
     # TODO: Match testing.
     # TODO: Suggestion testing.
 
+
+# ----------------------------------------------------------------------------
+# Prefix Index Unit Tests
+# ----------------------------------------------------------------------------
+
+class PrefixIndexTester( unittest.TestCase ):
+    EXPRESSIONS = [ "{all named commands}",
+                    "open {file}",
+                    "open with {app}",
+                    "calculate {expression}",
+                    "o {x}" ]
+
+    def setUp( self ):
+        self.index = CommandPrefixIndex()
+        self.exprs = [ CommandExpression( e ) for e in self.EXPRESSIONS ]
+        for expr in self.exprs:
+            self.index.add( expr, FakeCommand( str(expr) ) )
+
+    def tearDown( self ):
+        self.index = None
+
+    def testMatchesAgreeWithExpressions( self ):
+        for userText in [ "", "o", "op", "open", "open ", "open foo",
+                          "open with x", "calc", "x", "calculate 1+1" ]:
+            expected = set( [ str(e) for e in self.exprs
+                              if e.matches( userText ) ] )
+            found = [ str(e) for e, f in self.index.iterMatches( userText ) ]
+            self.failUnlessEqual( len( found ), len( expected ) )
+            self.failUnlessEqual( set( found ), expected )
+
+    def testRemove( self ):
+        self.index.remove( self.exprs[1] )
+        found = [ str(e) for e, f in self.index.iterMatches( "open foo" ) ]
+        self.failUnlessEqual( found, [ "{all named commands}" ] )
+
+
+
+# ----------------------------------------------------------------------------
+# Command Manager Unit Tests
+# ----------------------------------------------------------------------------
+
+class FakeCalculateFactory( ArbitraryPostfixFactory ):
+    PREFIX = "calculate "
+    HELP_TEXT = "expression"
+
+    def _generateCommandObj( self, postfix ):
+        return FakeCommand( postfix )
+
+class ManagerTester( unittest.TestCase ):
+    def setUp( self ):
+        self.manager = CommandManager()
+        self.manager.registerCommand( "calculate {expression}",
+                                      FakeCalculateFactory() )
+
+    def tearDown( self ):
+        self.manager = None
+
+    def testHasSuggestionsAgreesWithAutoComplete( self ):
+        for userText in [ "c", "calc", "calculate ", "calculate 5+3",
+                          "x", "calculate5" ]:
+            self.failUnlessEqual(
+                self.manager.hasSuggestions( userText ),
+                self.manager.autoComplete( userText ) is not None
+                )
+
         
 # ----------------------------------------------------------------------------
 # Script
@@ -8,7 +8,9 @@
 
 import unittest
 
+from enso.commands import highlighting
 from enso.commands import suggestions
+from enso.commands import usage
 
 
 # ----------------------------------------------------------------------------
@@ -92,6 +94,72 @@ class SuggestionBasicTests( unittest.TestCase ):
         # Make sure we can create empty AutoCompletions
         # We're checking to see whether errors get raised.
         suggestions.AutoCompletion( self.SOURCE, "" )
+
+
+class HighlightingTests( unittest.TestCase ):
+    def testSpanAgreesWithSimilarity( self ):
+        # For a plain substring match, the single-pass markup must be
+        # the same as the one found by comparing the texts.
+        for source, text, start in [ ( "open fi", "open my file", 3 ),
+                                     ( "open my", "open my file", 0 ),
+                                     ( "open le", "open file", 2 ) ]:
+            self.failUnlessEqual(
+                highlighting.markupSpan( text, 5, start,
+                                         start + len( source ) - 5 ),
+                highlighting.markupSimilarity( source, text )
+                )
+
+    def testSpanSuggestion( self ):
+        sugg = suggestions.Suggestion( "open fi", "open my file", None,
+                                       5, 3, 5 )
+        self.failUnlessEqual( sugg.toXml(), "open <ins>my </ins>fi<ins>le</ins>" )
+
+
+class TopSuggestionsTests( unittest.TestCase ):
+    SOURCE = "abcd"
+    TEXTS = [ "abcdz", "zabcd", "abcdzzzz", "abcd", "abzd", "abcdzz",
+              "xyz", "abcdzzzzzz" ]
+
+    def testTopSuggestions( self ):
+        allSuggestions = [ suggestions.Suggestion( self.SOURCE, text )
+                           for text in self.TEXTS ]
+        for size in range( len( self.TEXTS ) + 2 ):
+            top = suggestions.TopSuggestions( size )
+            top.extend( allSuggestions )
+            self.failUnlessEqual(
+                [ s.toText() for s in top.getSuggestions() ],
+                [ s.toText() for s in sorted( allSuggestions )[:size] ]
+                )
+
+    def testOfferText( self ):
+        top = suggestions.TopSuggestions( 3 )
+        for text in self.TEXTS:
+            top.offerText( self.SOURCE, text )
+        expected = sorted( [ suggestions.Suggestion( self.SOURCE, text )
+                             for text in self.TEXTS ] )[:3]
+        result = top.getSuggestions()
+        self.failUnlessEqual( result, expected )
+        for sugg in result:
+            self.failUnless( isinstance( sugg, suggestions.Suggestion ) )
+
+    def testUsageBoost( self ):
+        store = usage.UsageStore()
+        worst = sorted( [ suggestions.Suggestion( self.SOURCE, text )
+                          for text in self.TEXTS ] )[-1].toText()
+        store.recordRun( worst )
+        top = suggestions.TopSuggestions( 1, store, 1.0 )
+        for text in self.TEXTS:
+            top.offerText( self.SOURCE, text )
+        self.failUnless( top.isBoosted( worst ) )
+        self.failUnlessEqual( [ s.toText() for s in top.getSuggestions() ],
+                              [ worst ] )
+
+    def testNearnessBound( self ):
+        for text in self.TEXTS:
+            sugg = suggestions.Suggestion( self.SOURCE, text )
+            bound = suggestions.nearnessBound( len( self.SOURCE ),
+                                               len( text ) )
+            self.failUnless( sugg._nearness <= bound )
     
 
 # ----------------------------------------------------------------------------
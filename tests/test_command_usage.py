@@ -0,0 +1,85 @@
+"""
+    Tests for the persistent command usage store.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from enso.commands import usage
+from enso.commands.usage import UsageStore
+
+
+# ----------------------------------------------------------------------------
+# Unit Tests
+# ----------------------------------------------------------------------------
+
+DAY = 24 * 60 * 60
+
+class UsageStoreTests( unittest.TestCase ):
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join( self.directory, usage.USAGE_FILE_NAME )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def testBoost( self ):
+        store = UsageStore( self.fileName, halfLife=DAY )
+        store.recordRun( "open firefox", 0 )
+        store.recordRun( "open firefox", 0 )
+        store.recordRun( "calculate", 0 )
+        self.failUnlessEqual( store.getBoost( "open firefox" ), 1.0 )
+        self.failUnlessEqual( store.getBoost( "calculate" ), 0.5 )
+        self.failUnlessEqual( store.getBoost( "help" ), 0.0 )
+        self.failUnless( "calculate" in store )
+
+    def testDecay( self ):
+        store = UsageStore( None, halfLife=DAY )
+        store.recordRun( "open firefox", 0 )
+        store.recordRun( "open firefox", 0 )
+        store.recordRun( "calculate", 2 * DAY )
+        self.failUnlessAlmostEqual( store.getScore( "open firefox", 2 * DAY ),
+                                    0.5 )
+        self.failUnlessEqual( store.getBoost( "calculate" ), 1.0 )
+        self.failUnlessAlmostEqual( store.getBoost( "open firefox" ), 0.5 )
+
+    def testPersistence( self ):
+        store = UsageStore( self.fileName, halfLife=DAY )
+        store.recordRun( u"open caf\xe9", 0 )
+        store.recordRun( "calculate", DAY )
+        reloaded = UsageStore( self.fileName, halfLife=DAY )
+        self.failUnlessAlmostEqual( reloaded.getScore( u"open caf\xe9", DAY ),
+                                    0.5 )
+        self.failUnlessAlmostEqual( reloaded.getBoost( u"open caf\xe9" ),
+                                    0.5 )
+
+    def testByteStringNames( self ):
+        store = UsageStore( None, halfLife=DAY )
+        store.recordRun( u"open caf\xe9".encode( "utf-8" ), 0 )
+        self.failUnless( u"open caf\xe9" in store )
+
+    def testCompaction( self ):
+        store = UsageStore( self.fileName, halfLife=DAY )
+        store.recordRun( "help", 0 )
+        for i in range( 10 ):
+            store.recordRun( "calculate", 10 * DAY )
+        store.compact( 10 * DAY )
+        self.failIf( "help" in store )
+        self.failUnlessEqual( len( open( self.fileName ).readlines() ), 1 )
+        reloaded = UsageStore( self.fileName, halfLife=DAY )
+        self.failUnlessAlmostEqual( reloaded.getScore( "calculate", 10 * DAY ),
+                                    10.0 )
+
+
+# ----------------------------------------------------------------------------
+# Script
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+    Tests for the event responder profiler.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+import unittest
+
+from enso import eventprofiler
+from enso.eventprofiler import EventProfiler
+
+
+# ----------------------------------------------------------------------------
+# Unit Tests
+# ----------------------------------------------------------------------------
+
+class EventProfilerTests( unittest.TestCase ):
+    def setUp( self ):
+        self.profiler = EventProfiler( bufferSize=4 )
+        self.profiler.setEnabled( True )
+
+    def tearDown( self ):
+        self.profiler = None
+
+    def testDisabled( self ):
+        self.profiler.setEnabled( False )
+        self.profiler.record( "timer", "onTick", 0.001 )
+        self.failUnlessEqual( self.profiler.getStats(), [] )
+        self.failUnlessEqual( self.profiler.getSummary()["recorded"], 0 )
+
+    def testStats( self ):
+        self.profiler.record( "timer", "onTick", 0.001 )
+        self.profiler.record( "timer", "onTick", 0.003 )
+        self.profiler.record( "key", "onKey", 0.0001 )
+        stats = self.profiler.getStats()
+        self.failUnlessEqual(
+            [ ( s["eventType"], s["responder"], s["count"] ) for s in stats ],
+            [ ( "timer", "onTick", 2 ), ( "key", "onKey", 1 ) ]
+            )
+        self.failUnlessAlmostEqual( stats[0]["meanMs"], 2.0 )
+        self.failUnlessEqual( sum( stats[0]["histogram"] ), 2 )
+        self.failUnlessEqual(
+            [ s["responder"] for s in self.profiler.getStats( "key" ) ],
+            [ "onKey" ]
+            )
+
+    def testRingBuffer( self ):
+        for i in range( 10 ):
+            self.profiler.record( "timer", "onTick", i / 1000.0 )
+        stats = self.profiler.getStats()[0]
+        self.failUnlessEqual( ( stats["count"], stats["totalCount"] ),
+                              ( 4, 10 ) )
+        self.failUnlessEqual(
+            [ round( ms ) for when, eventType, responder, ms
+              in self.profiler.getSlowestCalls( 2 ) ],
+            [ 9.0, 8.0 ]
+            )
+
+    def testClear( self ):
+        self.profiler.record( "timer", "onTick", 0.001 )
+        self.profiler.clear()
+        self.failUnlessEqual( self.profiler.getStats(), [] )
+
+    def testResponderName( self ):
+        self.failUnlessEqual(
+            eventprofiler.getResponderName( self.setUp ),
+            "EventProfilerTests.setUp"
+            )
+
+
+# ----------------------------------------------------------------------------
+# Script
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
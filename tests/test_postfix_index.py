@@ -0,0 +1,181 @@
+"""
+    Tests for the postfix search index used by command factories.
+"""
+
+# ----------------------------------------------------------------------------
+# Imports
+# ----------------------------------------------------------------------------
+
+import unittest
+
+from enso.commands import postfixindex
+from enso.commands import suggestions
+from enso.commands.factories import GenericPrefixFactory
+from enso.commands.postfixindex import PostfixIndex
+
+
+# ----------------------------------------------------------------------------
+# Unit Tests
+# ----------------------------------------------------------------------------
+
+class PostfixIndexTests( unittest.TestCase ):
+    POSTFIXES = [
+        u"Firefox",
+        u"foo bar",
+        u"my_fox",
+        u"gimp  2",
+        u"foo (temp)",
+        u"",
+        ]
+
+    def setUp( self ):
+        self.index = PostfixIndex( self.POSTFIXES )
+
+    def tearDown( self ):
+        self.index = None
+
+    def testSubstring( self ):
+        self.failUnlessEqual(
+            self.index.search( "fox" ),
+            [ (u"Firefox", 4), (u"my_fox", 3) ]
+            )
+        self.failUnlessEqual( self.index.search( "zz" ), [] )
+
+    def testPrefix( self ):
+        self.failUnlessEqual(
+            self.index.search( "FO", postfixindex.MATCH_PREFIX ),
+            [ (u"foo (temp)", 0), (u"foo bar", 0) ]
+            )
+
+    def testWordPrefix( self ):
+        self.failUnlessEqual(
+            self.index.search( "fox", postfixindex.MATCH_WORD_PREFIX ),
+            [ (u"my_fox", 3) ]
+            )
+
+    def testPunctuationWordBoundaries( self ):
+        index = PostfixIndex( [ u"foo (temp)", u"open @home", u"a!bang" ] )
+        for userText, expected in [ ( "te", [ (u"foo (temp)", 5) ] ),
+                                    ( "ho", [ (u"open @home", 6) ] ),
+                                    ( "ba", [ (u"a!bang", 2) ] ) ]:
+            self.failUnlessEqual(
+                index.search( userText, postfixindex.MATCH_WORD_PREFIX ),
+                expected
+                )
+
+    def testEquivalentChars( self ):
+        self.failUnlessEqual(
+            self.index.search( "9temp0" ),
+            [ (u"foo (temp)", 4) ]
+            )
+
+    def testMultipleSpaces( self ):
+        self.failUnlessEqual(
+            self.index.search( "p 2" ),
+            [ (u"gimp  2", 3) ]
+            )
+
+    def testSpans( self ):
+        for userText, expected in [ ( "p 2", [ (u"gimp  2", 3, 7) ] ),
+                                    ( "p  2", [ (u"gimp  2", 3, 7) ] ),
+                                    ( "9temp", [ (u"foo (temp)", 4, 9) ] ) ]:
+            self.failUnlessEqual( self.index.searchSpans( userText ),
+                                  expected )
+
+    def testByteStringSpans( self ):
+        index = PostfixIndex( [ "caf\xc3\xa9 bar", "x" ] )
+        postfix, start, end = index.searchSpans( "bar" )[0]
+        self.failUnlessEqual( postfix[start:end], "bar" )
+        postfix, start, end = index.searchSpans( u"\xe9 b" )[0]
+        self.failUnlessEqual( postfix[start:end], "\xc3\xa9 b" )
+
+    def testHasMatches( self ):
+        for mode in [ postfixindex.MATCH_PREFIX,
+                      postfixindex.MATCH_WORD_PREFIX,
+                      postfixindex.MATCH_SUBSTRING ]:
+            for userText in [ "", "fox", "fo", "my", "2", "zz", "(", "p 2" ]:
+                self.failUnlessEqual(
+                    self.index.hasMatches( userText, mode ),
+                    len( self.index.search( userText, mode ) ) > 0
+                    )
+        self.failIf( PostfixIndex( [ u"" ] ).hasMatches( "" ) )
+
+    def testEmptyText( self ):
+        self.failUnlessEqual(
+            [ match for match, location in self.index.search( "" ) ],
+            sorted( [ postfix for postfix in self.POSTFIXES if postfix ] )
+            )
+
+
+class FakeOpenFactory( GenericPrefixFactory ):
+    PREFIX = "open "
+
+    def update( self ):
+        pass
+
+    def _generateCommandObj( self, postfix ):
+        return None
+
+class ByteStringFactoryTests( unittest.TestCase ):
+    def testAutoComplete( self ):
+        factory = FakeOpenFactory()
+        factory.setPostfixes( [ "caf\xc3\xa9 bar" ] )
+        completion = factory.autoComplete( "open ba" )
+        self.failUnlessEqual( completion.toText(), "open caf\xc3\xa9 bar" )
+        self.failUnlessEqual( completion.getSource(), "open ba" )
+
+class FakeRecentFactory( FakeOpenFactory ):
+    """
+    Suggests only the postfixes that start with the user text.
+    """
+
+    def retrieveSuggestions( self, userText ):
+        postfix = userText[len( self.PREFIX ):]
+        return [ suggestions.Suggestion( userText, self.PREFIX + text )
+                 for text in self.getPostfixes()
+                 if text.startswith( postfix ) ]
+
+class OverriddenSuggestionsTests( unittest.TestCase ):
+    def setUp( self ):
+        self.factory = FakeRecentFactory()
+        self.factory.setPostfixes( [ u"foo bar", u"bar" ] )
+
+    def tearDown( self ):
+        self.factory = None
+
+    def testRetrieveTopSuggestions( self ):
+        top = suggestions.TopSuggestions( 5 )
+        self.factory.retrieveTopSuggestions( u"open ba", top )
+        self.failUnlessEqual( [ s.toText() for s in top.getSuggestions() ],
+                              [ u"open bar" ] )
+
+    def testHasSuggestions( self ):
+        self.failUnless( self.factory.hasSuggestions( u"open ba" ) )
+        self.failIf( self.factory.hasSuggestions( u"open oo" ) )
+
+    def testExplicitOverride( self ):
+        self.factory.SUGGESTS_POSTFIX_MATCHES = True
+        self.failUnless( self.factory.hasSuggestions( u"open oo" ) )
+
+
+class QueryCacheTests( unittest.TestCase ):
+    def testHitsAndMisses( self ):
+        cache = postfixindex.QueryCache( maxSize=2 )
+        self.failUnlessEqual( cache.getSearchKey( "Foo@" ), u"foo2" )
+        self.failUnlessEqual( cache.getSearchKey( "Foo@" ), u"foo2" )
+        stats = cache.getStats()
+        self.failUnlessEqual( ( stats["hits"], stats["misses"] ), ( 1, 1 ) )
+
+    def testBounded( self ):
+        cache = postfixindex.QueryCache( maxSize=2 )
+        for text in [ "a", "b", "c", "d", "e" ]:
+            cache.getSearchKey( text )
+        self.failUnless( cache.getStats()["size"] <= 2 )
+
+
+# ----------------------------------------------------------------------------
+# Script
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()